@@ -83,3 +83,20 @@ def no_distribute():
         return False
     else:
         return general_utils.str2bool(nd)
+
+
+def local_executor():
+    """
+    Check the `backend` parameter in the `[executor]` section of the
+    OpenQuake config file to determine if the tasks of a calculation are run
+    by a pool of processes on the control node instead of being distributed
+    to the celery workers.
+
+    :returns:
+        `True` if the backend is "multiprocessing", `False` otherwise (the
+        default backend is "celery").
+    """
+    # imported here, since the config module imports this package
+    from openquake.engine.utils import config
+
+    return config.get('executor', 'backend') == 'multiprocessing'
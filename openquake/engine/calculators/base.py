@@ -16,17 +16,53 @@
 
 """Base code for calculator classes."""
 
+import importlib
+import logging
+import math
+import multiprocessing
+import os
+import Queue
+import socket
+import time
+
 import kombu
+import numpy
+
+from django.db import connections
 
 import openquake.engine
 
 from openquake.engine import logs
+from openquake.engine import signalling
 from openquake.engine.utils import config
+from openquake.engine.utils import monitor
+from openquake.engine.utils import tasks as utils_tasks
 
 # Routing key format string for communication between tasks and the control
 # node.
 ROUTING_KEY_FMT = 'oq.job.%(job_id)s.tasks'
 
+#: The executor running the tasks of the current calculation, when the tasks
+#: are run by a pool of processes on the control node (see
+#: :class:`LocalExecutor`)
+_LOCAL_EXECUTOR = None
+
+#: The :class:`TaskTracker` of the tasks of the current calculation
+_TASK_TRACKER = None
+
+#: In the processes of a :class:`LocalExecutor`, the queue where the tasks
+#: put their completion messages
+_LOCAL_SIGNAL_QUEUE = None
+
+#: In the processes of a :class:`LocalExecutor`, the log handlers inherited
+#: from the control node; they are replaced, but kept alive, so that their
+#: broker connection is never closed by the children
+_INHERITED_LOG_HANDLERS = []
+
+#: The producer of the completion messages of this process and the ID of the
+#: process which created it, see :func:`_signal_producer`
+_SIGNAL_PRODUCER = dict(pid=None, producer=None, publish=None)
+
 
 class CalculatorNext(object):
     """
@@ -39,10 +75,17 @@ class CalculatorNext(object):
     #: generated by :func:`task_arg_gen`.
     core_calc_task = None
 
+    #: If true, the tasks running far longer than the others are dispatched
+    #: again, and the first copy to complete is taken (see
+    #: :class:`TaskTracker`); this requires the tasks to be idempotent.
+    speculative_execution = False
+
     def __init__(self, job):
         self.job = job
 
         self.progress = dict(total=0, computed=0, in_queue=0)
+        # the :class:`TaskWindow` of the `execute` phase
+        self.window = None
 
     def task_arg_gen(self, block_size):
         """
@@ -115,14 +158,22 @@ class CalculatorNext(object):
             logs.log_percent_complete(job_id, "hazard")
             logs.log_percent_complete(job_id, "risk")
 
-            # Once we receive a completion signal, enqueue the next
-            # piece of work (if there's anything left to be done).
-            try:
-                queue_next(self.core_calc_task, task_arg_gen.next())
-            except StopIteration:
-                # There are no more tasks to dispatch; now we just need
-                # to wait until all tasks signal completion.
+            if self.window is not None:
+                self.window.task_done(body.get('duration'))
+
+            if (self.window is not None
+                    and self.progress['in_queue'] > self.window.size()):
+                # The window has shrunk: do not replace this task.
                 self.progress['in_queue'] -= 1
+            else:
+                # Once we receive a completion signal, enqueue the next
+                # piece of work (if there's anything left to be done).
+                try:
+                    queue_next(self.core_calc_task, task_arg_gen.next())
+                except StopIteration:
+                    # There are no more tasks to dispatch; now we just need
+                    # to wait until all tasks signal completion.
+                    self.progress['in_queue'] -= 1
 
             message.ack()
             logs.LOG.info('A task was completed. Tasks now in queue: %s'
@@ -155,13 +206,24 @@ class CalculatorNext(object):
 
         The general workflow is as follows:
 
-        1. Fill the queue with an initial set of tasks. The number of initial
-        tasks is configurable using the `concurrent_tasks` parameter in the
-        `[hazard]` section of the OpenQuake config file.
+        1. Fill the queue with an initial set of tasks. The number of tasks
+        in queue is given by a :class:`TaskWindow`, which adapts it to the
+        number of workers and to the duration of the tasks; it never exceeds
+        the `concurrent_tasks` parameter in the `[hazard]` (or `[risk]`)
+        section of the OpenQuake config file.
 
         2. Wait for tasks to signal completion (via AMQP message) and enqueue a
-        new task each time another completes. Once all of the job work is
-        enqueued, we just wait until all of the tasks conclude.
+        new task each time another completes; all the completion messages
+        received at once are handled before the window is filled up again.
+        Once all of the job work is enqueued, we just wait until all of the
+        tasks conclude.
+
+        The tasks are run by the executor selected with the `backend`
+        parameter in the `[executor]` section of the OpenQuake config file,
+        see :func:`get_executor`. The tasks are tracked by a
+        :class:`TaskTracker`, so that the duplicated completion messages are
+        ignored and, if :attr:`speculative_execution` is set, the stragglers
+        are dispatched again.
         """
         if openquake.engine.no_distribute():
             logs.LOG.warn('Calculation task distribution is disabled')
@@ -171,45 +233,73 @@ class CalculatorNext(object):
         # `self.progress['total']`, `execute` can conclude.
 
         task_gen = self.task_arg_gen(self.block_size())
-        exchange, conn_args = exchange_and_conn_args()
+        callback = self.get_task_complete_callback(
+            task_gen, self.block_size(), self.concurrent_tasks())
 
-        routing_key = ROUTING_KEY_FMT % dict(job_id=self.job.id)
-        task_signal_queue = kombu.Queue(
-            'tasks.job.%s' % self.job.id, exchange=exchange,
-            routing_key=routing_key, durable=False, auto_delete=True)
+        tracker = TaskTracker()
+
+        def tracked_callback(body, message):
+            """
+            Pass the first completion message of each task to `callback`.
+            """
+            if tracker.completed(body):
+                callback(body, message)
+            else:
+                logs.LOG.info('Ignoring the duplicated completion of task %s'
+                              % body['task_no'])
+                message.ack()
+
+        if self.speculative_execution:
+            timeout = TaskTracker.CHECK_INTERVAL
+        else:
+            timeout = None
+
+        with tracker, get_executor(self.job.id, tracked_callback) as executor:
+            self.window = TaskWindow(
+                self.concurrent_tasks(), executor.num_workers)
+            # First: Queue up the initial tasks.
+            self.fill_window(task_gen)
+
+            logs.LOG.info('Tasks now in queue: %s'
+                          % self.progress['in_queue'])
 
-        with kombu.BrokerConnection(**conn_args) as conn:
-            task_signal_queue(conn.channel()).declare()
-            with conn.Consumer(
-                task_signal_queue,
-                callbacks=[self.get_task_complete_callback(
-                    task_gen, self.block_size(), self.concurrent_tasks())]):
-
-                # First: Queue up the initial tasks.
-                for _ in xrange(self.concurrent_tasks()):
-                    try:
-                        queue_next(self.core_calc_task, task_gen.next())
-                    except StopIteration:
-                        # If we get a `StopIteration` here, that means we have
-                        # a number of tasks < concurrent_tasks.
-                        # This basically just means that we could be
-                        # under-utilizing worker node resources.
-                        break
-                    else:
-                        self.progress['in_queue'] += 1
-
-                logs.LOG.info('Tasks now in queue: %s'
-                              % self.progress['in_queue'])
-
-                while (self.progress['computed'] < self.progress['total']):
-                    # This blocks until a message is received.
-                    # Once we receive a completion signal, enqueue the next
-                    # piece of work (if there's anything left to be done).
-                    # (The `task_complete_callback` will handle additional
-                    # queuing.)
-                    conn.drain_events()
+            while (self.progress['computed'] < self.progress['total']):
+                # This blocks until at least a message is received (or,
+                # with the speculative execution, until the timeout).
+                # Once we receive a completion signal, enqueue the next
+                # piece of work (if there's anything left to be done).
+                # (The `task_complete_callback` will handle additional
+                # queuing.)
+                executor.wait(timeout)
+                if self.speculative_execution:
+                    for task_no, task_func, task_args in tracker.stragglers():
+                        logs.LOG.warn('Task %s is late, dispatching it again'
+                                      % task_no)
+                        queue_next(task_func, task_args, task_no)
+                # the window may have grown in the meantime
+                self.fill_window(task_gen)
         logs.LOG.progress("calculation 100% complete")
 
+    def fill_window(self, task_gen):
+        """
+        Enqueue new tasks until the number of tasks in queue reaches the size
+        of the :class:`TaskWindow`, or there are no more tasks.
+
+        :param task_gen:
+            The task arg generator.
+        """
+        while self.progress['in_queue'] < self.window.size():
+            try:
+                queue_next(self.core_calc_task, task_gen.next())
+            except StopIteration:
+                # If we get a `StopIteration` here, that means we have
+                # a number of tasks < the size of the window.
+                # This basically just means that we could be
+                # under-utilizing worker node resources.
+                break
+            else:
+                self.progress['in_queue'] += 1
+
     def post_execute(self):
         """
         Override this method in subclasses to any necessary post-execution
@@ -250,23 +340,509 @@ def exchange_and_conn_args():
     return exchange, conn_args
 
 
-def queue_next(task_func, task_args):
+class TaskWindow(object):
+    """
+    The number of tasks to keep in queue during the `execute` phase of a
+    calculation. Each worker process should have a task running and enough
+    tasks waiting, so that it is still busy when the control node replaces
+    the task which just completed; on the other hand, each task in queue
+    holds its arguments (and its results, until they are collected) in
+    memory, so the queue must not be longer than needed.
+
+    The size of the window is the number of live worker processes times
+    one plus the number of tasks a worker can complete while the control
+    node handles a completion message, which is estimated from the moving
+    average of the durations of the tasks. It is capped by the
+    `concurrent_tasks` parameter of the OpenQuake config file.
+
+    :param int max_tasks:
+        The maximum number of tasks in queue.
+    :param count_workers:
+        A function returning the number of live worker processes, see
+        :meth:`CeleryExecutor.num_workers`; it is called again every
+        :attr:`REFRESH_INTERVAL` seconds.
+    """
+
+    #: Seconds between two counts of the live worker processes
+    REFRESH_INTERVAL = 60
+
+    #: Seconds needed by the control node to replace a completed task
+    DISPATCH_LATENCY = 1.
+
+    #: Weight of the duration of the last completed task in the moving
+    #: average of the durations
+    SMOOTHING = 0.2
+
+    def __init__(self, max_tasks, count_workers):
+        self.max_tasks = max_tasks
+        self.count_workers = count_workers
+        self.num_workers = None
+        self.counted = None
+        self.mean_duration = None
+
+    def task_done(self, duration):
+        """
+        Record the duration of a completed task.
+
+        :param float duration:
+            The seconds needed by the task, or `None` if unknown.
+        """
+        if duration is None:
+            return
+        if self.mean_duration is None:
+            self.mean_duration = duration
+        else:
+            self.mean_duration += self.SMOOTHING * (
+                duration - self.mean_duration)
+
+    def size(self):
+        """
+        :returns:
+            The number of tasks which should be in queue.
+        """
+        now = time.time()
+        if self.counted is None or now - self.counted > self.REFRESH_INTERVAL:
+            self.num_workers = self.count_workers()
+            self.counted = now
+
+        if not self.num_workers:
+            # no worker found, fall back to the configured value
+            return self.max_tasks
+
+        if self.mean_duration is None:
+            # a task running and a task waiting for each worker
+            depth = 2
+        else:
+            depth = 1 + int(math.ceil(
+                self.DISPATCH_LATENCY / max(self.mean_duration, 0.001)))
+        return max(1, min(self.max_tasks, self.num_workers * depth))
+
+
+class TaskTracker(object):
+    """
+    Keep track of the tasks dispatched by the control node, which are
+    numbered by :func:`queue_next`; the tasks send back their number in
+    their completion message (see :func:`signal_task_complete`).
+
+    This allows to spot the stragglers, i.e. the tasks still running long
+    after the others have completed (for instance because their node is
+    overloaded), and to recognize the duplicated completion messages of the
+    tasks dispatched twice.
+
+    When used as a context manager, the tracker is the one of
+    :func:`queue_next`.
+    """
+
+    #: Seconds between two searches for stragglers
+    CHECK_INTERVAL = 10
+
+    #: A task is a straggler if it is running for this number of times the
+    #: median duration of the completed tasks (including their time in
+    #: queue)
+    SLOWDOWN_FACTOR = 3
+
+    #: Minimum number of completed tasks needed to look for stragglers
+    MIN_COMPLETED = 5
+
+    def __init__(self):
+        self.num_tasks = 0
+        # task number -> [task function, task args, dispatch time, flag
+        # set when the task is dispatched again]
+        self.running = {}
+        self.completed_tasks = set()
+        self.durations = []
+
+    def __enter__(self):
+        global _TASK_TRACKER  # pylint: disable=W0603
+        _TASK_TRACKER = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _TASK_TRACKER  # pylint: disable=W0603
+        _TASK_TRACKER = None
+
+    def dispatched(self, task_func, task_args):
+        """
+        Record a new task.
+
+        :param task_func:
+            A Celery task function.
+        :param task_args:
+            A set of arguments which match the specified ``task_func``.
+        :returns:
+            The number of the task.
+        """
+        self.num_tasks += 1
+        self.running[self.num_tasks] = [
+            task_func, task_args, time.time(), False]
+        return self.num_tasks
+
+    def completed(self, body):
+        """
+        Record the completion of a task.
+
+        :param dict body:
+            The completion message of the task.
+        :returns:
+            `False` if the task already completed, i.e. if this is the
+            message of a copy of the task, `True` otherwise.
+        """
+        task_no = body.get('task_no')
+        if task_no is None:
+            # the task is not tracked
+            return True
+        if task_no in self.completed_tasks:
+            return False
+        self.completed_tasks.add(task_no)
+        task = self.running.pop(task_no, None)
+        if task is not None:
+            self.durations.append(time.time() - task[2])
+        return True
+
+    def stragglers(self):
+        """
+        Find the tasks running for more than :attr:`SLOWDOWN_FACTOR` times
+        the median duration of the completed tasks, which have not been
+        dispatched again yet.
+
+        :returns:
+            A list of triples (task number, task function, task args); the
+            tasks are marked as dispatched again.
+        """
+        if len(self.durations) < self.MIN_COMPLETED:
+            return []
+        threshold = max(self.SLOWDOWN_FACTOR * numpy.median(self.durations),
+                        self.CHECK_INTERVAL)
+        now = time.time()
+        stragglers = []
+        for task_no, task in sorted(self.running.iteritems()):
+            task_func, task_args, dispatched, again = task
+            if not again and now - dispatched > threshold:
+                task[3] = True
+                stragglers.append((task_no, task_func, task_args))
+        return stragglers
+
+
+class CeleryExecutor(object):
+    """
+    Executor distributing the tasks to the celery workers. The tasks signal
+    their completion with a message to the `task_exchange` of the AMQP
+    broker, see :func:`signal_task_complete`.
+
+    If the distribution is disabled with the `OQ_NO_DISTRIBUTE` environment
+    variable, the tasks are run in the control process, when enqueued.
+
+    :param int job_id:
+        The ID of the :class:`openquake.engine.db.models.OqJob` whose tasks
+        are executed.
+    :param callback:
+        The function called with the body of each completion message and
+        the message itself, see
+        :meth:`CalculatorNext.get_task_complete_callback`.
+    """
+
+    #: Seconds to wait for further completion messages, once one has been
+    #: received
+    DRAIN_TIMEOUT = 0.01
+
+    def __init__(self, job_id, callback):
+        self.job_id = job_id
+        self.callback = callback
+        self.conn = None
+        self.consumer = None
+
+    def __enter__(self):
+        exchange, conn_args = exchange_and_conn_args()
+
+        routing_key = ROUTING_KEY_FMT % dict(job_id=self.job_id)
+        task_signal_queue = kombu.Queue(
+            'tasks.job.%s' % self.job_id, exchange=exchange,
+            routing_key=routing_key, durable=False, auto_delete=True)
+
+        self.conn = kombu.BrokerConnection(**conn_args)
+        task_signal_queue(self.conn.channel()).declare()
+        self.consumer = self.conn.Consumer(
+            task_signal_queue, callbacks=[self.callback])
+        self.consumer.consume()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.consumer.cancel()
+        self.conn.release()
+
+    @staticmethod
+    def submit(task_func, task_args, task_kwargs=None):
+        """
+        Enqueue a task.
+
+        :param task_func:
+            A Celery task function.
+        :param task_args:
+            A set of arguments which match the specified ``task_func``.
+        :param dict task_kwargs:
+            The keyword arguments of the task, if any.
+        """
+        if openquake.engine.no_distribute():
+            task_func(*task_args, **(task_kwargs or {}))
+        else:
+            task_func.apply_async(task_args, task_kwargs)
+
+    def wait(self, timeout=None):
+        """
+        Block until a completion message is received and pass it to the
+        callback, together with all the other messages already received.
+
+        :param float timeout:
+            If given, the seconds after which to return anyway.
+        """
+        try:
+            self.conn.drain_events(timeout=timeout)
+        except socket.timeout:
+            return
+        while True:
+            try:
+                self.conn.drain_events(timeout=self.DRAIN_TIMEOUT)
+            except socket.timeout:
+                return
+
+    @staticmethod
+    def num_workers():
+        """
+        :returns:
+            The number of worker processes of the live compute nodes. Each
+            node is assumed to have the number of processes given by the
+            `worker_processes` parameter in the `[executor]` section of the
+            OpenQuake config file, by default the number of cores of the
+            control node.
+        """
+        if openquake.engine.no_distribute():
+            return 1
+        worker_processes = config.get('executor', 'worker_processes')
+        return len(monitor._live_cnode_status()) * (
+            int(worker_processes) if worker_processes
+            else multiprocessing.cpu_count())
+
+
+class _AckedMessage(object):
+    """
+    A completion message which does not need to be acknowledged, because it
+    was received from a process of a :class:`LocalExecutor`. The callbacks
+    expect the same interface of the AMQP messages.
+    """
+
+    def ack(self):
+        """Do nothing, the message is already removed from the queue."""
+
+
+def _init_local_worker(signal_queue):
+    """
+    Initialize a process of a :class:`LocalExecutor`: the completion
+    messages of the tasks are put in `signal_queue`, and the log handlers
+    get their own broker connection.
+    """
+    global _LOCAL_SIGNAL_QUEUE  # pylint: disable=W0603
+    _LOCAL_SIGNAL_QUEUE = signal_queue
+
+    for handler in logging.root.handlers[:]:
+        if isinstance(handler, logs.AMQPHandler):
+            _INHERITED_LOG_HANDLERS.append(handler)
+            logging.root.removeHandler(handler)
+            logging.root.addHandler(logs.AMQPHandler(handler.level))
+
+
+def _run_local_task(task_name, task_args, task_kwargs):
+    """
+    Run a task in a process of a :class:`LocalExecutor`.
+
+    :param str task_name:
+        The full dotted name of the task, see :func:`_task_name`
+    :param task_args:
+        The arguments of the task
+    :param dict task_kwargs:
+        The keyword arguments of the task
+    """
+    module_name, func_name = task_name.rsplit('.', 1)
+    task_func = getattr(importlib.import_module(module_name), func_name)
+    task_func(*task_args, **task_kwargs)
+
+
+def _task_name(task_func):
+    """
+    :returns:
+        the full dotted name of a task function, which can be imported by
+        the processes of a :class:`LocalExecutor`
+    """
+    # the celery tasks have a name, which is their full dotted name
+    name = getattr(task_func, 'name', None)
+    return name or '%s.%s' % (task_func.__module__, task_func.__name__)
+
+
+class LocalExecutor(object):
+    """
+    Executor running the tasks in a pool of processes on the control node,
+    so that a single machine can use all of its cores without celery. The
+    tasks signal their completion by putting their message in a
+    multiprocessing queue, which is consumed by the control node, instead
+    of sending it to the AMQP broker.
+
+    :param int job_id:
+        The ID of the :class:`openquake.engine.db.models.OqJob` whose tasks
+        are executed.
+    :param callback:
+        The function called with the body of each completion message and
+        the message itself, see
+        :meth:`CalculatorNext.get_task_complete_callback`.
+    :param int num_processes:
+        The number of processes of the pool; by default, the number of
+        cores.
+    """
+
+    #: Seconds to wait for a completion message before checking if any task
+    #: failed
+    POLL_INTERVAL = 1
+
+    def __init__(self, job_id, callback, num_processes=None):
+        self.job_id = job_id
+        self.callback = callback
+        self.num_processes = num_processes
+        self.signal_queue = None
+        self.pool = None
+        self.results = []
+
+    def __enter__(self):
+        global _LOCAL_EXECUTOR  # pylint: disable=W0603
+
+        # the forked processes must open their own database connections
+        for conn in connections.all():
+            conn.close()
+
+        self.signal_queue = multiprocessing.Queue()
+        self.pool = multiprocessing.Pool(
+            self.num_processes, _init_local_worker, (self.signal_queue,))
+        _LOCAL_EXECUTOR = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _LOCAL_EXECUTOR  # pylint: disable=W0603
+        _LOCAL_EXECUTOR = None
+
+        if exc_info[0] is None:
+            self.pool.close()
+        else:
+            self.pool.terminate()
+        self.pool.join()
+
+    def submit(self, task_func, task_args, task_kwargs=None):
+        """
+        Run a task in the pool.
+
+        :param task_func:
+            A task function, defined at the module level.
+        :param task_args:
+            A set of arguments which match the specified ``task_func``.
+        :param dict task_kwargs:
+            The keyword arguments of the task, if any.
+        """
+        self.results.append(self.pool.apply_async(
+            _run_local_task, (_task_name(task_func), tuple(task_args),
+                              task_kwargs or {})))
+
+    def wait(self, timeout=None):
+        """
+        Block until a completion message is received and pass it to the
+        callback, together with all the other messages already in the queue.
+
+        :param float timeout:
+            If given, the seconds after which to return anyway.
+        :raises:
+            the exception raised by a task, if any task failed
+        """
+        started = time.time()
+        while True:
+            # the failures are checked on each iteration, so that they stop
+            # the job even while the other tasks keep signalling
+            self._check_results()
+            try:
+                body = self.signal_queue.get(timeout=self.POLL_INTERVAL)
+            except Queue.Empty:
+                if timeout is not None and time.time() - started >= timeout:
+                    return
+            else:
+                break
+        while True:
+            self.callback(body, _AckedMessage())
+            try:
+                body = self.signal_queue.get_nowait()
+            except Queue.Empty:
+                return
+
+    def num_workers(self):
+        """
+        :returns:
+            The number of processes of the pool.
+        """
+        return self.num_processes or multiprocessing.cpu_count()
+
+    def _check_results(self):
+        """
+        Forget the results of the tasks which are done, re-raising the
+        exception of the ones which failed.
+        """
+        pending = []
+        for result in self.results:
+            if result.ready():
+                # re-raise the exception of the task, if any
+                result.get()
+            else:
+                pending.append(result)
+        self.results = pending
+
+
+def get_executor(job_id, callback):
+    """
+    :param int job_id:
+        The ID of the :class:`openquake.engine.db.models.OqJob` whose tasks
+        are executed.
+    :param callback:
+        The function called with the body of each completion message and
+        the message itself.
+    :returns:
+        A :class:`LocalExecutor` if the `backend` parameter in the
+        `[executor]` section of the OpenQuake config file is
+        `multiprocessing`, otherwise a :class:`CeleryExecutor`.
+    """
+    if openquake.engine.local_executor():
+        num_processes = config.get('executor', 'num_processes')
+        return LocalExecutor(
+            job_id, callback, int(num_processes) if num_processes else None)
+    return CeleryExecutor(job_id, callback)
+
+
+def queue_next(task_func, task_args, task_no=None):
     """
     :param task_func:
         A Celery task function, to be enqueued with the next set of args in
         ``task_arg_gen``.
     :param task_args:
         A set of arguments which match the specified ``task_func``.
+    :param int task_no:
+        The number of a task dispatched again, see :class:`TaskTracker`; by
+        default, the task is a new one, numbered by the active tracker (if
+        any).
 
     .. note::
         This utility function was added to make for easier mocking and testing
         of the "plumbing" which handles task queuing (such as the various "task
         complete" callback functions).
     """
-    if openquake.engine.no_distribute():
-        task_func(*task_args)
+    if task_no is None and _TASK_TRACKER is not None:
+        task_no = _TASK_TRACKER.dispatched(task_func, task_args)
+    task_kwargs = None if task_no is None else dict(task_no=task_no)
+
+    if _LOCAL_EXECUTOR is not None:
+        _LOCAL_EXECUTOR.submit(task_func, task_args, task_kwargs)
     else:
-        task_func.apply_async(task_args)
+        CeleryExecutor.submit(task_func, task_args, task_kwargs)
 
 
 def signal_task_complete(**kwargs):
@@ -287,16 +863,57 @@ def signal_task_complete(**kwargs):
         .. note::
             `job_id` is required for routing the message. All other parameters
             can be treated as optional.
+
+        When called by an :func:`openquake.engine.utils.tasks.oqtask`, the
+        seconds elapsed since the start of the task are added as `duration`
+        and, if the task was numbered by a :class:`TaskTracker`, its number
+        as `task_no`.
     """
     msg = kwargs
+    duration = utils_tasks.task_duration()
+    if duration is not None:
+        # used by the control node to size its `TaskWindow`
+        msg = dict(msg, duration=duration)
+    task_no = utils_tasks.current_task_no()
+    if task_no is not None:
+        # used by the control node to spot the duplicated messages
+        msg = dict(msg, task_no=task_no)
+
+    if _LOCAL_SIGNAL_QUEUE is not None:
+        # the task is running in a process of a `LocalExecutor`
+        _LOCAL_SIGNAL_QUEUE.put(msg)
+        return
+
     # here we make the assumption that the job_id is in the message kwargs
     job_id = kwargs['job_id']
 
-    exchange, conn_args = exchange_and_conn_args()
+    # the message is published on the long-lived connection of the process;
+    # if the broker is not reachable, the publication is retried until it
+    # is, since the control node would wait forever for a lost message.
+    # The messages are not batched: a worker process runs a single task at
+    # a time (see CELERYD_PREFETCH_MULTIPLIER in celeryconfig.py) and sends
+    # a single message at its end, so there is never a second message to
+    # send with it. The bursts of messages from different processes are
+    # handled together by the control node, see `CeleryExecutor.wait`
+    _signal_producer()(msg, routing_key=ROUTING_KEY_FMT % dict(job_id=job_id))
 
-    routing_key = ROUTING_KEY_FMT % dict(job_id=job_id)
 
-    with kombu.BrokerConnection(**conn_args) as conn, conn.Producer(
-            exchange=exchange, routing_key=routing_key,
-            serializer='pickle') as producer:
-        producer.publish(msg)
+def _signal_producer():
+    """
+    :returns:
+        the `publish` function of the producer of the completion messages
+        of this process, on the connection returned by
+        :func:`openquake.engine.signalling.shared_connection`, which
+        reconnects to the broker until the message is published; the
+        producer is created at the first call in each process
+    """
+    pid = os.getpid()
+    if _SIGNAL_PRODUCER['pid'] != pid:
+        exchange, _ = exchange_and_conn_args()
+        conn = signalling.shared_connection()
+        producer = conn.Producer(exchange=exchange, serializer='pickle')
+        _SIGNAL_PRODUCER.update(
+            pid=pid, producer=producer,
+            publish=signalling.ensure_publish(
+                conn, producer, max_retries=None))
+    return _SIGNAL_PRODUCER['publish']
@@ -17,11 +17,15 @@
 Core functionality for the classical PSHA hazard calculator.
 """
 
+import numpy
+
 import openquake.hazardlib
 import openquake.hazardlib.calc
 import openquake.hazardlib.imt
 
 from django.db import transaction
+from openquake.hazardlib.calc import filters
+from openquake.hazardlib.tom import PoissonTOM
 
 from openquake.engine import logs
 from openquake.engine.calculators import base
@@ -33,10 +37,11 @@ from openquake.engine.calculators.post_processing import (
 )
 from openquake.engine.db import models
 from openquake.engine.input import logictree
+from openquake.engine.utils import config
 from openquake.engine.utils import stats
 from openquake.engine.utils import tasks as utils_tasks
 from openquake.engine.utils.general import block_splitter
-from openquake.engine.writer import BulkInserter
+from openquake.engine.writer import CopyBulkInserter
 
 #: Maximum number of hazard curves to cache, for selects or inserts
 _CURVE_CACHE_SIZE = 100000
@@ -44,25 +49,71 @@ _CURVE_CACHE_SIZE = 100000
 
 @utils_tasks.oqtask
 @stats.count_progress('h')
-def hazard_curves(job_id, src_ids, lt_rlz_id):
+def hazard_curves(job_id, src_ids, lt_rlz_id, tile=None):
     """
     A celery task wrapper function around :func:`compute_hazard_curves`.
     See :func:`compute_hazard_curves` for parameter definitions.
+
+    When `lt_rlz_id` is a list, the `lt_rlz_id` and the `matrices` of the
+    completion message are lists too, with an item per realization.
     """
     logs.LOG.debug('> starting task: job_id=%s, lt_realization_id=%s'
                    % (job_id, lt_rlz_id))
 
-    compute_hazard_curves(job_id, src_ids, lt_rlz_id)
+    matrices = compute_hazard_curves(
+        job_id, src_ids, lt_rlz_id, tile,
+        reduce_on_control_node=config.flag_set(
+            'hazard', 'control_node_reduction'),
+        speculative=ClassicalHazardCalculator.speculative_execution)
     # Last thing, signal back the control node to indicate the completion of
     # task. The control node needs this to manage the task distribution and
     # keep track of progress.
     logs.LOG.debug('< task complete, signalling completion')
-    base.signal_task_complete(job_id=job_id, num_items=len(src_ids))
+    # the sources are computed for each realization
+    num_items = len(src_ids) * (
+        len(lt_rlz_id) if isinstance(lt_rlz_id, list) else 1)
+    if matrices is None:
+        base.signal_task_complete(job_id=job_id, num_items=num_items)
+    else:
+        # the partial hazard curves are reduced by the control node, see
+        # :meth:`ClassicalHazardCalculator.task_completed_hook`
+        base.signal_task_complete(job_id=job_id, num_items=num_items,
+                                  lt_rlz_id=lt_rlz_id,
+                                  site_offset=_site_offset(tile),
+                                  matrices=matrices)
+
+
+def _site_offset(tile):
+    """
+    :returns:
+        the index of the first site of the `tile` slice, or 0 if the task
+        computes all the sites
+    """
+    return 0 if tile is None else tile.start
+
+
+def site_tiles(num_sites):
+    """
+    Split the sites of a calculation in tiles of `site_tile_size` sites,
+    as set in the `[hazard]` section of the OpenQuake config file. If the
+    parameter is not set, there is a single tile with all the sites.
+
+    :param int num_sites:
+        the number of sites of the calculation
+    :returns:
+        a list of `slice` objects
+    """
+    tile_size = int(config.get('hazard', 'site_tile_size') or 0)
+    if tile_size <= 0:
+        tile_size = num_sites
+    return [slice(start, min(start + tile_size, num_sites))
+            for start in xrange(0, num_sites, tile_size)]
 
 
 # Silencing 'Too many local variables'
 # pylint: disable=R0914
-def compute_hazard_curves(job_id, src_ids, lt_rlz_id):
+def compute_hazard_curves(job_id, src_ids, lt_rlz_id, tile=None,
+                          reduce_on_control_node=False, speculative=False):
     """
     Celery task for hazard curve calculator.
 
@@ -71,7 +122,9 @@ def compute_hazard_curves(job_id, src_ids, lt_rlz_id):
 
     Once hazard curve data is computed, result progress updated (within a
     transaction, to prevent race conditions) in the
-    `htemp.hazard_curve_progress` table.
+    `htemp.hazard_curve_progress` table. If `reduce_on_control_node` is
+    true, the partial results are returned instead, to be combined by the
+    control node.
 
     Once all of this work is complete, a signal will be sent via AMQP to let
     the control node know that the work is complete. (If there is any work left
@@ -83,16 +136,43 @@ def compute_hazard_curves(job_id, src_ids, lt_rlz_id):
     :param src_ids:
         List of ids of parsed source models to take into account.
     :param lt_rlz_id:
-        Id of logic tree realization model to calculate for.
+        Id of logic tree realization model to calculate for, or a list of
+        ids of realizations with the same source model logic tree path,
+        whose ruptures are then generated only once (see
+        :func:`hazard_curves_multi_gsims`).
+    :param tile:
+        The `slice` of the site collection to compute, see
+        :func:`site_tiles`, or `None` to compute all the sites.
+    :param bool reduce_on_control_node:
+        If true, return the partial results instead of saving them. Only
+        the calculators combining the returned results (see
+        :meth:`ClassicalHazardCalculator.task_completed_hook`) can set it.
+    :param bool speculative:
+        If true, the task may be dispatched more than once (see
+        :attr:`~openquake.engine.calculators.base.CalculatorNext.\
+speculative_execution`), and the results of the copies completing after
+        the first one are discarded (see :func:`_claim_source_progress`).
+    :returns:
+        `None` or, when the control node reduces the results, a dict
+        mapping IMT strings to the 2D arrays (sites of the tile x IMLs) of
+        PoEs with a non-zero hazard contribution (a list of such dicts, one
+        per realization, if `lt_rlz_id` is a list).
     """
-    hc = models.HazardCalculation.objects.get(oqjob=job_id)
-
-    lt_rlz = models.LtRealization.objects.get(id=lt_rlz_id)
+    # the pickled site collection is loaded only if all the sites are needed
+    hc = models.HazardCalculation.objects.defer('_site_collection').get(
+        oqjob=job_id)
+
+    if isinstance(lt_rlz_id, list):
+        lt_rlzs = [models.LtRealization.objects.get(id=rlz_id)
+                   for rlz_id in lt_rlz_id]
+    else:
+        lt_rlzs = [models.LtRealization.objects.get(id=lt_rlz_id)]
     ltp = logictree.LogicTreeProcessor(hc.id)
 
     apply_uncertainties = ltp.parse_source_model_logictree_path(
-        lt_rlz.sm_lt_path)
-    gsims = ltp.parse_gmpe_logictree_path(lt_rlz.gsim_lt_path)
+        lt_rlzs[0].sm_lt_path)
+    gsims_list = [ltp.parse_gmpe_logictree_path(lt_rlz.gsim_lt_path)
+                  for lt_rlz in lt_rlzs]
 
     sources = haz_general.gen_sources(
         src_ids, apply_uncertainties, hc.rupture_mesh_spacing,
@@ -101,13 +181,21 @@ def compute_hazard_curves(job_id, src_ids, lt_rlz_id):
     imts = haz_general.im_dict_to_hazardlib(
         hc.intensity_measure_types_and_levels)
 
+    if tile is None:
+        sites = hc.site_collection
+    elif hc.site_collection_fingerprint is not None:
+        # a slice of the memory-mapped site collection
+        sites = haz_general.site_collection_tile(hc.site_collection, tile)
+    else:
+        # only the sites of the tile are built
+        sites = models.get_site_collection(hc, tile)
+
     # Prepare args for the calculator.
-    calc_kwargs = {'gsims': gsims,
-                   'truncation_level': hc.truncation_level,
+    calc_kwargs = {'truncation_level': hc.truncation_level,
                    'time_span': hc.investigation_time,
                    'sources': sources,
                    'imts': imts,
-                   'sites': hc.site_collection}
+                   'sites': sites}
 
     if hc.maximum_distance:
         dist = hc.maximum_distance
@@ -118,21 +206,112 @@ def compute_hazard_curves(job_id, src_ids, lt_rlz_id):
                 dist))
 
     # mapping "imt" to 2d array of hazard curves: first dimension -- sites,
-    # second -- IMLs
+    # second -- IMLs; one per realization
     logs.LOG.debug('> computing hazard matrices')
-    matrices = openquake.hazardlib.calc.hazard_curve.hazard_curves_poissonian(
-        **calc_kwargs)
+    if len(lt_rlzs) == 1:
+        [gsims] = gsims_list
+        matrices_list = [
+            openquake.hazardlib.calc.hazard_curve.hazard_curves_poissonian(
+                gsims=gsims, **calc_kwargs)]
+    else:
+        matrices_list = hazard_curves_multi_gsims(
+            gsims_list=gsims_list, **calc_kwargs)
     logs.LOG.debug('< done computing hazard matrices')
 
+    site_offset = _site_offset(tile)
+    if reduce_on_control_node:
+        partial_matrices_list = []
+        for lt_rlz, matrices in zip(lt_rlzs, matrices_list):
+            _update_source_progress(lt_rlz, src_ids, site_offset,
+                                    speculative)
+            # send back only the matrices with some hazard contribution
+            partial_matrices = {}
+            for imt in hc.intensity_measure_types_and_levels:
+                matrix = matrices[haz_general.imt_to_hazardlib(imt)]
+                if not (matrix == 0.0).all():
+                    partial_matrices[imt] = matrix
+            partial_matrices_list.append(partial_matrices)
+        if isinstance(lt_rlz_id, list):
+            return partial_matrices_list
+        return partial_matrices_list[0]
+
     logs.LOG.debug('> starting transaction')
-    _update_curves(hc, matrices, lt_rlz, src_ids)
+    for lt_rlz, matrices in zip(lt_rlzs, matrices_list):
+        _update_curves(hc, matrices, lt_rlz, src_ids, site_offset,
+                       speculative)
     logs.LOG.debug('< transaction complete')
 
 
-def _update_curves(hc, matrices, lt_rlz, src_ids):
+def hazard_curves_multi_gsims(sources, sites, imts, time_span, gsims_list,
+                              truncation_level,
+                              source_site_filter=(
+                                  filters.source_site_noop_filter),
+                              rupture_site_filter=(
+                                  filters.rupture_site_noop_filter)):
+    """
+    Compute the hazard curves of the same sources for several GSIM logic
+    tree paths. This is the same as
+    :func:`openquake.hazardlib.calc.hazard_curve.hazard_curves_poissonian`
+    called for each path, but the ruptures of the sources are generated
+    and filtered only once; the contexts of a rupture (with the distances
+    of the sites) and the probabilities of exceedance are computed only
+    once for each distinct GSIM.
+
+    :param gsims_list:
+        A list of dictionaries mapping tectonic region types to GSIMs, one
+        per GSIM logic tree path.
+
+    See :func:`~openquake.hazardlib.calc.hazard_curve.\
+hazard_curves_poissonian` for the other parameters.
+
+    :returns:
+        A list of dictionaries mapping IMTs to the 2D arrays of PoEs (sites
+        x IMLs), one per dictionary in `gsims_list`.
+    """
+    curves_list = [
+        dict((imt, numpy.ones([len(sites), len(imts[imt])])) for imt in imts)
+        for _ in gsims_list]
+    tom = PoissonTOM(time_span)
+
+    total_sites = len(sites)
+    sources_sites = ((source, sites) for source in sources)
+    for source, s_sites in source_site_filter(sources_sites):
+        ruptures_sites = ((rupture, s_sites)
+                          for rupture in source.iter_ruptures(tom))
+        for rupture, r_sites in rupture_site_filter(ruptures_sites):
+            prob = rupture.get_probability_one_or_more_occurrences()
+            # GSIM class -> IMT -> probabilities of no exceedance; the GSIMs
+            # have no parameters, so the ones of the same class are
+            # interchangeable
+            no_exceedance = {}
+            for gsims, curves in zip(gsims_list, curves_list):
+                gsim = gsims[rupture.tectonic_region_type]
+                gsim_class = gsim.__class__
+                if gsim_class not in no_exceedance:
+                    sctx, rctx, dctx = gsim.make_contexts(r_sites, rupture)
+                    no_exceedance[gsim_class] = dict(
+                        (imt, r_sites.expand(
+                            (1 - prob) ** gsim.get_poes(
+                                sctx, rctx, dctx, imt, imts[imt],
+                                truncation_level),
+                            total_sites, placeholder=1))
+                        for imt in imts)
+                for imt in imts:
+                    curves[imt] *= no_exceedance[gsim_class][imt]
+
+    for curves in curves_list:
+        for imt in imts:
+            curves[imt] = 1 - curves[imt]
+    return curves_list
+
+
+def _update_curves(hc, matrices, lt_rlz, src_ids, site_offset=0,
+                   speculative=False):
     """
     Helper function for updating source, hazard curve, and realization progress
-    records in the database.
+    records in the database, in a single transaction. With the speculative
+    execution, nothing is updated if the sources were already computed by
+    another copy of the task (see :func:`_claim_source_progress`).
 
     This is intended to be used by :func:`compute_hazard_curves`.
 
@@ -143,60 +322,127 @@ def _update_curves(hc, matrices, lt_rlz, src_ids):
         current realization.
     :param src_ids:
         List of source IDs considered for this calculation task.
+    :param int site_offset:
+        The index of the first site of the tile computed by the task.
+    :param bool speculative:
+        If true, the task may have been dispatched more than once.
     """
     with logs.tracing('_update_curves for all IMTs'):
-        for imt in hc.intensity_measure_types_and_levels.keys():
-            hazardlib_imt = haz_general.imt_to_hazardlib(imt)
-            matrix = matrices[hazardlib_imt]
-            if (matrix == 0.0).all():
-                # The matrix for this IMT is all zeros; there's no reason to
-                # update `hazard_curve_progress` records.
-                logs.LOG.debug('* No hazard contribution for IMT=%s' % imt)
-                continue
-            else:
+        with transaction.commit_on_success():
+            if not _claim_source_progress(lt_rlz, src_ids, site_offset,
+                                          speculative):
+                return
+
+            for imt in hc.intensity_measure_types_and_levels.keys():
+                hazardlib_imt = haz_general.imt_to_hazardlib(imt)
+                matrix = matrices[hazardlib_imt]
+                if (matrix == 0.0).all():
+                    # The matrix for this IMT is all zeros; there's no reason
+                    # to update `hazard_curve_progress` records.
+                    logs.LOG.debug('* No hazard contribution for IMT=%s'
+                                   % imt)
+                    continue
                 # The is some contribution here to the hazard; we need to
                 # update.
-                with transaction.commit_on_success():
-                    logs.LOG.debug('> updating hazard for IMT=%s' % imt)
-                    query = """
-                    SELECT * FROM htemp.hazard_curve_progress
-                    WHERE lt_realization_id = %s
-                    AND imt = %s
-                    FOR UPDATE"""
-                    [hc_progress] = models.HazardCurveProgress.objects.raw(
-                        query, [lt_rlz.id, imt])
-
-                    hc_progress.result_matrix = update_result_matrix(
-                        hc_progress.result_matrix, matrix)
-                    hc_progress.save()
-
-                    logs.LOG.debug('< done updating hazard for IMT=%s' % imt)
-
-        with transaction.commit_on_success():
-            # Check here if any of records in source progress model
-            # with parsed_source_id from src_ids are marked as complete,
-            # and rollback and abort if there is at least one
-            src_prog = models.SourceProgress.objects.filter(
-                lt_realization=lt_rlz, parsed_source__in=src_ids)
-
-            if any(x.is_complete for x in src_prog):
-                msg = (
-                    'One or more `source_progress` records were marked as '
-                    'complete. This was unexpected and probably means that the'
-                    ' calculation workload was not distributed properly.'
-                )
-                logs.LOG.critical(msg)
-                transaction.rollback()
-                raise RuntimeError(msg)
-
-            # Mark source_progress records as complete
-            src_prog.update(is_complete=True)
+                logs.LOG.debug('> updating hazard for IMT=%s' % imt)
+                query = """
+                SELECT * FROM htemp.hazard_curve_progress
+                WHERE lt_realization_id = %s
+                AND imt = %s
+                AND site_offset = %s
+                FOR UPDATE"""
+                [hc_progress] = models.HazardCurveProgress.objects.raw(
+                    query, [lt_rlz.id, imt, site_offset])
+
+                hc_progress.result_matrix = update_result_matrix(
+                    hc_progress.result_matrix, matrix)
+                hc_progress.save()
+
+                logs.LOG.debug('< done updating hazard for IMT=%s' % imt)
 
             # Update realiation progress,
             # mark realization as complete if it is done
             haz_general.update_realization(lt_rlz.id, len(src_ids))
 
 
+def _update_source_progress(lt_rlz, src_ids, site_offset=0,
+                            speculative=False):
+    """
+    Helper function marking the `source_progress` records of the given
+    sources as complete and updating the realization progress, unless the
+    sources were already computed by another copy of the task (only
+    possible with the speculative execution).
+
+    :param lt_rlz:
+        :class:`openquake.engine.db.models.LtRealization` record for the
+        current realization.
+    :param src_ids:
+        List of source IDs considered for this calculation task.
+    :param int site_offset:
+        The index of the first site of the tile computed by the task.
+    :param bool speculative:
+        If true, the task may have been dispatched more than once.
+    :returns:
+        `True` if the records were updated, `False` otherwise.
+    """
+    with transaction.commit_on_success():
+        if not _claim_source_progress(lt_rlz, src_ids, site_offset,
+                                      speculative):
+            return False
+
+        # Update realiation progress,
+        # mark realization as complete if it is done
+        haz_general.update_realization(lt_rlz.id, len(src_ids))
+        return True
+
+
+def _claim_source_progress(lt_rlz, src_ids, site_offset, speculative):
+    """
+    Mark the `source_progress` records of the given sources as complete.
+    This is intended to be called at the beginning of the transaction which
+    stores the results of a task: if a copy of the task (see
+    :class:`openquake.engine.calculators.base.TaskTracker`) is storing the
+    same results, the update waits for its transaction to end, and then
+    finds the records already complete.
+
+    :param lt_rlz:
+        :class:`openquake.engine.db.models.LtRealization` record for the
+        current realization.
+    :param src_ids:
+        List of source IDs considered for this calculation task.
+    :param int site_offset:
+        The index of the first site of the tile computed by the task.
+    :param bool speculative:
+        If true, the task may have been dispatched more than once, so the
+        records may all be already complete.
+    :returns:
+        `True` if the records were marked as complete, `False` if they were
+        already complete.
+    :raises RuntimeError:
+        if only some of the records were already complete, or all of them
+        and `speculative` is false
+    """
+    claimed = models.SourceProgress.objects.filter(
+        lt_realization=lt_rlz, parsed_source__in=src_ids,
+        site_offset=site_offset, is_complete=False).update(is_complete=True)
+
+    if claimed == 0 and speculative:
+        logs.LOG.info('The sources were already computed by another copy of '
+                      'the task')
+        return False
+
+    if claimed != len(src_ids):
+        msg = (
+            'One or more `source_progress` records were marked as '
+            'complete. This was unexpected and probably means that the'
+            ' calculation workload was not distributed properly.'
+        )
+        logs.LOG.critical(msg)
+        transaction.rollback()
+        raise RuntimeError(msg)
+    return True
+
+
 class ClassicalHazardCalculator(haz_general.BaseHazardCalculatorNext):
     """
     Classical PSHA hazard calculator. Computes hazard curves for a given set of
@@ -208,34 +454,157 @@ class ClassicalHazardCalculator(haz_general.BaseHazardCalculatorNext):
 
     core_calc_task = hazard_curves
 
+    # the tasks store their results only once, see _claim_source_progress
+    speculative_execution = True
+
+    # the sources far from all the sites do not contribute to the curves
+    prefilter_sources = True
+
+    def __init__(self, *args, **kwargs):
+        super(ClassicalHazardCalculator, self).__init__(*args, **kwargs)
+
+        # (lt_rlz_id, site_offset, imt) -> product of the (1 - PoEs)
+        # matrices received from the workers, when they do not update the
+        # hazard curve progress records by themselves
+        self.curves_complement = {}
+        # lt_rlz_id -> [number of sources received or filtered out, total
+        # number of sources], see initialize_rlz_items
+        self.rlz_items = {}
+
+    def task_completed_hook(self, body):
+        """
+        If the task sent back its partial hazard curves, combine them with
+        the ones already received for the same realization (or
+        realizations, see :func:`hazard_curves`), tile of sites
+        and IMT. Once
+        all the sources of a realization have been computed, its hazard
+        curves are saved with :meth:`save_hazard_curve_progress`.
+
+        :param dict body:
+            The message sent by the task, see :func:`hazard_curves`.
+        """
+        matrices = body.get('matrices')
+        if matrices is None:
+            return
+        lt_rlz_ids = body['lt_rlz_id']
+        site_offset = body.get('site_offset', 0)
+        if not isinstance(lt_rlz_ids, list):
+            lt_rlz_ids, matrices = [lt_rlz_ids], [matrices]
+        # the items are the same for each realization
+        num_items = body['num_items'] / len(lt_rlz_ids)
+
+        for lt_rlz_id, rlz_matrices in zip(lt_rlz_ids, matrices):
+            for imt, matrix in rlz_matrices.iteritems():
+                key = (lt_rlz_id, site_offset, imt)
+                if key in self.curves_complement:
+                    self.curves_complement[key] *= 1 - matrix
+                else:
+                    self.curves_complement[key] = 1 - matrix
+
+            if lt_rlz_id not in self.rlz_items:
+                total_items = models.LtRealization.objects.get(
+                    id=lt_rlz_id).total_items
+                self.rlz_items[lt_rlz_id] = [0, total_items]
+            items = self.rlz_items[lt_rlz_id]
+            items[0] += num_items
+            if items[0] == items[1]:
+                self.save_hazard_curve_progress(lt_rlz_id)
+
+    def save_hazard_curve_progress(self, lt_rlz_id=None):
+        """
+        Combine the hazard curves accumulated by the control node with the
+        ones stored in `htemp.hazard_curve_progress` and save them.
+
+        :param int lt_rlz_id:
+            The ID of the realization to save, or `None` to save all of the
+            accumulated realizations.
+        """
+        for key in sorted(self.curves_complement):
+            rlz_id, site_offset, imt = key
+            if lt_rlz_id is not None and rlz_id != lt_rlz_id:
+                continue
+            matrix = 1 - self.curves_complement.pop(key)
+            with transaction.commit_on_success():
+                logs.LOG.debug('> saving hazard for realization=%s, '
+                               'site offset=%s, IMT=%s'
+                               % (rlz_id, site_offset, imt))
+                hc_progress = models.HazardCurveProgress.objects.get(
+                    lt_realization=rlz_id, site_offset=site_offset, imt=imt)
+                hc_progress.result_matrix = update_result_matrix(
+                    hc_progress.result_matrix, matrix)
+                hc_progress.save()
+
     def task_arg_gen(self, block_size):
         """
         Loop through realizations and sources to generate a sequence of
         task arg tuples. Each tuple of args applies to a single task.
 
-        Yielded results are triples of (job_id, realization_id,
-        source_id_list).
+        Yielded results are triples of (job_id, source_id_list,
+        realization_id), followed by the tile of sites to compute when the
+        sites are split in tiles (see :meth:`site_tiles`). If the
+        `share_source_models` flag is set in the `[hazard]` section of the
+        OpenQuake config file, the realizations with the same source model
+        logic tree path are computed by the same tasks, and the
+        `realization_id` is the list of their ids.
+
+        If the `control_node_reduction` flag is set, the blocks of a
+        realization are dispatched only after the ones of the previous
+        realization, so that the control node keeps in memory the hazard
+        curves of few realizations at a time.
 
         :param int block_size:
-            The (max) number of work items for each each task. In this case,
-            sources.
+            The (average) number of work items for each each task. In this
+            case, sources. The sources are distributed to the tasks
+            according to their weight, see
+            :meth:`~openquake.engine.calculators.hazard.general.\
+BaseHazardCalculatorNext.source_blocks`.
         """
         realizations = models.LtRealization.objects.filter(
-            hazard_calculation=self.hc, is_complete=False)
-
-        for lt_rlz in realizations:
-            source_progress = models.SourceProgress.objects.filter(
-                is_complete=False, lt_realization=lt_rlz).order_by('id')
-            source_ids = source_progress.values_list('parsed_source_id',
-                                                     flat=True)
-
-            for offset in xrange(0, len(source_ids), block_size):
-                task_args = (
-                    self.job.id,
-                    source_ids[offset:offset + block_size],
-                    lt_rlz.id
-                )
-                yield task_args
+            hazard_calculation=self.hc, is_complete=False).order_by('id')
+        tiles = dict((tile.start, tile) for tile in self.site_tiles())
+
+        # realization id -> ids of the realizations computed with it
+        shared = None
+        if config.flag_set('hazard', 'share_source_models'):
+            groups = {}
+            for lt_rlz in realizations:
+                groups.setdefault(
+                    tuple(lt_rlz.sm_lt_path), []).append(lt_rlz)
+            shared = dict((group[0].id, [rlz.id for rlz in group])
+                          for group in groups.itervalues())
+            # the sources are split according to the first realization of
+            # each group
+            realizations = sorted((group[0] for group in groups.itervalues()),
+                                  key=lambda rlz: rlz.id)
+
+        # the control node keeps the hazard curves of the realizations in
+        # flight in memory, so the realizations are computed one at a time
+        reduce_on_control_node = config.flag_set(
+            'hazard', 'control_node_reduction')
+        for lt_rlz, site_offset, source_ids in self.source_blocks(
+                realizations, block_size,
+                across_realizations=not reduce_on_control_node):
+            if shared is not None and len(shared[lt_rlz.id]) > 1:
+                rlz_ids = shared[lt_rlz.id]
+            else:
+                rlz_ids = lt_rlz.id
+            task_args = (
+                self.job.id,
+                source_ids,
+                rlz_ids
+            )
+            if len(tiles) > 1:
+                task_args += (tiles[site_offset],)
+            yield task_args
+
+    def site_tiles(self):
+        """
+        Split the sites in tiles of `site_tile_size` sites, as set in the
+        `[hazard]` section of the OpenQuake config file, so that the memory
+        needed by each task and by each hazard curve progress record is
+        bounded by the size of the tiles. See :func:`site_tiles`.
+        """
+        return site_tiles(len(self.computation_mesh))
 
     def pre_execute(self):
         """
@@ -274,6 +643,20 @@ class ClassicalHazardCalculator(haz_general.BaseHazardCalculatorNext):
         self.progress['total'] = num_sources
 
         self.initialize_pr_data()
+        self.initialize_rlz_items()
+
+    def initialize_rlz_items(self):
+        """
+        Initialize the counts of the sources received by the control node
+        with the number of sources already completed by
+        :meth:`filter_source_progress`, for which no task is dispatched, so
+        that the hazard curves of a realization are saved as soon as its
+        last task is received (see :meth:`task_completed_hook`).
+        """
+        for lt_rlz in models.LtRealization.objects.filter(
+                hazard_calculation=self.hc):
+            self.rlz_items[lt_rlz.id] = [
+                lt_rlz.completed_items, lt_rlz.total_items]
 
     def post_execute(self):
         """
@@ -283,6 +666,8 @@ class ClassicalHazardCalculator(haz_general.BaseHazardCalculatorNext):
 BaseHazardCalculatorNext.finalize_hazard_curves`
         for more info.
         """
+        # save the hazard curves of the realizations still in memory, if any
+        self.save_hazard_curve_progress()
         self.finalize_hazard_curves()
 
     def clean_up(self):
@@ -375,37 +760,46 @@ BaseHazardCalculatorNext.finalize_hazard_curves`
                     )
                     container_ids['q%s' % quantile] = q_hc.id
 
-            all_curves_for_imt = models.order_by_location(
+            all_curves_for_imt = (
                 models.HazardCurveData.objects.all_curves_for_imt(
                     self.job.id, im_type, sa_period, sa_damping))
 
             with transaction.commit_on_success(using='reslt_writer'):
-                inserter = BulkInserter(models.HazardCurveData,
-                                        max_cache_size=_CURVE_CACHE_SIZE)
-
-                for chunk in models.queryset_iter(all_curves_for_imt,
-                                                  slice_incr):
-                    # slice each chunk by `num_rlzs` into `site_chunk`
-                    # and compute the aggregate
-                    for site_chunk in block_splitter(chunk, num_rlzs):
-                        site = site_chunk[0].location
-                        curves_poes = [x.poes for x in site_chunk]
-                        curves_weights = [x.weight for x in site_chunk]
-
-                        # do means and quantiles
-                        # quantiles first:
-                        if self.hc.quantile_hazard_curves:
-                            for quantile in self.hc.quantile_hazard_curves:
-                                if self.hc.number_of_logic_tree_samples == 0:
-                                    # explicitly weighted quantiles
-                                    q_curve = weighted_quantile_curve(
-                                        curves_poes, curves_weights, quantile
-                                    )
-                                else:
-                                    # implicitly weighted quantiles
-                                    q_curve = quantile_curve(
-                                        curves_poes, quantile
-                                    )
+                inserter = CopyBulkInserter(models.HazardCurveData,
+                                            max_cache_size=_CURVE_CACHE_SIZE)
+
+                for chunk in models.location_queryset_iter(
+                        all_curves_for_imt, slice_incr):
+                    # slice each chunk by `num_rlzs` into `site_chunk`,
+                    # sorting the curves of each site by realization (i.e.
+                    # by hazard curve), and compute the aggregates of all
+                    # the sites in the chunk at once
+                    site_chunks = [
+                        sorted(site_chunk, key=lambda x: x.hazard_curve_id)
+                        for site_chunk in block_splitter(chunk, num_rlzs)]
+                    sites = [site_chunk[0].location
+                             for site_chunk in site_chunks]
+                    # a (realizations x sites x levels) matrix
+                    curves_poes = numpy.array(
+                        [[x.poes for x in site_chunk]
+                         for site_chunk in site_chunks]).transpose(1, 0, 2)
+                    curves_weights = [x.weight for x in site_chunks[0]]
+
+                    # do means and quantiles
+                    # quantiles first:
+                    if self.hc.quantile_hazard_curves:
+                        for quantile in self.hc.quantile_hazard_curves:
+                            if self.hc.number_of_logic_tree_samples == 0:
+                                # explicitly weighted quantiles
+                                q_curves = weighted_quantile_curve(
+                                    curves_poes, curves_weights, quantile
+                                )
+                            else:
+                                # implicitly weighted quantiles
+                                q_curves = quantile_curve(
+                                    curves_poes, quantile
+                                )
+                            for site, q_curve in zip(sites, q_curves):
                                 inserter.add_entry(
                                     hazard_curve_id=(
                                         container_ids['q%s' % quantile]
@@ -414,11 +808,12 @@ BaseHazardCalculatorNext.finalize_hazard_curves`
                                     location=site.wkt
                                 )
 
-                        # then means
-                        if self.hc.mean_hazard_curves:
-                            m_curve = mean_curve(
-                                curves_poes, weights=curves_weights
-                            )
+                    # then means
+                    if self.hc.mean_hazard_curves:
+                        m_curves = mean_curve(
+                            curves_poes, weights=curves_weights
+                        )
+                        for site, m_curve in zip(sites, m_curves):
                             inserter.add_entry(
                                 hazard_curve_id=container_ids['mean'],
                                 poes=m_curve.tolist(),
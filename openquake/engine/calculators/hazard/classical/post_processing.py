@@ -27,10 +27,10 @@ import numpy
 import openquake.engine
 
 from celery.task.sets import TaskSet
-from scipy.stats import mstats
 
 
 from openquake.engine import logs
+from openquake.engine.calculators import post_processing
 from openquake.engine.db import models
 from openquake.engine.utils import config
 from openquake.engine.utils import tasks as utils_tasks
@@ -225,13 +225,7 @@ def quantile_curves(poe_matrix, quantile):
     :param quantile:
       The quantile considered by the computation
     """
-
-    # mquantiles can not work on 3d matrixes, so we roll back the
-    # location axis as first dimension, then we iterate on each
-    # locations
-    poe_matrixes = numpy.rollaxis(poe_matrix, 1, 0)
-    return [mstats.mquantiles(curves, quantile, axis=0)[0]
-            for curves in poe_matrixes]
+    return post_processing.quantile_curve(poe_matrix, quantile)
 
 
 def quantile_curves_weighted(poe_matrix, weights, quantile):
@@ -249,28 +243,11 @@ def quantile_curves_weighted(poe_matrix, weights, quantile):
     :param quantile:
       The quantile considered by the computation
     """
-    # NOTE(LB): Weights might be passed as a list of `decimal.Decimal`
-    # types, and numpy.interp can't handle this (it throws TypeErrors).
-    # So we explicitly cast to floats here before doing interpolation.
-    weights = numpy.array(weights, dtype=numpy.float64)
-
     # Here, we expect that weight values sum to 1. A weight
     # describes the probability that a realization is expected
     # to occur.
-    poe_matrixes = poe_matrix.transpose()
-    ret = []
-    for curves in poe_matrixes:  # iterate on locations
-        result_curve = []
-        for poes in curves:  # iterate on levels
-            sorted_poe_idxs = numpy.argsort(poes)
-            sorted_weights = weights[sorted_poe_idxs]
-            sorted_poes = poes[sorted_poe_idxs]
-
-            cum_weights = numpy.cumsum(sorted_weights)
-            result_curve.append(
-                numpy.interp(quantile, cum_weights, sorted_poes))
-        ret.append(result_curve)
-    return numpy.array(ret).transpose()
+    return post_processing.weighted_quantile_curve(
+        poe_matrix, weights, quantile)
 
 
 # Disabling "Unused argument 'job_id'" (this parameter is required by @oqtask):
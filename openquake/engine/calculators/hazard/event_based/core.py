@@ -62,6 +62,9 @@ from openquake.engine.utils import tasks as utils_tasks
 #: hazard calculator.
 DEFAULT_GMF_REALIZATIONS = 1
 
+#: Number of SES rupture ids allocated from the database sequence at once
+RUPTURE_ID_BLOCK_SIZE = 1000
+
 
 # Disabling pylint for 'Too many local variables'
 # pylint: disable=R0914
@@ -106,16 +109,10 @@ def ses_and_gmfs(job_id, src_ids, lt_rlz_id, task_seed, result_grp_ordinal):
 
     hc = models.HazardCalculation.objects.get(oqjob=job_id)
 
-    cmplt_lt_ses = None
-    if hc.complete_logic_tree_ses:
-        cmplt_lt_ses = models.SES.objects.get(
-            ses_collection__output__oq_job=job_id,
-            complete_logic_tree_ses=True)
-
     if hc.ground_motion_fields:
         # For ground motion field calculation, we need the points of interest
-        # for the calculation.
-        points_to_compute = hc.points_to_compute()
+        # for the calculation; we need to access them by index
+        points_to_compute = list(hc.points_to_compute())
 
         imts = [haz_general.imt_to_hazardlib(x)
                 for x in hc.intensity_measure_types]
@@ -135,6 +132,8 @@ def ses_and_gmfs(job_id, src_ids, lt_rlz_id, task_seed, result_grp_ordinal):
         src_ids, apply_uncertainties, hc.rupture_mesh_spacing,
         hc.width_of_mfd_bin, hc.area_source_discretization))
 
+    rupture_writer = _RuptureWriter(result_grp_ordinal)
+
     # Compute stochastic event sets
     # For each rupture generated, we can optionally calculate a GMF
     for ses_rlz_n in xrange(1, hc.ses_per_logic_tree_path + 1):
@@ -154,7 +153,7 @@ def ses_and_gmfs(job_id, src_ids, lt_rlz_id, task_seed, result_grp_ordinal):
         # Calculate stochastic event sets:
         logs.LOG.debug('> computing stochastic event sets')
         if hc.ground_motion_fields:
-            gmf_cache = _create_gmf_cache(len(points_to_compute), imts)
+            gmf_cache = _create_gmf_cache(imts)
 
             logs.LOG.debug('> computing also ground motion fields')
             # This will be the "container" for all computed ground motion field
@@ -170,12 +169,9 @@ def ses_and_gmfs(job_id, src_ids, lt_rlz_id, task_seed, result_grp_ordinal):
         for rupture in ses_poissonian:
             rupture_ordinal += 1
 
-            # Prepare and save SES ruptures to the db:
-            logs.LOG.debug('> saving SES rupture to DB')
-            rupture_id = _save_ses_rupture(
-                ses, rupture, cmplt_lt_ses, result_grp_ordinal,
-                rupture_ordinal)
-            logs.LOG.debug('> done saving SES rupture to DB')
+            # Buffer the SES rupture; the ruptures are saved to the db at
+            # the end of the SES
+            rupture_id = rupture_writer.add(ses, rupture, rupture_ordinal)
 
             # Compute ground motion fields (if requested)
             logs.LOG.debug('compute ground motion fields?  %s'
@@ -199,11 +195,7 @@ def ses_and_gmfs(job_id, src_ids, lt_rlz_id, task_seed, result_grp_ordinal):
                 gmf_dict = gmf_calc.ground_motion_fields(**gmf_calc_kwargs)
                 logs.LOG.debug('< done computing ground motion fields')
 
-                # update the gmf cache:
-                for imt_key, v in gmf_dict.iteritems():
-                    gmf_cache[imt_key]['gmvs'] = numpy.append(
-                        gmf_cache[imt_key]['gmvs'], v, axis=1)
-                    gmf_cache[imt_key]['rupture_ids'].append(rupture_id)
+                _update_gmf_cache(gmf_cache, gmf_dict, rupture_id)
 
         logs.LOG.debug('< Done looping over ruptures')
         logs.LOG.debug('%s ruptures computed for SES realization %s of %s'
@@ -212,6 +204,10 @@ def ses_and_gmfs(job_id, src_ids, lt_rlz_id, task_seed, result_grp_ordinal):
         logs.LOG.debug('< done computing stochastic event set %s of %s'
                        % (ses_rlz_n, hc.ses_per_logic_tree_path))
 
+        logs.LOG.debug('> saving SES ruptures to DB')
+        rupture_writer.flush()
+        logs.LOG.debug('< done saving SES ruptures to DB')
+
         if hc.ground_motion_fields:
             # save the GMFs to the DB
             logs.LOG.debug('> saving GMF results to DB')
@@ -223,17 +219,19 @@ def ses_and_gmfs(job_id, src_ids, lt_rlz_id, task_seed, result_grp_ordinal):
     base.signal_task_complete(job_id=job_id, num_items=len(src_ids))
 
 
-def _create_gmf_cache(n_sites, imts):
+def _create_gmf_cache(imts):
     """
     Create a `dict` to cache GMF data during the course of a computation.
 
     The `dict` is keyed by IMTs (which are IMT objects from
     :mod:`openquake.hazardlib.imt`).
-    Each value is initialized to a numpy array with a shape of (n, 0), where n
-    is `n_sites`.
+    Each value is a `dict` of lists, to which :func:`_update_gmf_cache`
+    appends, for each rupture, the indices of the sites with a nonzero ground
+    motion value (`site_idxs`), the ground motion values themselves (`gmvs`)
+    and the rupture ids (`rupture_ids`). The lists are concatenated only
+    once, when the GMFs are saved, so that the memory occupation depends on
+    the number of affected sites and not on the total number of sites.
 
-    :param int n_sites:
-        The number of sites in the calculation.
     :param imts:
         A `list` or other sequence of :mod:`openquake.hazardlib.imt` IMT
         objects.
@@ -241,87 +239,117 @@ def _create_gmf_cache(n_sites, imts):
     cache = dict()
 
     for imt in imts:
-        cache[imt] = dict(gmvs=numpy.empty((n_sites, 0)),
-                          rupture_ids=[])
+        cache[imt] = dict(site_idxs=[], gmvs=[], rupture_ids=[])
 
     return cache
 
 
-@transaction.commit_on_success(using='reslt_writer')
-def _save_ses_rupture(ses, rupture, complete_logic_tree_ses,
-                      result_grp_ordinal, rupture_ordinal):
+def _update_gmf_cache(gmf_cache, gmf_dict, rupture_id):
+    """
+    Add the nonzero ground motion values of a single rupture to the GMF cache.
+
+    :param dict gmf_cache:
+        See :func:`_create_gmf_cache`.
+    :param dict gmf_dict:
+        The ground motion fields of the rupture, as returned by
+        :func:`openquake.hazardlib.calc.gmf.ground_motion_fields`, i.e.
+        a `dict` IMT -> matrix with a single realization per site.
+    :param int rupture_id:
+        The id of the :class:`openquake.engine.db.models.SESRupture` which
+        generated the ground motion fields.
     """
-    Helper function for saving stochastic event set ruptures to the database.
-
-    :param ses:
-        A :class:`openquake.engine.db.models.SES` instance. This will be DB
-        'container' for the new rupture record.
-    :param rupture:
-        A :class:`openquake.hazardlib.source.rupture.Rupture` instance.
-    :param complete_logic_tree_ses:
-        :class:`openquake.engine.db.models.SES` representing the `complete
-        logic tree` stochastic event set.
-        If not None, save a copy of the input `rupture` to this SES.
+    for imt, gmf in gmf_dict.iteritems():
+        gmvs = numpy.asarray(gmf).reshape(-1)
+        [site_idxs] = numpy.nonzero(gmvs)
+        cache = gmf_cache[imt]
+        cache['site_idxs'].append(site_idxs)
+        cache['gmvs'].append(gmvs[site_idxs])
+        cache['rupture_ids'].append(
+            numpy.repeat(rupture_id, len(site_idxs)))
+
+
+class _RuptureWriter(object):
+    """
+    Buffer the ruptures of a stochastic event set and save them to the
+    database with a single bulk insert.
+
+    The ids of the ruptures are allocated in blocks from the database
+    sequence, so that they are known (and can be referenced by the GMFs)
+    before the ruptures are saved.
+
     :param int result_grp_ordinal:
-        The result group in which the calculation results will be placed.
+        The result group in which the ruptures will be placed.
         This ID basically corresponds to the sequence number of the task,
         in the context of the entire calculation.
-    :param int rupture_ordinal:
-        The ordinal of a rupture with a given result group (inidicated by
-        ``result_grp_ordinal``).
+    :param int id_block_size:
+        The number of rupture ids to allocate at once.
     """
-    is_from_fault_source = rupture.source_typology in (
-        openquake.hazardlib.source.ComplexFaultSource,
-        openquake.hazardlib.source.SimpleFaultSource)
-
-    if is_from_fault_source:
-        # for simple and complex fault sources,
-        # rupture surface geometry is represented by a mesh
-        surf_mesh = rupture.surface.get_mesh()
-        lons = surf_mesh.lons
-        lats = surf_mesh.lats
-        depths = surf_mesh.depths
-    else:
-        # For area or point source,
-        # rupture geometry is represented by a planar surface,
-        # defined by 3D corner points
-        surface = rupture.surface
-        lons = numpy.zeros((4))
-        lats = numpy.zeros((4))
-        depths = numpy.zeros((4))
-
-        # NOTE: It is important to maintain the order of these corner
-        # points.
-        for i, corner in enumerate((surface.top_left,
-                                    surface.top_right,
-                                    surface.bottom_right,
-                                    surface.bottom_left)):
-            lons[i] = corner.longitude
-            lats[i] = corner.latitude
-            depths[i] = corner.depth
-
-    # TODO: Possible future optimiztion:
-    # Refactor this to do bulk insertion of ruptures
-    rupture_id = models.SESRupture.objects.create(
-        ses=ses,
-        magnitude=rupture.mag,
-        strike=rupture.surface.get_strike(),
-        dip=rupture.surface.get_dip(),
-        rake=rupture.rake,
-        tectonic_region_type=rupture.tectonic_region_type,
-        is_from_fault_source=is_from_fault_source,
-        lons=lons,
-        lats=lats,
-        depths=depths,
-        result_grp_ordinal=result_grp_ordinal,
-        rupture_ordinal=rupture_ordinal,
-    ).id
-
-    # FIXME(lp): do not save a copy. use the same approach used for
-    # gmf and gmfset
-    if complete_logic_tree_ses is not None:
-        models.SESRupture.objects.create(
-            ses=complete_logic_tree_ses,
+
+    def __init__(self, result_grp_ordinal,
+                 id_block_size=RUPTURE_ID_BLOCK_SIZE):
+        self.result_grp_ordinal = result_grp_ordinal
+        self.id_block_size = id_block_size
+        self.free_ids = []
+        self.inserter = writer.CopyBulkInserter(models.SESRupture)
+
+    def _next_id(self):
+        """
+        :returns: a new rupture id, allocating a new block if needed
+        """
+        if not self.free_ids:
+            self.free_ids = writer.allocate_ids(
+                models.SESRupture, self.id_block_size)
+            self.free_ids.reverse()
+        return self.free_ids.pop()
+
+    def add(self, ses, rupture, rupture_ordinal):
+        """
+        Buffer a stochastic event set rupture.
+
+        :param ses:
+            A :class:`openquake.engine.db.models.SES` instance. This will be DB
+            'container' for the new rupture record.
+        :param rupture:
+            A :class:`openquake.hazardlib.source.rupture.Rupture` instance.
+        :param int rupture_ordinal:
+            The ordinal of a rupture with a given result group.
+        :returns:
+            The id of the new :class:`openquake.engine.db.models.SESRupture`.
+        """
+        is_from_fault_source = rupture.source_typology in (
+            openquake.hazardlib.source.ComplexFaultSource,
+            openquake.hazardlib.source.SimpleFaultSource)
+
+        if is_from_fault_source:
+            # for simple and complex fault sources,
+            # rupture surface geometry is represented by a mesh
+            surf_mesh = rupture.surface.get_mesh()
+            lons = surf_mesh.lons
+            lats = surf_mesh.lats
+            depths = surf_mesh.depths
+        else:
+            # For area or point source,
+            # rupture geometry is represented by a planar surface,
+            # defined by 3D corner points
+            surface = rupture.surface
+            lons = numpy.zeros((4))
+            lats = numpy.zeros((4))
+            depths = numpy.zeros((4))
+
+            # NOTE: It is important to maintain the order of these corner
+            # points.
+            for i, corner in enumerate((surface.top_left,
+                                        surface.top_right,
+                                        surface.bottom_right,
+                                        surface.bottom_left)):
+                lons[i] = corner.longitude
+                lats[i] = corner.latitude
+                depths[i] = corner.depth
+
+        rupture_id = self._next_id()
+        self.inserter.add_entry(
+            id=rupture_id,
+            ses_id=ses.id,
             magnitude=rupture.mag,
             strike=rupture.surface.get_strike(),
             dip=rupture.surface.get_dip(),
@@ -331,11 +359,17 @@ def _save_ses_rupture(ses, rupture, complete_logic_tree_ses,
             lons=lons,
             lats=lats,
             depths=depths,
-            result_grp_ordinal=result_grp_ordinal,
+            result_grp_ordinal=self.result_grp_ordinal,
             rupture_ordinal=rupture_ordinal,
         )
+        return rupture_id
 
-    return rupture_id
+    def flush(self):
+        """
+        Save the buffered ruptures to the database.
+        """
+        with transaction.commit_on_success(using='reslt_writer'):
+            self.inserter.flush()
 
 
 @transaction.commit_on_success(using='reslt_writer')
@@ -350,24 +384,29 @@ def _save_gmfs(gmf_set, gmf_dict, points_to_compute, result_grp_ordinal):
         The dict use to cache/buffer up GMF results during the calculation.
         See :func:`_create_gmf_cache`.
     :param points_to_compute:
-        An :class:`openquake.hazardlib.geo.mesh.Mesh` object, representing all
-        of the points of interest for a calculation.
+        A list of :class:`openquake.hazardlib.geo.point.Point` objects,
+        representing all of the points of interest for a calculation.
     :param int result_grp_ordinal:
         The sequence number (1 to N) of the task which computed these results.
 
         A calculation consists of N tasks, so this tells us which task computed
         the data.
     """
-    inserter = writer.BulkInserter(models.Gmf)
+    inserter = writer.CopyBulkInserter(models.Gmf)
 
     for imt, gmf_data in gmf_dict.iteritems():
-
-        gmfs = gmf_data['gmvs']
-        # ``gmfs`` and ``rupture_ids`` come in as a numpy.matrix and
-        # a list. we want them as an array; it handles subscripting in
-        # the way that we want
-        gmfs = numpy.array(gmfs)
-        rupture_ids = numpy.array(gmf_data['rupture_ids'])
+        if not gmf_data['gmvs']:
+            continue
+
+        site_idxs = numpy.concatenate(gmf_data['site_idxs'])
+        # a stable sort keeps the ground motion values of each site in
+        # rupture order
+        order = numpy.argsort(site_idxs, kind='mergesort')
+        site_idxs = site_idxs[order]
+        gmvs = numpy.concatenate(gmf_data['gmvs'])[order]
+        rupture_ids = numpy.concatenate(gmf_data['rupture_ids'])[order]
+        sites, starts = numpy.unique(site_idxs, return_index=True)
+        ends = numpy.append(starts[1:], len(site_idxs))
 
         sa_period = None
         sa_damping = None
@@ -376,30 +415,18 @@ def _save_gmfs(gmf_set, gmf_dict, points_to_compute, result_grp_ordinal):
             sa_damping = imt.damping
         imt_name = imt.__class__.__name__
 
-        for i, location in enumerate(points_to_compute):
-            all_gmvs = gmfs[i]
-
-            # take only the nonzero ground motion values and the
-            # corresponding rupture ids
-            nonzero_gmvs_idxs = numpy.where(all_gmvs != 0)
-            gmvs = all_gmvs[nonzero_gmvs_idxs].tolist()
-            relevant_rupture_ids = rupture_ids[nonzero_gmvs_idxs].tolist()
-
-            if gmvs:
-                inserter.add_entry(
-                    gmf_set_id=gmf_set.id,
-                    imt=imt_name,
-                    sa_period=sa_period,
-                    sa_damping=sa_damping,
-                    location=location.wkt2d,
-                    gmvs=gmvs,
-                    rupture_ids=relevant_rupture_ids,
-                    result_grp_ordinal=result_grp_ordinal,
-                )
-            else:
-                logs.LOG.debug(
-                    "No ground motion field in point %s "
-                    "as it is too far from any rupture" % location.wkt2d)
+        # only the sites with nonzero ground motion values are saved
+        for site_idx, start, end in zip(sites, starts, ends):
+            inserter.add_entry(
+                gmf_set_id=gmf_set.id,
+                imt=imt_name,
+                sa_period=sa_period,
+                sa_damping=sa_damping,
+                location=points_to_compute[site_idx].wkt2d,
+                gmvs=gmvs[start:end].tolist(),
+                rupture_ids=rupture_ids[start:end].tolist(),
+                result_grp_ordinal=result_grp_ordinal,
+            )
 
     inserter.flush()
 
@@ -417,41 +444,55 @@ class EventBasedHazardCalculator(haz_general.BaseHazardCalculatorNext):
         Loop through realizations and sources to generate a sequence of
         task arg tuples. Each tuple of args applies to a single task.
 
-        Yielded results are quadruples of (job_id, realization_id,
-        source_id_list, random_seed). (random_seed will be used to seed
-        numpy for temporal occurence sampling.)
+        Yielded results are quintuples of (job_id, source_id_list,
+        realization_id, random_seed, result_grp_ordinal). (random_seed will
+        be used to seed numpy for temporal occurence sampling.)
+
+        The seeds and ordinals are assigned to the blocks in the order of
+        the realizations, and of the blocks of each realization, so they do
+        not depend on the order in which the blocks are dispatched. Since
+        the sources are grouped by weight, the blocks (and then the
+        stochastic event sets) differ from the ones of the versions
+        grouping the sources by ID.
 
         :param int block_size:
-            The (max) number of work items for each task. In this case,
-            sources.
+            The (average) number of work items for each task. In this case,
+            sources. The sources are distributed to the tasks according to
+            their weight, see
+            :meth:`~openquake.engine.calculators.hazard.general.\
+BaseHazardCalculatorNext.source_blocks`.
         """
         rnd = random.Random()
         rnd.seed(self.hc.random_seed)
 
-        realizations = models.LtRealization.objects.filter(
-                hazard_calculation=self.hc, is_complete=False).order_by('id')
-
-        result_grp_ordinal = 1
-        for lt_rlz in realizations:
-            source_progress = models.SourceProgress.objects.filter(
-                    is_complete=False, lt_realization=lt_rlz).order_by('id')
-            source_ids = source_progress.values_list('parsed_source_id',
-                                                     flat=True)
-
-            for offset in xrange(0, len(source_ids), block_size):
-                # Since this seed will used for numpy random seeding, it needs
-                # to be positive (since numpy will convert it to a unsigned
-                # long).
-                task_seed = rnd.randint(0, MAX_SINT_32)
-                task_args = (
-                    self.job.id,
-                    source_ids[offset:offset + block_size],
-                    lt_rlz.id,
-                    task_seed,
-                    result_grp_ordinal
-                )
-                yield task_args
-                result_grp_ordinal += 1
+        realizations = list(models.LtRealization.objects.filter(
+                hazard_calculation=self.hc, is_complete=False).order_by('id'))
+        rlz_idx = dict((lt_rlz.id, i) for i, lt_rlz in enumerate(realizations))
+
+        # the sites are not split in tiles, so there is a single site offset
+        blocks = self.source_blocks(realizations, block_size)
+
+        # the blocks are sorted by weight with a stable sort, so sorting
+        # them back by realization gives the order in which they were split
+        block_idxs = sorted(xrange(len(blocks)),
+                            key=lambda i: rlz_idx[blocks[i][0].id])
+        seeds = {}
+        for result_grp_ordinal, i in enumerate(block_idxs, 1):
+            # Since this seed will used for numpy random seeding, it needs
+            # to be positive (since numpy will convert it to a unsigned
+            # long).
+            seeds[i] = rnd.randint(0, MAX_SINT_32), result_grp_ordinal
+
+        for i, (lt_rlz, _, source_ids) in enumerate(blocks):
+            task_seed, result_grp_ordinal = seeds[i]
+            task_args = (
+                self.job.id,
+                source_ids,
+                lt_rlz.id,
+                task_seed,
+                result_grp_ordinal
+            )
+            yield task_args
 
     def initialize_ses_db_records(self, lt_rlz):
         """
@@ -484,9 +525,9 @@ class EventBasedHazardCalculator(haz_general.BaseHazardCalculatorNext):
         stochastic event set (containing all ruptures from all realizations),
         initialize DB records for those results here.
 
-        Throughout the course of the calculation, computed ruptures will be
-        copied into this collection. See :func:`_save_ses_rupture` for more
-        info.
+        Ruptures are not copied into this collection: the `complete logic
+        tree` SES refers to the ruptures of all of the realizations. See
+        :meth:`openquake.engine.db.models.SES.__iter__` for more info.
         """
         # `complete logic tree` SES
         clt_ses_output = models.Output.objects.create(
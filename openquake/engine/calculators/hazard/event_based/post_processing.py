@@ -21,31 +21,27 @@ will be equal to the `ses_per_logic_tree_path`. The data contained in these
 records can include ground motion values from many ruptures, stored in
 variable length arrays; the quantity is random.
 
-For post-processing, we will need to perform P * R * M queries to the database,
-where P is the number of points in a given calculation, R is the total number
-of tree paths, and M is the number of intensity measure levels defined for the
-hazard curve processing. Each of these queries will give us all of the data we
-need to compute a single hazard curve.
-
-Typical values for P can go from 1 to a few 100,000s. *
-Typical values for R can from 1 few 1,000s. *
-Typical values for M are about 10.
-
-* Considering maximum for both P and R is an extreme case.
-
-P * R * M = 100,000 * 1,000 * 10 = 1 Billion queries, in the extreme case
-
-This could be the target for future optimizations.
+For post-processing, we perform a single task per logic tree path and IMT.
+Each task reads all of the GMF records of its realization and IMT in one
+pass, counts the exceedances of the intensity measure levels for all of the
+points of interest at once and bulk inserts the resulting hazard curves.
+
+This means R * I queries, where R is the total number of tree paths and I is
+the number of intensity measure types, independently from the number P of
+points in the calculation (which can go from 1 to a few 100,000s).
 """
 
-import itertools
 import math
 
 import numpy
 
 from celery.task.sets import TaskSet
+from django.db import transaction
+from openquake.hazardlib.geo import utils as geo_utils
+from scipy.spatial import cKDTree
 
 from openquake.engine import logs
+from openquake.engine import writer
 from openquake.engine.db import models
 from openquake.engine.utils import config
 from openquake.engine.utils import tasks as utils_tasks
@@ -54,6 +50,9 @@ from openquake.engine.utils.general import block_splitter
 
 HAZ_CURVE_DISP_NAME_FMT = 'hazard-curve-rlz-%(rlz)s-%(imt)s'
 
+#: Number of GMF records to process with a single numpy operation
+_GMF_CHUNK_SIZE = 10000
+
 
 def gmf_post_process_arg_gen(job):
     """
@@ -63,7 +62,6 @@ def gmf_post_process_arg_gen(job):
     Yielded arguments are as follows:
 
     * job ID
-    * point geometry
     * logic tree realization ID
     * IMT
     * IMLs
@@ -84,7 +82,6 @@ def gmf_post_process_arg_gen(job):
         :class:`openquake.engine.db.models.OqJob` instance.
     """
     hc = job.hazard_calculation
-    points = hc.points_to_compute()
 
     lt_realizations = models.LtRealization.objects.filter(
         hazard_calculation=hc.id)
@@ -111,26 +108,24 @@ def gmf_post_process_arg_gen(job):
                 sa_period=sa_period,
                 sa_damping=sa_damping)
 
-            for point in points:
-                yield (job.id, point, lt_rlz.id, imt, imls, hc_coll.id,
-                       invest_time, duration, sa_period, sa_damping)
+            yield (job.id, lt_rlz.id, imt, imls, hc_coll.id,
+                   invest_time, duration, sa_period, sa_damping)
 
 
 # Disabling "Unused argument 'job_id'" (this parameter is required by @oqtask):
 # pylint: disable=W0613
 @utils_tasks.oqtask
-def gmf_to_hazard_curve_task(job_id, point, lt_rlz_id, imt, imls, hc_coll_id,
+def gmf_to_hazard_curve_task(job_id, lt_rlz_id, imt, imls, hc_coll_id,
                              invest_time, duration, sa_period=None,
                              sa_damping=None):
     """
-    For a given job, point, realization, and IMT, compute a hazard curve and
-    save it to the database. The hazard curve will be computed from all
-    available ground motion data for the specified point and realization.
+    For a given job, realization, and IMT, compute the hazard curves of all of
+    the points of interest and save them to the database. The hazard curves
+    will be computed from all available ground motion data for the specified
+    realization.
 
     :param int job_id:
         ID of a currently running :class:`openquake.engine.db.models.OqJob`.
-    :param point:
-        A :class:`openquake.hazardlib.geo.point.Point` instance.
     :param int lt_rlz_id:
         ID of a :class:`openquake.engine.db.models.LtRealization` for the
         current calculation.
@@ -138,10 +133,10 @@ def gmf_to_hazard_curve_task(job_id, point, lt_rlz_id, imt, imls, hc_coll_id,
         Intensity Measure Type (PGA, SA, PGV, etc.)
     :param imls:
         List of Intensity Measure Levels. These will serve as the abscissae for
-        the computed hazard curve.
+        the computed hazard curves.
     :param int hc_coll_id:
         ID of a :class:`openquake.engine.db.models.HazardCurve`, which will be
-        the 'container' for the computed hazard curve.
+        the 'container' for the computed hazard curves.
     :param float invest_time:
         Investigation time, in years. It is with this time span that we compute
         probabilities of exceedance.
@@ -161,23 +156,43 @@ def gmf_to_hazard_curve_task(job_id, point, lt_rlz_id, imt, imls, hc_coll_id,
     :param float sa_damping:
         Spectral Acceleration damping. Used only with ``imt`` of 'SA'.
     """
+    hc = models.HazardCalculation.objects.get(oqjob=job_id)
+    points = hc.points_to_compute()
     lt_rlz = models.LtRealization.objects.get(id=lt_rlz_id)
-    gmfs = models.Gmf.objects.filter(
-        gmf_set__gmf_collection__lt_realization=lt_rlz_id,
-        imt=imt,
-        sa_period=sa_period,
-        sa_damping=sa_damping).extra(where=[
-            "location::geometry ~= 'SRID=4326;%s'::geometry" % point.wkt2d])
-    # Collect all of the ground motion values:
-    gmvs = list(itertools.chain(*(g.gmvs for g in gmfs)))
-    # Compute the hazard curve PoEs:
-    hc_poes = gmvs_to_haz_curve(gmvs, imls, invest_time, duration)
+
+    # GMF locations are saved as `point.wkt2d` and the coordinates read back
+    # from the database can differ in the last digits from the ones of the
+    # points, so each GMF is assigned to the closest point
+    site_index = cKDTree(geo_utils.spherical_to_cartesian(
+        points.lons, points.lats, numpy.zeros(len(points))))
+
+    gmfs = models.Gmf.objects\
+        .filter(gmf_set__gmf_collection__lt_realization=lt_rlz_id,
+                imt=imt, sa_period=sa_period, sa_damping=sa_damping)\
+        .extra(select={'x': 'ST_X(geometry(location))',
+                       'y': 'ST_Y(geometry(location))'})\
+        .values_list('x', 'y', 'gmvs')\
+        .iterator()
+
+    num_exceeding = numpy.zeros((len(points), len(imls)), dtype=int)
+    for chunk in block_splitter(gmfs, _GMF_CHUNK_SIZE):
+        lons, lats, gmvs_list = zip(*chunk)
+        _, site_idxs = site_index.query(geo_utils.spherical_to_cartesian(
+            lons, lats, numpy.zeros(len(lons))))
+        idxs = numpy.repeat(site_idxs, [len(gmvs) for gmvs in gmvs_list])
+        gmvs = numpy.concatenate(gmvs_list)
+        num_exceeding += count_exceedances(idxs, gmvs, imls, len(points))
+
+    all_poes = 1 - numpy.exp(- (invest_time / duration) * num_exceeding)
 
     # Save:
-    models.HazardCurveData.objects.create(
-        hazard_curve_id=hc_coll_id, poes=hc_poes, location=point.wkt2d,
-        weight=lt_rlz.weight
-    )
+    with transaction.commit_on_success(using='reslt_writer'):
+        inserter = writer.CopyBulkInserter(models.HazardCurveData)
+        for point, poes in zip(points, all_poes):
+            inserter.add_entry(
+                hazard_curve_id=hc_coll_id, poes=poes.tolist(),
+                location=point.wkt2d, weight=lt_rlz.weight)
+        inserter.flush()
 gmf_to_hazard_curve_task.ignore_result = False
 
 
@@ -196,10 +211,8 @@ def do_post_process(job):
 
     # Stats for debug logging:
     n_imts = len(hc.intensity_measure_types_and_levels)
-    n_sites = len(hc.points_to_compute())
     n_rlzs = models.LtRealization.objects.filter(hazard_calculation=hc).count()
-    total_blocks = int(math.ceil(
-        (n_imts * n_sites * n_rlzs) / float(block_size)))
+    total_blocks = int(math.ceil((n_imts * n_rlzs) / float(block_size)))
 
     for i, block in enumerate(block_gen):
         logs.LOG.debug('> GMF post-processing block, %s of %s'
@@ -219,6 +232,33 @@ def do_post_process(job):
     logs.LOG.debug('< Done post-processing - GMFs to Hazard Curves')
 
 
+def count_exceedances(site_idxs, gmvs, imls, num_sites):
+    """
+    Count, for each site, the ground motion values exceeding each of the
+    intensity measure levels.
+
+    :param site_idxs:
+        A numpy array with the index of the site of each ground motion value.
+    :param gmvs:
+        A numpy array of ground motion values, with the same length of
+        ``site_idxs``.
+    :param imls:
+        A list of intensity measure levels, as floats.
+    :param int num_sites:
+        The total number of sites.
+    :returns:
+        A 2D numpy array of integers (sites x IMLs).
+    """
+    num_imls = len(imls)
+    exceeding = gmvs.reshape((len(gmvs), 1)) >= numpy.array(imls)
+    # flat index of the (site, iml) pair of each exceedance
+    flat_idxs = (site_idxs.reshape((len(site_idxs), 1)) * num_imls
+                 + numpy.arange(num_imls))[exceeding]
+    return numpy.bincount(
+        flat_idxs, minlength=num_sites * num_imls).reshape(
+            (num_sites, num_imls))
+
+
 def gmvs_to_haz_curve(gmvs, imls, invest_time, duration):
     """
     Given a set of ground motion values (``gmvs``) and intensity measure levels
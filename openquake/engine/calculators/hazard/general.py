@@ -18,6 +18,7 @@
 
 """Common code for the hazard calculators."""
 
+import copy
 import math
 import os
 import random
@@ -33,8 +34,11 @@ from django.db.models import Sum
 from django.core.exceptions import ObjectDoesNotExist
 
 from openquake.hazardlib import geo as hazardlib_geo
+from openquake.hazardlib.geo import utils as geo_utils
+from openquake.hazardlib.geo.geodetic import EARTH_RADIUS
 from openquake.hazardlib import correlation
 from openquake.nrmllib import parsers as nrml_parsers
+from scipy.spatial import cKDTree
 from shapely import geometry
 
 from openquake.engine import engine2
@@ -50,6 +54,7 @@ from openquake.engine.job.validation import MAX_SINT_32
 from openquake.engine.job.validation import MIN_SINT_32
 from openquake.engine import logs
 from openquake.engine.utils import config
+from openquake.engine.utils import general
 from openquake.engine.utils import stats
 
 
@@ -59,6 +64,14 @@ POES_PARAM_NAME = "POES"
 # 1e-5 represents the approximate distance of one meter at the equator.
 DILATION_ONE_METER = 1e-5
 
+#: Maximum number of hazardlib sources kept in the cache of each process,
+#: see :func:`gen_sources`
+SOURCE_CACHE_SIZE = 1000
+
+#: Hazardlib sources converted by this process, keyed by parsed source ID,
+#: rupture mesh spacing, MFD bin width and area source discretization
+_SOURCE_CACHE = general.LRUCache(SOURCE_CACHE_SIZE)
+
 
 def store_source_model(job_id, seed, params, calc):
     """Generate source model from the source model logic tree and store it in
@@ -276,46 +289,122 @@ def store_site_data(hc_id, site_model_inp, mesh):
         created to store computation points of interest with associated site
         parameters.
     """
-    lons = []
-    lats = []
-    vs30s = []
-    vs30_types = []
-    z1pt0s = []
-    z2pt5s = []
-
-    for pt in mesh:
-        smd = get_closest_site_model_data(site_model_inp, pt)
-
-        lons.append(pt.longitude)
-        lats.append(pt.latitude)
-
-        vs30s.append(smd.vs30)
-        vs30_types.append(smd.vs30_type)
-        z1pt0s.append(smd.z1pt0)
-        z2pt5s.append(smd.z2pt5)
+    # Load the whole site model at once
+    sm_data = models.SiteModel.objects\
+        .filter(input=site_model_inp)\
+        .extra(select={'x': 'ST_X(location)', 'y': 'ST_Y(location)'})\
+        .values_list('x', 'y', 'vs30', 'vs30_type', 'z1pt0', 'z2pt5')
+    sm_lons, sm_lats, vs30s, vs30_types, z1pt0s, z2pt5s = [
+        numpy.array(column) for column in zip(*sm_data)]
+
+    # Find the closest site model node for each point of the mesh. The
+    # closest points in the 3d space are the closest ones on the sphere too.
+    sm_index = cKDTree(geo_utils.spherical_to_cartesian(
+        sm_lons, sm_lats, numpy.zeros(len(sm_lons))))
+    _, idxs = sm_index.query(geo_utils.spherical_to_cartesian(
+        mesh.lons, mesh.lats, numpy.zeros(mesh.lons.shape)))
 
     site_data = models.SiteData(hazard_calculation_id=hc_id)
-    site_data.lons = numpy.array(lons)
-    site_data.lats = numpy.array(lats)
-    site_data.vs30s = numpy.array(vs30s)
+    site_data.lons = numpy.array(mesh.lons)
+    site_data.lats = numpy.array(mesh.lats)
+    site_data.vs30s = vs30s[idxs]
     # We convert from strings to booleans here because this is what a hazardlib
     # SiteCollection expects for the vs30 type. If we do the conversion here,
     # we only do it once and we can directly consume the data on the worker
     # side without having to convert inside each task.
-    site_data.vs30_measured = numpy.array(vs30_types) == 'measured'
-    site_data.z1pt0s = numpy.array(z1pt0s)
-    site_data.z2pt5s = numpy.array(z2pt5s)
+    site_data.vs30_measured = vs30_types[idxs] == 'measured'
+    site_data.z1pt0s = z1pt0s[idxs]
+    site_data.z2pt5s = z2pt5s[idxs]
     site_data.save()
 
     return site_data
 
 
+def filter_sources(polygons, mesh, integration_distance):
+    """
+    Find the sources which can affect at least one site, i.e. the sources
+    whose rupture enclosing polygon, dilated by the integration distance,
+    contains some site. This is the same criterion used by hazardlib to
+    filter the sources of point and area sources, and a conservative one
+    for fault sources.
+
+    The sites are indexed with a KD-tree in the 3d space, so that for each
+    source only the sites inside a sphere enclosing the dilated polygon
+    need to be checked exactly.
+
+    :param polygons:
+        An iterable of pairs (source ID,
+        :class:`openquake.hazardlib.geo.polygon.Polygon`)
+    :param mesh:
+        The :class:`openquake.hazardlib.geo.mesh.Mesh` of the sites
+    :param float integration_distance:
+        The maximum distance (in km) between a source and a site
+    :returns:
+        The list of the IDs of the sources affecting the sites, in the
+        order of `polygons`
+    """
+    lons = numpy.array(mesh.lons).flatten()
+    lats = numpy.array(mesh.lats).flatten()
+    site_index = cKDTree(geo_utils.spherical_to_cartesian(
+        lons, lats, numpy.zeros(len(lons))))
+
+    src_ids = []
+    for src_id, polygon in polygons:
+        vertices = geo_utils.spherical_to_cartesian(
+            polygon.lons, polygon.lats, numpy.zeros(len(polygon.lons)))
+        # the projection of the barycenter of the vertices on the surface
+        center = vertices.mean(axis=0)
+        center *= EARTH_RADIUS / numpy.linalg.norm(center)
+        # the chord between two points on the surface is shorter than the
+        # great circle distance, so the ball with this radius encloses all
+        # the sites within the integration distance from the polygon
+        chord = numpy.sqrt(((vertices - center) ** 2).sum(axis=1)).max()
+        radius = 2 * EARTH_RADIUS * numpy.arcsin(
+            min(chord / (2 * EARTH_RADIUS), 1.0)) + integration_distance
+
+        idxs = site_index.query_ball_point(center, radius)
+        if not idxs:
+            continue
+        candidates = hazardlib_geo.Mesh(lons[idxs], lats[idxs], None)
+        if polygon.dilate(integration_distance).intersects(candidates).any():
+            src_ids.append(src_id)
+    return src_ids
+
+
+def site_collection_tile(site_coll, tile):
+    """
+    Get the sites of a tile, without copying the site parameters.
+
+    :param site_coll:
+        A :class:`openquake.hazardlib.site.SiteCollection` instance.
+    :param tile:
+        A `slice` of the sites, see
+        :meth:`BaseHazardCalculatorNext.site_tiles`
+    :returns:
+        A :class:`openquake.hazardlib.site.SiteCollection` with the sites
+        of the tile, or `site_coll` itself if the tile covers all of it.
+    """
+    start, stop, _ = tile.indices(len(site_coll.vs30))
+    if start == 0 and stop == len(site_coll.vs30):
+        return site_coll
+
+    return models.site_collection_from_arrays(
+        site_coll.mesh.lons[start:stop], site_coll.mesh.lats[start:stop],
+        site_coll.vs30[start:stop], site_coll.vs30measured[start:stop],
+        site_coll.z1pt0[start:stop], site_coll.z2pt5[start:stop])
+
+
 def gen_sources(src_ids, apply_uncertainties, rupture_mesh_spacing,
                 width_of_mfd_bin, area_source_discretization):
     """
     Hazardlib source objects generator for a given set of sources.
 
-    Performs lazy loading, converting and processing of sources.
+    The sources which are not already in the cache of this process are
+    loaded with a single query; the conversion and processing of sources is
+    lazy. Converted sources are cached (see :data:`_SOURCE_CACHE`), so that
+    tasks computing other realizations of the same source model can skip
+    the loading and the conversion. Each source is yielded as a copy with
+    its own MFD, since the uncertainties are applied to the MFD in place.
 
     :param src_ids:
         A list of IDs for :class:`openquake.engine.db.models.ParsedSource`
@@ -328,13 +417,29 @@ parse_source_model_logictree_path`
     For information about the other parameters, see
     :func:`openquake.engine.input.source.nrml_to_hazardlib`.
     """
-    for src_id in src_ids:
-        parsed_source = models.ParsedSource.objects.get(id=src_id)
-
-        hazardlib_source = source.nrml_to_hazardlib(
-            parsed_source.nrml, rupture_mesh_spacing, width_of_mfd_bin,
-            area_source_discretization)
+    params = (rupture_mesh_spacing, width_of_mfd_bin,
+              area_source_discretization)
+
+    # the cached sources are taken upfront, since caching the missing ones
+    # can evict them before they are yielded
+    cached_sources = dict(
+        (src_id, _SOURCE_CACHE[(src_id,) + params]) for src_id in src_ids
+        if (src_id,) + params in _SOURCE_CACHE)
+    missing_ids = [src_id for src_id in src_ids
+                   if src_id not in cached_sources]
+    parsed_sources = dict(
+        (ps.id, ps)
+        for ps in models.ParsedSource.objects.filter(id__in=missing_ids))
 
+    for src_id in src_ids:
+        hazardlib_source = cached_sources.get(src_id)
+        if hazardlib_source is None:
+            hazardlib_source = source.nrml_to_hazardlib(
+                parsed_sources[src_id].nrml, *params)
+            _SOURCE_CACHE[(src_id,) + params] = hazardlib_source
+
+        hazardlib_source = copy.copy(hazardlib_source)
+        hazardlib_source.mfd = copy.deepcopy(hazardlib_source.mfd)
         apply_uncertainties(hazardlib_source)
         yield hazardlib_source
 
@@ -377,6 +482,41 @@ def imt_to_hazardlib(imt):
         return imt_class()
 
 
+def save_hazard_curve_data(haz_curve, lt_rlz, imt, lons, lats):
+    """
+    Copy the hazard curves of a realization and IMT from the temporary
+    `htemp.hazard_curve_progress` records to `hzrdr.hazard_curve_data`.
+
+    :param haz_curve:
+        The :class:`openquake.engine.db.models.HazardCurve` container of
+        the curves.
+    :param lt_rlz:
+        The :class:`openquake.engine.db.models.LtRealization` of the curves.
+    :param str imt:
+        The intensity measure type, e.g. "SA(0.025)".
+    :param lons:
+        The longitudes of the sites of the calculation.
+    :param lats:
+        The latitudes of the sites of the calculation. The order of the
+        sites must be the one of the rows of the result matrices (or of the
+        concatenation of the matrices of the tiles of sites, sorted by
+        `site_offset`).
+    """
+    progress = models.HazardCurveProgress.objects.filter(
+        lt_realization=lt_rlz, imt=imt).order_by('site_offset')
+    result_matrix = numpy.concatenate(
+        [tile.result_matrix for tile in progress])
+    assert len(result_matrix) == len(lons), (
+        'Expected %d hazard curves, got %d' % (len(lons), len(result_matrix)))
+
+    inserter = writer.CopyBulkInserter(models.HazardCurveData)
+    for lon, lat, poes in zip(lons, lats, result_matrix):
+        inserter.add_entry(
+            hazard_curve_id=haz_curve.id, poes=poes.tolist(),
+            location='POINT(%s %s)' % (lon, lat), weight=lt_rlz.weight)
+    inserter.flush()
+
+
 def update_realization(lt_rlz_id, num_items):
     """
     Call this function when a task is complete to update realization counters
@@ -441,6 +581,13 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
     functionality, like initialization procedures.
     """
 
+    #: If true, the sources which cannot affect any site are marked as
+    #: computed before the tasks are dispatched (see
+    #: :meth:`filter_source_progress`). The results of the calculator must
+    #: not depend on such sources, and its realizations must need no further
+    #: work once all of their sources are computed.
+    prefilter_sources = False
+
     def __init__(self, *args, **kwargs):
         super(BaseHazardCalculatorNext, self).__init__(*args, **kwargs)
 
@@ -469,6 +616,68 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
         """
         return int(config.get('hazard', 'block_size'))
 
+    def site_tiles(self):
+        """
+        The sites of the calculation can be split in tiles, i.e. slices of
+        the site collection which are computed independently, each one with
+        its own `htemp.source_progress` and `htemp.hazard_curve_progress`
+        records. By default, there is a single tile with all the sites.
+
+        :returns:
+            a list of `slice` objects
+        """
+        return [slice(0, len(self.computation_mesh))]
+
+    def source_blocks(self, realizations, block_size,
+                      across_realizations=True):
+        """
+        Split the sources of each realization and tile of sites which are
+        not computed yet in blocks of roughly the same weight (see
+        :class:`openquake.engine.db.models.ParsedSource`). For each
+        realization and tile, the number of blocks is the same as when
+        splitting its sources in blocks of `block_size` sources.
+
+        :param realizations:
+            an iterable of :class:`openquake.engine.db.models.LtRealization`
+        :param int block_size:
+            the number of sources per block, on average
+        :param bool across_realizations:
+            if false, the blocks are sorted by weight only within each
+            realization, and the realizations are dispatched one after the
+            other
+        :returns:
+            a list of triples (realization, site offset of the tile, list of
+            parsed source IDs), from the heaviest block to the lightest one,
+            so that the biggest tasks can be dispatched first
+        """
+        blocks = []
+        for rlz_idx, lt_rlz in enumerate(realizations):
+            source_progress = models.SourceProgress.objects.filter(
+                is_complete=False, lt_realization=lt_rlz).order_by('id')
+            weights = {}
+            for site_offset, src_id, weight in source_progress.values_list(
+                    'site_offset', 'parsed_source_id',
+                    'parsed_source__weight'):
+                weights.setdefault(site_offset, {})[src_id] = weight
+
+            for site_offset in sorted(weights):
+                tile_weights = weights[site_offset]
+                source_ids = sorted(tile_weights)
+                num_blocks = int(
+                    math.ceil(float(len(source_ids)) / block_size))
+                for block in general.weighted_block_splitter(
+                        source_ids, [tile_weights[i] for i in source_ids],
+                        num_blocks):
+                    blocks.append((
+                        0 if across_realizations else rlz_idx,
+                        -sum(tile_weights[i] for i in block),
+                        lt_rlz, site_offset, block))
+
+        # sort by decreasing weight; the sort is stable, so the blocks with
+        # the same weight keep the order of the realizations and tiles
+        blocks.sort(key=lambda b: b[:2])
+        return [block[2:] for block in blocks]
+
     def concurrent_tasks(self):
         """
         For hazard calculators, the number of tasks to be in queue
@@ -488,10 +697,6 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
         im = self.hc.intensity_measure_types_and_levels
         points = self.computation_mesh
 
-        # prepare site locations for the stored function call
-        lons = '{%s}' % ', '.join(str(v) for v in points.lons)
-        lats = '{%s}' % ', '.join(str(v) for v in points.lats)
-
         realizations = models.LtRealization.objects.filter(
             hazard_calculation=self.hc.id)
 
@@ -521,28 +726,8 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
                 haz_curve.save()
 
                 with transaction.commit_on_success(using='reslt_writer'):
-                    cursor = connections['reslt_writer'].cursor()
-
-                    # TODO(LB): I don't like the fact that we have to pass
-                    # potentially huge arguments (100k sites, for example).
-                    # I would like to be able to fetch this site data from
-                    # the stored function, but at the moment, the only form
-                    # available is a pickled `SiteCollection` object, and I've
-                    # experienced problems trying to import third-party libs
-                    # in a DB function context and could not get it to reliably
-                    # work.
-                    # As a fix, in addition to caching the pickled
-                    # SiteCollection in the DB, we could store also arrays for
-                    # lons and lats. It's duplicated information, but we have a
-                    # relatively low number of HazardCalculation records, so it
-                    # shouldn't be a big deal.
-                    cursor.execute(
-                        """
-                        SELECT hzrdr.finalize_hazard_curves(
-                            %s, %s, %s, %s, %s, %s)
-                        """,
-                        [self.hc.id, rlz.id, haz_curve.id, imt, lons, lats]
-                    )
+                    save_hazard_curve_data(
+                        haz_curve, rlz, imt, points.lons, points.lats)
 
     def initialize_sources(self):
         """
@@ -649,7 +834,10 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
 
         Then we create `htemp.source_progress` records for each source
         in the source model chosen for each realization,
-        see :meth:`initialize_source_progress`.
+        see :meth:`initialize_source_progress`. If
+        :attr:`prefilter_sources` is set, the records of the sources which
+        cannot affect any site are marked as complete, see
+        :meth:`filter_source_progress`.
 
         :param rlz_callbacks:
             Optionally, you can specify a list of callbacks for each
@@ -670,6 +858,86 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
             self._initialize_realizations_enumeration(
                 rlz_callbacks=rlz_callbacks)
 
+        if self.prefilter_sources:
+            self.filter_source_progress()
+
+    def filter_source_progress(self):
+        """
+        Mark as complete the `htemp.source_progress` records of the sources
+        which are farther than the `maximum_distance` from all the sites of
+        a tile (see :func:`filter_sources`), so that no task is ever
+        dispatched for them, and count them as completed items of their
+        realizations. Nothing is filtered if the calculation has no
+        `maximum_distance`.
+
+        The polygons of the sources are the ones of the sources as they are
+        stored: the sources of the realizations whose source model logic
+        tree path applies some uncertainty (which can enlarge the
+        ruptures, e.g. by increasing the maximum magnitude) are not
+        filtered, and are left to the filter of hazardlib.
+        """
+        if self.hc.maximum_distance is None:
+            return
+
+        ltp = logictree.LogicTreeProcessor(self.hc.id)
+        rlz_ids = [
+            lt_rlz.id for lt_rlz in models.LtRealization.objects.filter(
+                hazard_calculation=self.hc, is_complete=False)
+            if not ltp.applies_uncertainties(lt_rlz.sm_lt_path)]
+        if not rlz_ids:
+            return
+
+        parsed_sources = models.ParsedSource.objects.filter(
+            sourceprogress__lt_realization__in=rlz_ids,
+            sourceprogress__is_complete=False).distinct()
+        polygons = [
+            (src_id, hazardlib_geo.Polygon(
+                [hazardlib_geo.Point(*coords)
+                 for coords in polygon.exterior_ring.coords[:-1]]))
+            for src_id, polygon in parsed_sources.values_list(
+                'id', 'polygon').iterator()]
+        src_ids = set(src_id for src_id, _ in polygons)
+
+        cursor = connections['reslt_writer'].cursor()
+        src_progress_tbl = models.SourceProgress._meta.db_table
+        lt_rlz_tbl = models.LtRealization._meta.db_table
+        mesh = self.hc.site_collection.mesh
+        num_far = 0
+        for tile in self.site_tiles():
+            tile_mesh = hazardlib_geo.Mesh(
+                mesh.lons[tile], mesh.lats[tile], None)
+            far_ids = src_ids - set(filter_sources(
+                polygons, tile_mesh, self.hc.maximum_distance))
+            if not far_ids:
+                continue
+            num_far += len(far_ids)
+            cursor.execute("""
+                UPDATE "%s" SET is_complete = TRUE
+                WHERE parsed_source_id = ANY(%%s) AND site_offset = %%s
+                AND lt_realization_id = ANY(%%s)
+                """ % src_progress_tbl,
+                           [sorted(far_ids), tile.start, rlz_ids])
+
+        logs.LOG.info('%d sources are farther than %s km from all the sites '
+                      'of a tile', num_far, self.hc.maximum_distance)
+        if not num_far:
+            return
+
+        cursor.execute("""
+            UPDATE "%s" AS rlz SET completed_items = (
+                SELECT count(1) FROM "%s"
+                WHERE lt_realization_id = rlz.id AND is_complete)
+            WHERE hazard_calculation_id = %%s
+            """ % (lt_rlz_tbl, src_progress_tbl),
+            [self.hc.id])
+        cursor.execute("""
+            UPDATE "%s" SET is_complete = TRUE
+            WHERE hazard_calculation_id = %%s
+            AND completed_items = total_items
+            """ % lt_rlz_tbl,
+                       [self.hc.id])
+        transaction.set_dirty(using='reslt_writer')
+
     def initialize_pr_data(self):
         """Record the total/completed number of work items.
 
@@ -696,6 +964,7 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
         [smlt] = models.inputs4hcalc(hc.id, input_type='source_model_logic_tree')
         ltp = logictree.LogicTreeProcessor(hc.id)
         hzrd_src_cache = {}
+        site_offsets = [tile.start for tile in self.site_tiles()]
 
         for i, path_info in enumerate(ltp.enumerate_paths()):
             sm_name, weight, sm_lt_path, gsim_lt_path = path_info
@@ -721,7 +990,7 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
                 hzrd_src = hzrd_src_cache[sm_name]
 
             # Create source_progress objects
-            self.initialize_source_progress(lt_rlz, hzrd_src)
+            self.initialize_source_progress(lt_rlz, hzrd_src, site_offsets)
 
             # Run realization callback (if any) to do additional initialization
             # for each realization:
@@ -748,6 +1017,7 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
         ltp = logictree.LogicTreeProcessor(self.hc.id)
 
         hzrd_src_cache = {}
+        site_offsets = [tile.start for tile in self.site_tiles()]
 
         # The first realization gets the seed we specified in the config file.
         for i in xrange(self.hc.number_of_logic_tree_samples):
@@ -781,7 +1051,7 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
                 hzrd_src = hzrd_src_cache[sm_name]
 
             # Create source_progress objects
-            self.initialize_source_progress(lt_rlz, hzrd_src)
+            self.initialize_source_progress(lt_rlz, hzrd_src, site_offsets)
 
             # Run realization callback (if any) to do additional initialization
             # for each realization:
@@ -794,7 +1064,7 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
             rnd.seed(seed)
 
     @staticmethod
-    def initialize_source_progress(lt_rlz, hzrd_src):
+    def initialize_source_progress(lt_rlz, hzrd_src, site_offsets=(0,)):
         """
         Create ``source_progress`` models for given logic tree realization
         and set total sources of realization.
@@ -805,23 +1075,28 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
         :param hztd_src:
             :class:`openquake.engine.db.models.Input` object that needed parsed
             sources are referencing.
+        :param site_offsets:
+            The offsets of the tiles of sites (see :meth:`site_tiles`); a
+            record is created for each source and tile.
         """
         cursor = connections['reslt_writer'].cursor()
         src_progress_tbl = models.SourceProgress._meta.db_table
         parsed_src_tbl = models.ParsedSource._meta.db_table
         lt_rlz_tbl = models.LtRealization._meta.db_table
         cursor.execute("""
-            INSERT INTO "%s" (lt_realization_id, parsed_source_id, is_complete)
-            SELECT %%s, id, FALSE
-            FROM "%s" WHERE input_id = %%s
-            ORDER BY id
+            INSERT INTO "%s" (lt_realization_id, parsed_source_id,
+                              site_offset, is_complete)
+            SELECT %%s, src.id, site_offset, FALSE
+            FROM "%s" AS src, unnest(%%s) AS site_offset
+            WHERE src.input_id = %%s
+            ORDER BY site_offset, src.id
             """ % (src_progress_tbl, parsed_src_tbl),
-            [lt_rlz.id, hzrd_src.id])
+            [lt_rlz.id, list(site_offsets), hzrd_src.id])
         cursor.execute("""
             UPDATE "%s" SET total_items = (
                 SELECT count(1) FROM "%s" WHERE lt_realization_id = %%s
-            )""" % (lt_rlz_tbl, src_progress_tbl),
-            [lt_rlz.id])
+            ) WHERE id = %%s""" % (lt_rlz_tbl, src_progress_tbl),
+                       [lt_rlz.id, lt_rlz.id])
         transaction.commit_unless_managed()
 
     def initialize_hazard_curve_progress(self, lt_rlz):
@@ -837,21 +1112,23 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
         IMT).
 
         We will create 1 `hazard_curve_progress` record per IMT per
-        realization.
+        realization per tile of sites (see :meth:`site_tiles`), so that the
+        size of each matrix is bounded by the size of the tiles.
 
         :param lt_rlz:
             :class:`openquake.engine.db.models.LtRealization` object to
             associate with these inital hazard curve values.
         """
-        num_points = len(self.computation_mesh)
-
         im_data = self.hc.intensity_measure_types_and_levels
-        for imt, imls in im_data.items():
-            hc_prog = models.HazardCurveProgress()
-            hc_prog.lt_realization = lt_rlz
-            hc_prog.imt = imt
-            hc_prog.result_matrix = numpy.zeros((num_points, len(imls)))
-            hc_prog.save()
+        for tile in self.site_tiles():
+            num_points = tile.stop - tile.start
+            for imt, imls in im_data.items():
+                hc_prog = models.HazardCurveProgress()
+                hc_prog.lt_realization = lt_rlz
+                hc_prog.imt = imt
+                hc_prog.site_offset = tile.start
+                hc_prog.result_matrix = numpy.zeros((num_points, len(imls)))
+                hc_prog.save()
 
     def export(self, *args, **kwargs):
         """
@@ -900,10 +1177,13 @@ class BaseHazardCalculatorNext(base.CalculatorNext):
             # Each realization has the potential to choose a random source
             # model, and thus there may be a variable number of tasks for each
             # realization (depending on the number of the sources in the model
-            # which was chosen for the realization).
-            num_sources = models.SourceProgress.objects.filter(
-                lt_realization=lt_rlz).count()
-            num_tasks += math.ceil(float(num_sources) / block_size)
+            # which was chosen for the realization), and the sources of each
+            # tile of sites are split in blocks independently.
+            for tile in self.site_tiles():
+                num_sources = models.SourceProgress.objects.filter(
+                    is_complete=False, lt_realization=lt_rlz,
+                    site_offset=tile.start).count()
+                num_tasks += math.ceil(float(num_sources) / block_size)
 
         [job_stats] = models.JobStats.objects.filter(oq_job=self.job.id)
         job_stats.num_sites = num_sites
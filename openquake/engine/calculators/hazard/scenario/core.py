@@ -102,7 +102,7 @@ def save_gmf(output_id, gmf_dict, points_to_compute):
         An :class:`openquake.hazardlib.geo.mesh.Mesh` object, representing
         all of the points of interest for a calculation.
     """
-    inserter = writer.BulkInserter(models.GmfScenario)
+    inserter = writer.CopyBulkInserter(models.GmfScenario)
 
     for imt, gmfs_ in gmf_dict.iteritems():
         # ``gmfs`` comes in as a numpy.matrix
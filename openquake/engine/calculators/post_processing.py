@@ -64,9 +64,14 @@ def weighted_quantile_curve(curves, weights, quantile):
     used in the case where hazard curves are computed using the logic tree
     end-branch enumeration approach. In this case, the weights are explicit.
 
+    The computation is vectorized: `curves` can have any number of
+    dimensions, the first one being the realizations (e.g. realizations x
+    locations x levels), and the quantile is computed for all the other
+    elements at once.
+
     :param curves:
-        2D array-like of curve PoEs. Each row represents the PoEs for a single
-        curve
+        N-d array-like of curve PoEs. Each element of the first axis
+        represents the PoEs of a single realization
     :param weights:
         Array-like of weights, 1 for each input curve.
     :param quantile:
@@ -75,31 +80,42 @@ def weighted_quantile_curve(curves, weights, quantile):
     :returns:
         A numpy array representing the quantile aggregate of the input
         ``curves`` and ``quantile``, weighting each curve with the specified
-        ``weights``.
+        ``weights``. Its shape is the shape of ``curves`` without the first
+        axis.
     """
     # Each curve needs to be associated with a weight:
     assert len(weights) == len(curves)
     # NOTE(LB): Weights might be passed as a list of `decimal.Decimal`
-    # types, and numpy.interp can't handle this (it throws TypeErrors).
+    # types, which numpy can't handle (it throws TypeErrors).
     # So we explicitly cast to floats here before doing interpolation.
     weights = numpy.array(weights, dtype=numpy.float64)
 
-    result_curve = []
-
-    np_curves = numpy.array(curves)
-    np_weights = numpy.array(weights)
-
-    for poes in np_curves.transpose():
-        sorted_poe_idxs = numpy.argsort(poes)
-        sorted_weights = np_weights[sorted_poe_idxs]
-        sorted_poes = poes[sorted_poe_idxs]
-
-        # cumulative sum of weights:
-        cum_weights = numpy.cumsum(sorted_weights)
-
-        result_curve.append(numpy.interp(quantile, cum_weights, sorted_poes))
-
-    return numpy.array(result_curve)
+    np_curves = numpy.array(curves, dtype=numpy.float64)
+    shape = np_curves.shape
+    num_curves = shape[0]
+    poes = np_curves.reshape(num_curves, -1)
+    cols = numpy.arange(poes.shape[1])
+
+    # sort the poes of each column, together with their weights
+    sorted_poe_idxs = numpy.argsort(poes, axis=0, kind='mergesort')
+    sorted_poes = poes[sorted_poe_idxs, cols]
+    cum_weights = numpy.cumsum(weights[sorted_poe_idxs], axis=0)
+
+    # interpolate the quantile between the cumulative weights of each
+    # column, as `numpy.interp` does for a single one: the values
+    # outside the range of the weights are clipped
+    k = (cum_weights <= quantile).sum(axis=0)
+    lo = (k - 1).clip(0, num_curves - 1)
+    hi = k.clip(0, num_curves - 1)
+    x_lo = cum_weights[lo, cols]
+    x_hi = cum_weights[hi, cols]
+    y_lo = sorted_poes[lo, cols]
+    y_hi = sorted_poes[hi, cols]
+    dx = x_hi - x_lo
+    fraction = numpy.where(
+        dx > 0, (quantile - x_lo) / numpy.where(dx > 0, dx, 1.), 0.)
+
+    return (y_lo + fraction * (y_hi - y_lo)).reshape(shape[1:])
 
 
 def quantile_curve(curves, quantile):
@@ -108,9 +124,13 @@ def quantile_curve(curves, quantile):
     the case where hazard curves are computed using the Monte-Carlo logic tree
     sampling approach. In this case, the weights are implicit.
 
+    As :func:`weighted_quantile_curve`, `curves` can have any number of
+    dimensions, the first one being the realizations.
+
     :param curves:
-        2D array-like collection of hazard curve PoE values. Each element
-        should be a sequence of PoE `float` values. Example::
+        N-d array-like collection of hazard curve PoE values. Each element
+        of the first axis should be a sequence of PoE `float` values.
+        Example::
 
             [[0.5, 0.4, 0.3], [0.6, 0.59, 0.1]]
     :param float quantile:
@@ -136,5 +156,5 @@ def quantile_curve(curves, quantile):
     k = numpy.floor(aleph.clip(1, n - 1)).astype(int)
     gamma = (aleph - k).clip(0, 1)
 
-    data = numpy.sort(arr, axis=0).transpose()
-    return (1.0 - gamma) * data[:, k - 1] + gamma * data[:, k]
+    data = numpy.sort(arr, axis=0)
+    return (1.0 - gamma) * data[k - 1] + gamma * data[k]
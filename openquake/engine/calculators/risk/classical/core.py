@@ -21,8 +21,6 @@ from collections import OrderedDict
 
 from openquake.risklib import api, scientific
 
-from django.db import transaction
-
 from openquake.engine.calculators.risk import hazard_getters
 from openquake.engine.db import models
 from openquake.engine.calculators import base
@@ -86,38 +84,34 @@ def classical(job_id, hazard, vulnerability_function, output_containers,
             asset_outputs[hazard_output_id] = calculator(hazard_curves)
 
         with logs.tracing('writing results'):
-            with transaction.commit_on_success(using='reslt_writer'):
-                for i, loss_ratio_curve in enumerate(
-                        asset_outputs[hazard_output_id]):
-
-                    asset = assets[i]
+            with general.BulkResultWriter() as result_writer:
+                loss_ratio_curves = asset_outputs[hazard_output_id]
 
-                    # Write Loss Curves
-                    general.write_loss_curve(
-                        loss_curve_id, asset, loss_ratio_curve)
+                # Write Loss Curves
+                general.write_loss_curves(
+                    result_writer, loss_curve_id, assets, loss_ratio_curves)
 
-                    # Then conditional loss maps
-                    for poe in conditional_loss_poes:
-                        general.write_loss_map_data(
-                            loss_map_ids[poe], asset,
-                            scientific.conditional_loss_ratio(
-                                loss_ratio_curve, poe))
+                # Then conditional loss maps
+                for poe in conditional_loss_poes:
+                    general.write_loss_maps(
+                        result_writer, loss_map_ids[poe], assets,
+                        [scientific.conditional_loss_ratio(curve, poe)
+                         for curve in loss_ratio_curves])
 
     if len(hazard) > 1 and (mean_loss_curve_id or quantile_loss_curve_ids):
         weights = [data[1] for _, data in hazard.items()]
 
         with logs.tracing('writing curve statistics'):
-            with transaction.commit_on_success(using='reslt_writer'):
-                loss_ratio_curve_matrix = asset_outputs.values()
-                for i, asset in enumerate(assets):
-                    general.curve_statistics(
-                        asset,
-                        loss_ratio_curve_matrix[i],
-                        weights,
-                        mean_loss_curve_id,
-                        quantile_loss_curve_ids,
-                        hazard_montecarlo_p,
-                        assume_equal="support")
+            with general.BulkResultWriter() as result_writer:
+                general.curve_statistics(
+                    result_writer,
+                    assets,
+                    asset_outputs.values(),
+                    weights,
+                    mean_loss_curve_id,
+                    quantile_loss_curve_ids,
+                    hazard_montecarlo_p,
+                    assume_equal="support")
 
     base.signal_task_complete(job_id=job_id,
                               num_items=len(assets) + len(missings))
@@ -25,7 +25,6 @@ from openquake.engine.calculators.risk.classical import core as classical
 from openquake.engine.utils import tasks
 from openquake.engine import logs
 from openquake.engine.db import models
-from django.db import transaction
 
 
 @tasks.oqtask
@@ -93,11 +92,10 @@ def classical_bcr(job_id, hazard, vulnerability_function,
                 for i, asset in enumerate(assets)]
 
         with logs.tracing('writing results'):
-            with transaction.commit_on_success(using='reslt_writer'):
-                for i, asset in enumerate(assets):
-                    general.write_bcr_distribution(
-                        bcr_distribution_id, asset,
-                        eal_original[i], eal_retrofitted[i], bcr_results[i])
+            with general.BulkResultWriter() as result_writer:
+                general.write_bcr_distribution(
+                    result_writer, bcr_distribution_id, assets,
+                    eal_original, eal_retrofitted, bcr_results)
 
     base.signal_task_complete(job_id=job_id,
                               num_items=len(assets) + len(missings))
@@ -19,12 +19,14 @@ Core functionality for the classical PSHA risk calculator.
 """
 
 from collections import OrderedDict
+
 import numpy
 
 from django import db
 
 from openquake.risklib import api, scientific
 
+from openquake.engine import writer
 from openquake.engine.calculators.risk import hazard_getters
 from openquake.engine.calculators.risk import general
 from openquake.engine.db import models
@@ -32,6 +34,10 @@ from openquake.engine.utils import tasks
 from openquake.engine import logs
 from openquake.engine.calculators import base
 
+#: The number of event loss tables received from the tasks that are
+#: merged at once on the control node
+EVENT_LOSS_TABLES_TO_MERGE = 100
+
 
 @tasks.oqtask
 @general.count_progress_risk('r')
@@ -77,15 +83,14 @@ def event_based(job_id, hazard,
     """
 
     loss_ratio_curves = OrderedDict()
-    event_loss_table = dict()
+    aggregate_losses = dict()
 
     for hazard_output_id, hazard_data in hazard.items():
         hazard_getter, _ = hazard_data
 
         (loss_curve_id, loss_map_ids,
          mean_loss_curve_id, quantile_loss_curve_ids,
-         insured_curve_id, aggregate_loss_curve_id) = (
-             output_containers[hazard_output_id])
+         insured_curve_id, _) = output_containers[hazard_output_id]
 
         # FIXME(lp). We should not pass the exact same seed for
         # different hazard
@@ -98,19 +103,17 @@ def event_based(job_id, hazard,
             correlation=asset_correlation)
 
         with logs.tracing('getting input data from db'):
-            assets, gmvs_ruptures, missings = hazard_getter()
+            assets, (ground_motion_values, rupture_ids), missings = (
+                hazard_getter())
 
-        if len(assets):
-            ground_motion_values = numpy.array(gmvs_ruptures)[:, 0]
-            rupture_id_matrix = numpy.array(gmvs_ruptures)[:, 1]
-        else:
+        if not len(assets):
             # we are relying on the fact that if all the hazard_getter
             # in this task will either return some results or they all
             # return an empty result set.
             logs.LOG.info("Exit from task as no asset could be processed")
             base.signal_task_complete(
                 job_id=job_id,
-                event_loss_table=dict(),
+                aggregate_losses=aggregate_losses,
                 num_items=len(missings))
             return
 
@@ -119,24 +122,24 @@ def event_based(job_id, hazard,
                 calculator(ground_motion_values))
 
         with logs.tracing('writing results'):
-            with db.transaction.commit_on_success(using='reslt_writer'):
-                for i, loss_ratio_curve in enumerate(
-                        loss_ratio_curves[hazard_output_id]):
-                    asset = assets[i]
-
-                    # loss curves
-                    general.write_loss_curve(
-                        loss_curve_id, asset, loss_ratio_curve)
-
-                    # loss maps
-                    for poe in conditional_loss_poes:
-                        general.write_loss_map_data(
-                            loss_map_ids[poe], asset,
-                            scientific.conditional_loss_ratio(
-                                loss_ratio_curve, poe))
-
-                    # insured losses
-                    if insured_losses:
+            with general.BulkResultWriter() as result_writer:
+                curves = loss_ratio_curves[hazard_output_id]
+
+                # loss curves
+                general.write_loss_curves(
+                    result_writer, loss_curve_id, assets, curves)
+
+                # loss maps
+                for poe in conditional_loss_poes:
+                    general.write_loss_maps(
+                        result_writer, loss_map_ids[poe], assets,
+                        [scientific.conditional_loss_ratio(curve, poe)
+                         for curve in curves])
+
+                # insured losses
+                if insured_losses:
+                    insured_loss_curves = []
+                    for i, asset in enumerate(assets):
                         insured_loss_curve = scientific.event_based(
                             scientific.insured_losses(
                                 loss_ratio_matrix[i],
@@ -149,22 +152,18 @@ def event_based(job_id, hazard,
 
                         insured_loss_curve.abscissae = (
                             insured_loss_curve.abscissae / asset.value)
-                        general.write_loss_curve(
-                            insured_curve_id, asset, insured_loss_curve)
-
-                # update the event loss table of this task
-                for i, asset in enumerate(assets):
-                    for j, rupture_id in enumerate(rupture_id_matrix[i]):
-                        loss = loss_ratio_matrix[i][j] * asset.value
-                        event_loss_table[rupture_id] = (
-                            event_loss_table.get(rupture_id, 0) + loss)
-
-                # update the aggregate losses
-                aggregate_losses = sum(
-                    loss_ratio_matrix[i] * asset.value
-                    for i, asset in enumerate(assets))
-                general.update_aggregate_losses(
-                    aggregate_loss_curve_id, aggregate_losses)
+                        insured_loss_curves.append(insured_loss_curve)
+                    general.write_loss_curves(
+                        result_writer, insured_curve_id, assets,
+                        insured_loss_curves)
+
+                # the losses of all the assets, for each rupture. They
+                # are summed with the ones of the other tasks by the
+                # control node, which derives from them both the
+                # aggregate loss curve and the event loss table
+                losses = numpy.dot(
+                    [asset.value for asset in assets], loss_ratio_matrix)
+                aggregate_losses[hazard_output_id] = (rupture_ids, losses)
 
     # compute mean and quantile loss curves if multiple hazard
     # realizations are computed
@@ -172,29 +171,48 @@ def event_based(job_id, hazard,
         weights = [data[1] for _, data in hazard.items()]
 
         with logs.tracing('writing curve statistics'):
-            with db.transaction.commit_on_success(using='reslt_writer'):
-                loss_ratio_curve_matrix = loss_ratio_curves.values()
-
+            with general.BulkResultWriter() as result_writer:
                 # here we are relying on the fact that assets do not
                 # change across different logic tree realizations (as
                 # the hazard grid does not change, so the hazard
                 # getters always returns the same assets)
-                for i, asset in enumerate(assets):
-                    general.curve_statistics(
-                        asset,
-                        loss_ratio_curve_matrix[i],
-                        weights,
-                        mean_loss_curve_id,
-                        quantile_loss_curve_ids,
-                        hazard_montecarlo_p,
-                        assume_equal="image")
-
-    base.signal_task_complete(job_id=job_id,
-                              num_items=len(assets) + len(missings),
-                              event_loss_table=event_loss_table)
+                general.curve_statistics(
+                    result_writer,
+                    assets,
+                    loss_ratio_curves.values(),
+                    weights,
+                    mean_loss_curve_id,
+                    quantile_loss_curve_ids,
+                    hazard_montecarlo_p,
+                    assume_equal="image")
+
+    base.signal_task_complete(
+        job_id=job_id,
+        num_items=len(assets) + len(missings),
+        aggregate_losses=aggregate_losses)
 event_based.ignore_result = False
 
 
+def merge_event_loss_tables(tables):
+    """
+    Merge event loss tables, by summing the losses of the same ruptures.
+
+    :param tables:
+        A sequence of event loss tables, i.e. pairs (rupture_ids, losses)
+        of numpy arrays of the same length.
+    :returns:
+        An event loss table with sorted and unique rupture ids.
+    """
+    if not tables:
+        return numpy.array([], dtype=int), numpy.array([])
+
+    rupture_ids, idxs = numpy.unique(
+        numpy.concatenate([ids for ids, _ in tables]), return_inverse=True)
+    losses = numpy.bincount(
+        idxs, weights=numpy.concatenate([losses for _, losses in tables]))
+    return rupture_ids, losses
+
+
 class EventBasedRiskCalculator(general.BaseRiskCalculator):
     """
     Probabilistic Event Based PSHA risk calculator. Computes loss
@@ -209,15 +227,25 @@ class EventBasedRiskCalculator(general.BaseRiskCalculator):
 
     def __init__(self, job):
         super(EventBasedRiskCalculator, self).__init__(job)
-        self.event_loss_table = dict()
+        # hazard output id -> the aggregate losses per rupture received
+        # from the tasks, not summed yet
+        self.aggregate_losses = dict()
 
     def task_completed_hook(self, message):
         """
-        Updates the event loss table
+        Collects the aggregate losses per rupture of a task, from which
+        both the aggregate loss curves and the event loss table are
+        computed by :meth:`post_process`. The tables of each hazard output
+        are merged every :data:`EVENT_LOSS_TABLES_TO_MERGE` messages, to
+        limit the memory needed.
         """
-        for rupture_id, aggregate_loss in message['event_loss_table'].items():
-            self.event_loss_table[rupture_id] = (
-                self.event_loss_table.get(rupture_id, 0) + aggregate_loss)
+        for hazard_output_id, losses in message.get(
+                'aggregate_losses', {}).iteritems():
+            tables = self.aggregate_losses.setdefault(hazard_output_id, [])
+            tables.append(losses)
+            if len(tables) >= EVENT_LOSS_TABLES_TO_MERGE:
+                self.aggregate_losses[hazard_output_id] = [
+                    merge_event_loss_tables(tables)]
 
     def pre_execute(self):
         """
@@ -237,6 +265,9 @@ class EventBasedRiskCalculator(general.BaseRiskCalculator):
                 "Deductible or insured limit missing in exposure")
 
     def post_process(self):
+        # the losses of the ruptures of all the hazard outputs
+        event_loss_tables = []
+
         # compute aggregate loss curves
         for hazard_output in self.considered_hazard_outputs():
             loss_curve = models.LossCurve.objects.get(
@@ -246,8 +277,15 @@ class EventBasedRiskCalculator(general.BaseRiskCalculator):
 
             tses, time_span = self.hazard_times()
 
+            # sum the losses of the same ruptures computed by
+            # different tasks
+            event_loss_table = merge_event_loss_tables(
+                self.aggregate_losses.pop(hazard_output.id, []))
+            event_loss_tables.append(event_loss_table)
+            _, aggregate_losses = event_loss_table
+
             aggregate_loss_curve = scientific.event_based(
-                curve_data.losses, tses, time_span,
+                aggregate_losses, tses, time_span,
                 curve_resolution=self.rc.loss_curve_resolution)
 
             curve_data.losses = aggregate_loss_curve.abscissae.tolist()
@@ -257,11 +295,17 @@ class EventBasedRiskCalculator(general.BaseRiskCalculator):
         event_loss_table_output = models.Output.objects.create_output(
             self.job, "Event Loss Table", "event_loss")
 
-        for rupture_id, aggregate_loss in self.event_loss_table.items():
-            models.EventLoss.objects.create(
-                output=event_loss_table_output,
-                rupture_id=rupture_id,
-                aggregate_loss=aggregate_loss)
+        rupture_ids, losses = merge_event_loss_tables(event_loss_tables)
+
+        with db.transaction.commit_on_success(using='reslt_writer'):
+            inserter = writer.CopyBulkInserter(models.EventLoss)
+            for rupture_id, aggregate_loss in zip(
+                    rupture_ids.tolist(), losses.tolist()):
+                inserter.add_entry(
+                    output_id=event_loss_table_output.id,
+                    rupture_id=rupture_id,
+                    aggregate_loss=aggregate_loss)
+            inserter.flush()
 
     def create_getter(self, output, assets):
         """
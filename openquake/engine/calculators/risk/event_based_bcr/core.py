@@ -17,8 +17,6 @@
 Core functionality for the Event Based BCR Risk calculator.
 """
 
-import numpy
-
 from openquake.risklib import api, scientific
 
 from openquake.engine.calculators import base
@@ -27,7 +25,6 @@ from openquake.engine.calculators.risk.event_based import core as event_based
 from openquake.engine.utils import tasks
 from openquake.engine import logs
 from openquake.engine.db import models
-from django.db import transaction
 
 
 @tasks.oqtask
@@ -90,10 +87,8 @@ def event_based_bcr(job_id, hazard, seed,
             seed=seed, correlation=asset_correlation)
 
         with logs.tracing('getting hazard'):
-            assets, gmvs_ruptures, missings = hazard_getter()
-            if len(assets):
-                ground_motion_values = numpy.array(gmvs_ruptures)[:, 0]
-            else:
+            assets, (ground_motion_values, _), missings = hazard_getter()
+            if not len(assets):
                 # we are relying on the fact that if all the
                 # hazard_getter in this task will either return some
                 # results or they all return an empty result set.
@@ -122,11 +117,10 @@ def event_based_bcr(job_id, hazard, seed,
                 for i, asset in enumerate(assets)]
 
         with logs.tracing('writing results'):
-            with transaction.commit_on_success(using='reslt_writer'):
-                for i, asset in enumerate(assets):
-                    general.write_bcr_distribution(
-                        bcr_distribution_id, asset,
-                        eal_original[i], eal_retrofitted[i], bcr_results[i])
+            with general.BulkResultWriter() as result_writer:
+                general.write_bcr_distribution(
+                    result_writer, bcr_distribution_id, assets,
+                    eal_original, eal_retrofitted, bcr_results)
 
     base.signal_task_complete(job_id=job_id,
                               num_items=len(assets) + len(missings))
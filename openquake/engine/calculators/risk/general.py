@@ -20,12 +20,15 @@
 import os
 import random
 
+import numpy
+
 
 from openquake.risklib import scientific
 
 from django import db
 
 from openquake.engine import logs
+from openquake.engine import writer
 from openquake.engine.utils import config
 from openquake.engine.db import models
 from openquake.engine.calculators import base, post_processing
@@ -176,12 +179,15 @@ class BaseRiskCalculator(base.CalculatorNext):
 
         for taxonomy, assets_nr in self.taxonomies.items():
             asset_offsets = range(0, assets_nr, block_size)
+            assets = None
 
             for offset in asset_offsets:
                 with logs.tracing("getting assets"):
+                    # each chunk starts after the last asset of the
+                    # previous one
                     assets = self.rc.exposure_model.get_asset_chunk(
-                        taxonomy,
-                        self.rc.region_constraint, offset, block_size)
+                        taxonomy, self.rc.region_constraint, block_size,
+                        assets[-1] if assets else None)
 
                 hazard = dict((ho.id, self.create_getter(ho, assets))
                               for ho in self.considered_hazard_outputs())
@@ -470,52 +476,69 @@ def hazard_getter(hazard_getter_name, hazard_id, *args):
     return getattr(hazard_getters, hazard_getter_name)(hazard_id, *args)
 
 
-def write_loss_curve(loss_curve_id, asset, loss_ratio_curve):
+class BulkResultWriter(object):
     """
-    Stores and returns a :class:`openquake.engine.db.models.LossCurveData`
-    where the data are got by `asset_output` and the
-    :class:`openquake.engine.db.models.LossCurve` output container is
-    identified by `loss_curve_id`.
+    Buffers the results computed by a risk task and writes them with a
+    `COPY` statement per table, all in one transaction.
 
-    :param int loss_curve_id: the ID of the output container
-    :param asset: an instance of
-           :class:`openquake.engine.db.models.ExposureData`
-    :param loss_ratio_curve: an instance of
-           :class:`openquake.risklib.curve.Curve`
+    It is meant to be used as a context manager: the results are
+    written on exit, unless an exception has been raised.
     """
 
-    return models.LossCurveData.objects.create(
-        loss_curve_id=loss_curve_id,
-        asset_ref=asset.asset_ref,
-        location=asset.site,
-        poes=loss_ratio_curve.ordinates,
-        loss_ratios=loss_ratio_curve.abscissae,
-        asset_value=asset.value)
+    def __init__(self):
+        self.inserters = dict()
 
+    def add(self, dj_model, **kwargs):
+        """
+        Buffer a row to be inserted in the table of `dj_model`. See
+        :meth:`openquake.engine.writer.CopyBulkInserter.add_entry`.
+        """
+        inserter = self.inserters.get(dj_model)
+        if inserter is None:
+            inserter = self.inserters[dj_model] = writer.CopyBulkInserter(
+                dj_model)
+        inserter.add_entry(**kwargs)
 
-@db.transaction.commit_on_success
-def update_aggregate_losses(curve_id, losses):
-    """
-    Update an aggregate loss curve with new `losses` (that will be
-    added)
+    def flush(self):
+        """
+        Write all the buffered rows
+        """
+        with db.transaction.commit_on_success(using='reslt_writer'):
+            for inserter in self.inserters.values():
+                inserter.flush()
 
-    :type losses: numpy array
-    """
+    def __enter__(self):
+        return self
 
-    # to avoid race conditions we lock the table
-    query = """
-      SELECT * FROM riskr.aggregate_loss_curve_data WHERE
-      loss_curve_id = %s FOR UPDATE
-    """
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
 
-    [curve_data] = models.AggregateLossCurveData.objects.raw(query, [curve_id])
 
-    if curve_data.losses:
-        curve_data.losses = losses + curve_data.losses
-    else:
-        curve_data.losses = losses
+def write_loss_curves(result_writer, loss_curve_id, assets,
+                      loss_ratio_curves):
+    """
+    Add to `result_writer` a :class:`openquake.engine.db.models.LossCurveData`
+    for each asset, linked to the
+    :class:`openquake.engine.db.models.LossCurve` output container
+    identified by `loss_curve_id`.
 
-    curve_data.save()
+    :param result_writer: a :class:`BulkResultWriter` instance
+    :param int loss_curve_id: the ID of the output container
+    :param assets: a list of
+           :class:`openquake.engine.db.models.ExposureData`
+    :param loss_ratio_curves: a list of
+           :class:`openquake.risklib.curve.Curve`, one per asset
+    """
+    for asset, loss_ratio_curve in zip(assets, loss_ratio_curves):
+        result_writer.add(
+            models.LossCurveData,
+            loss_curve_id=loss_curve_id,
+            asset_ref=asset.asset_ref,
+            location=asset.site.wkt,
+            poes=loss_ratio_curve.ordinates,
+            loss_ratios=loss_ratio_curve.abscissae,
+            asset_value=asset.value)
 
 
 # FIXME
@@ -523,99 +546,136 @@ def update_aggregate_losses(curve_id, losses):
 # is a different concept with respect to a loss map
 # for a different calculator.
 
-def write_loss_map_data(loss_map_id, asset, loss_ratio, std_dev=None):
+def write_loss_maps(result_writer, loss_map_id, assets, loss_ratios,
+                    std_devs=None):
     """
-    Create :class:`openquake.engine.db.models.LossMapData`
+    Add to `result_writer` a :class:`openquake.engine.db.models.LossMapData`
+    for each asset.
 
+    :param result_writer: a :class:`BulkResultWriter` instance
     :param int loss_map_id: the ID of the output container
-    :param asset: an instance of
+    :param assets: a list of
            :class:`openquake.engine.db.models.ExposureData`
-    :param float value: loss ratio value
-    :param float std_dev: std dev on loss ratios.
+    :param loss_ratios: the loss ratio values, one per asset
+    :param std_devs: the std devs on the loss ratios, one per asset
     """
 
-    if std_dev is not None:
-        std_dev = std_dev * asset.value
+    if std_devs is None:
+        std_devs = [None] * len(assets)
+
+    for asset, loss_ratio, std_dev in zip(assets, loss_ratios, std_devs):
+        if std_dev is not None:
+            std_dev = std_dev * asset.value
 
-    return models.LossMapData.objects.create(
-        loss_map_id=loss_map_id,
-        asset_ref=asset.asset_ref,
-        value=loss_ratio * asset.value,
-        std_dev=std_dev,
-        location=asset.site)
+        result_writer.add(
+            models.LossMapData,
+            loss_map_id=loss_map_id,
+            asset_ref=asset.asset_ref,
+            value=loss_ratio * asset.value,
+            std_dev=std_dev,
+            location=asset.site.wkt)
 
 
-def write_bcr_distribution(
-        bcr_distribution_id, asset, eal_original, eal_retrofitted, bcr):
+def write_bcr_distribution(result_writer, bcr_distribution_id, assets,
+                           eals_original, eals_retrofitted, bcrs):
     """
-    Create a new :class:`openquake.engine.db.models.BCRDistributionData` from
-    `asset_output` and links it to the output container identified by
+    Add to `result_writer` a
+    :class:`openquake.engine.db.models.BCRDistributionData` for each
+    asset, linked to the output container identified by
     `bcr_distribution_id`.
 
+    :param result_writer: a :class:`BulkResultWriter` instance
+
     :param int bcr_distribution_id: the ID of
     :class:`openquake.engine.db.models.BCRDistribution` instance that holds
     the BCR map
 
-    :param asset: an instance of
+    :param assets: a list of
         :class:`openquake.engine.db.models.ExposureData`
 
-    :param float eal_original: expected annual loss in the original model
-    for the asset
-    :param float eal_retrofitted: expected annual loss in the retrofitted model
-    for the asset
-    :param float bcr: Benefit Cost Ratio parameter
+    :param eals_original: expected annual losses in the original model,
+    one per asset
+    :param eals_retrofitted: expected annual losses in the retrofitted
+    model, one per asset
+    :param bcrs: Benefit Cost Ratio parameters, one per asset
     """
-    models.BCRDistributionData.objects.create(
-        bcr_distribution_id=bcr_distribution_id,
-        asset_ref=asset.asset_ref,
-        average_annual_loss_original=eal_original * asset.value,
-        average_annual_loss_retrofitted=eal_retrofitted * asset.value,
-        bcr=bcr,
-        location=asset.site)
+    for asset, eal_original, eal_retrofitted, bcr in zip(
+            assets, eals_original, eals_retrofitted, bcrs):
+        result_writer.add(
+            models.BCRDistributionData,
+            bcr_distribution_id=bcr_distribution_id,
+            asset_ref=asset.asset_ref,
+            average_annual_loss_original=eal_original * asset.value,
+            average_annual_loss_retrofitted=eal_retrofitted * asset.value,
+            bcr=bcr,
+            location=asset.site.wkt)
+
 
+def curve_statistics(result_writer, assets, loss_ratio_curve_matrix,
+                     curves_weights, mean_loss_curve_id,
+                     quantile_loss_curve_ids, explicit_quantiles,
+                     assume_equal):
+    """
+    Add to `result_writer` the mean and quantile loss curves of the
+    given `assets`. The statistics of all the assets are computed at
+    once.
 
-def curve_statistics(asset, loss_ratio_curves, curves_weights,
-                     mean_loss_curve_id, quantile_loss_curve_ids,
-                     explicit_quantiles, assume_equal):
+    :param result_writer: a :class:`BulkResultWriter` instance
+    :param assets: a list of
+           :class:`openquake.engine.db.models.ExposureData`
+    :param loss_ratio_curve_matrix: a list with the loss ratio curves
+           (:class:`openquake.risklib.curve.Curve`) of the assets for
+           each hazard output
+    :param curves_weights: the weights of the hazard outputs
+    """
 
     if assume_equal == 'support':
-        loss_ratios = loss_ratio_curves[0].abscissae
-        curves_poes = [curve.ordinates for curve in loss_ratio_curves]
+        loss_ratios = [curve.abscissae for curve in loss_ratio_curve_matrix[0]]
+        curves_poes = [[curve.ordinates for curve in curves]
+                       for curves in loss_ratio_curve_matrix]
     elif assume_equal == 'image':
-        loss_ratios = loss_ratio_curves[0].abscissae
-        curves_poes = [curve.ordinate_for(loss_ratios)
-                       for curve in loss_ratio_curves]
+        loss_ratios = [curve.abscissae for curve in loss_ratio_curve_matrix[0]]
+        curves_poes = [[curve.ordinate_for(loss_ratios[i])
+                        for i, curve in enumerate(curves)]
+                       for curves in loss_ratio_curve_matrix]
     else:
         raise NotImplementedError
 
+    # a (hazard outputs x assets x loss ratios) matrix
+    curves_poes = numpy.array(curves_poes)
+
     for quantile, quantile_loss_curve_id in quantile_loss_curve_ids.items():
         if explicit_quantiles:
-            q_curve = post_processing.weighted_quantile_curve(
+            q_curves = post_processing.weighted_quantile_curve(
                 curves_poes, curves_weights, quantile)
         else:
-            q_curve = post_processing.quantile_curve(
+            q_curves = post_processing.quantile_curve(
                 curves_poes, quantile)
 
-        models.LossCurveData.objects.create(
-            loss_curve_id=quantile_loss_curve_id,
-            asset_ref=asset.asset_ref,
-            poes=q_curve.tolist(),
-            loss_ratios=loss_ratios,
-            asset_value=asset.value,
-            location=asset.site.wkt)
+        for i, asset in enumerate(assets):
+            result_writer.add(
+                models.LossCurveData,
+                loss_curve_id=quantile_loss_curve_id,
+                asset_ref=asset.asset_ref,
+                poes=q_curves[i].tolist(),
+                loss_ratios=loss_ratios[i],
+                asset_value=asset.value,
+                location=asset.site.wkt)
 
     # then means
     if mean_loss_curve_id:
-        mean_curve = post_processing.mean_curve(
+        mean_curves = post_processing.mean_curve(
             curves_poes, weights=curves_weights)
 
-        models.LossCurveData.objects.create(
-            loss_curve_id=mean_loss_curve_id,
-            asset_ref=asset.asset_ref,
-            poes=mean_curve.tolist(),
-            loss_ratios=loss_ratios,
-            asset_value=asset.value,
-            location=asset.site.wkt)
+        for i, asset in enumerate(assets):
+            result_writer.add(
+                models.LossCurveData,
+                loss_curve_id=mean_loss_curve_id,
+                asset_ref=asset.asset_ref,
+                poes=mean_curves[i].tolist(),
+                loss_ratios=loss_ratios[i],
+                asset_value=asset.value,
+                location=asset.site.wkt)
 
 
 class count_progress_risk(stats.count_progress):   # pylint: disable=C0103
@@ -23,8 +23,14 @@ calculation.
 """
 
 from collections import OrderedDict
+
+import numpy
+from scipy.spatial import cKDTree
+
 from openquake.engine import logs
 from openquake.hazardlib import geo
+from openquake.hazardlib.geo import geodetic
+from openquake.hazardlib.geo import utils as geo_utils
 from openquake.engine.db import models
 from django.db import connection
 
@@ -65,7 +71,6 @@ class HazardGetter(object):
         self._imt, self._sa_period, self._sa_damping = (
             models.parse_imt(self.imt))
         self.asset_dict = dict((asset.id, asset) for asset in self.assets)
-        self._cache = {}
 
     def get_data(self):
         """
@@ -118,14 +123,12 @@ class HazardGetter(object):
 
 class HazardCurveGetterPerAsset(HazardGetter):
     """
-    Simple HazardCurve Getter that performs a spatial query for each
-    asset.
+    HazardCurve Getter that loads with a single query the hazard curves
+    around the assets, and then looks up the closest curve of each asset
+    with an in-memory spatial index.
 
     :attr imls: the intensity measure levels of the curves we are
     going to get.
-
-    :attr dict _cache: a cache of the computed hazard curve object on
-    a per-location basis.
     """
 
     def __init__(self, hazard_id, imt, assets, max_distance):
@@ -136,50 +139,48 @@ class HazardCurveGetterPerAsset(HazardGetter):
 
     def get_data(self):
         """
-        Calls ``get_by_site`` for each asset and pack the results as
+        Get the hazard curves of the sites inside the assets extent
+        (dilated by the maximum distance), build a KD-tree of the sites and
+        query it for all the assets at once. Pack the results as
         requested by the :method:`HazardGetter.get_data` interface.
         """
-        hazard_assets = [(asset.id, self.get_by_site(asset.site))
-                         for asset in self.assets]
-
-        return OrderedDict(
-            [(asset_id, hazard_curve)
-             for asset_id, (hazard_curve, distance) in hazard_assets
-             if distance < self.max_distance * KILOMETERS_TO_METERS])
-
-    def get_by_site(self, site):
-        """
-        :param site: an instance of
-        :class:`django.contrib.gis.geos.point.Point` corresponding to
-        the location of an asset.
-        """
-        if site.wkt in self._cache:
-            return self._cache[site.wkt]
-
         cursor = connection.cursor()
 
         query = """
-        SELECT
-            hzrdr.hazard_curve_data.poes,
-            min(ST_Distance(location::geography,
-                            ST_GeographyFromText(%s), false))
-                AS min_distance
+        SELECT ST_X(location), ST_Y(location), poes
         FROM hzrdr.hazard_curve_data
         WHERE hazard_curve_id = %s
-        GROUP BY id
-        ORDER BY min_distance
-        LIMIT 1;"""
+        AND location && ST_GeomFromText(%s, 4326)"""
 
-        args = (site.wkt, self.hazard_id)
+        assets_extent = self._assets_mesh.get_convex_hull()
+        args = (self.hazard_id, assets_extent.dilate(self.max_distance).wkt)
 
         cursor.execute(query, args)
-        poes, distance = cursor.fetchone()
+        data = cursor.fetchall()
 
-        hazard = zip(self.imls, poes)
+        if not data:
+            return OrderedDict()
 
-        self._cache[site.wkt] = (hazard, distance)
+        lons, lats, curves = zip(*data)
+        lons = numpy.array(lons)
+        lats = numpy.array(lats)
 
-        return hazard, distance
+        asset_lons = self._assets_mesh.lons
+        asset_lats = self._assets_mesh.lats
+
+        # the closest points in the 3d space are the closest ones on the
+        # sphere too
+        site_index = cKDTree(geo_utils.spherical_to_cartesian(
+            lons, lats, numpy.zeros(len(lons))))
+        _, idxs = site_index.query(geo_utils.spherical_to_cartesian(
+            asset_lons, asset_lats, numpy.zeros(len(asset_lons))))
+        distances = geodetic.geodetic_distance(
+            asset_lons, asset_lats, lons[idxs], lats[idxs])
+
+        return OrderedDict(
+            [(asset.id, zip(self.imls, curves[idx]))
+             for asset, idx, distance in zip(self.assets, idxs, distances)
+             if distance < self.max_distance])
 
 
 class GroundMotionValuesGetter(HazardGetter):
@@ -263,42 +264,46 @@ class GroundMotionValuesGetter(HazardGetter):
 
         data = cursor.fetchall()
 
-        # nested dicts with structure: asset_id -> (rupture_id -> gmv)
-        assets_ruptures_gmvs = OrderedDict()
-
-        # store all the ruptures returned by the query
-        ruptures = []
-
-        for asset_id, gmvs, rupture_ids in data:
-            assets_ruptures_gmvs[asset_id] = dict(zip(rupture_ids, gmvs))
-            ruptures.extend(rupture_ids)
-        ruptures = set(ruptures)
-
         # We expect that the query may return a different number of
         # gmvs and ruptures for each asset (because only the ruptures
-        # that gives a positive ground shaking are stored). Here on,
-        # we finalize `assets_ruptures_gmvs` by filling in with zero
-        # values for each rupture that has not given a contribute.
+        # that gives a positive ground shaking are stored). Here on, we
+        # build a dense (assets x ruptures) matrix, with zero values for
+        # each rupture that has not given a contribute, by scattering the
+        # ground motion values of each asset in the columns corresponding
+        # to its ruptures (the columns are sorted by rupture id).
+        if data:
+            self.rupture_ids = numpy.unique(numpy.concatenate(
+                [rupture_ids for _, _, rupture_ids in data]))
+        else:
+            self.rupture_ids = numpy.array([], dtype=int)
 
-        # for each asset, we look for missing ruptures
-        for asset_id, ruptures_gmvs_dict in assets_ruptures_gmvs.items():
+        gmvs = numpy.zeros((len(data), len(self.rupture_ids)))
+        for i, (_, asset_gmvs, rupture_ids) in enumerate(data):
+            gmvs[i, self.rupture_ids.searchsorted(rupture_ids)] = asset_gmvs
 
-            # all the ruptures producing a positive ground shaking for
-            # `asset`
-            asset_ruptures = set(ruptures_gmvs_dict)
+        # maps asset_id -> to the ground motion values of the asset
+        return OrderedDict([
+            (asset_id, gmvs[i]) for i, (asset_id, _, _) in enumerate(data)])
 
-            missing_ruptures = ruptures - asset_ruptures
+    def __call__(self):
+        """
+        :returns: a tuple with three elements. The first is an array
+        of instances of
+        :class:`openquake.engine.db.models.ExposureData`, the second
+        is a tuple with the (assets x ruptures) matrix of the ground
+        motion values and the sorted array of the corresponding rupture
+        ids, the third is the array of IDs of assets that has been
+        filtered out by the getter by the ``maximum_distance`` criteria.
+        """
+        assets, gmvs, missing_asset_ids = super(
+            GroundMotionValuesGetter, self).__call__()
 
-            # we finalize the asset data with 0
-            for rupture_id in missing_ruptures:
-                ruptures_gmvs_dict[rupture_id] = 0.
+        if assets:
+            gmvs = numpy.array(gmvs)
+        else:
+            gmvs = numpy.zeros((0, len(self.rupture_ids)))
 
-        # maps asset_id -> to a 2-tuple (rupture_ids, gmvs)
-        return OrderedDict([
-            (asset_id, zip(
-                *sorted(zip(asset_data.values(), asset_data.keys()),
-                        key=lambda x: x[1])))
-            for asset_id, asset_data in assets_ruptures_gmvs.items()])
+        return assets, (gmvs, self.rupture_ids), missing_asset_ids
 
 
 class GroundMotionScenarioGetter(HazardGetter):
@@ -86,18 +86,20 @@ def scenario(job_id, hazard, seed, vulnerability_function, output_containers,
     if insured_losses:
         insured_loss_map_id = output_containers[1]
 
-    with db.transaction.commit_on_success(using='reslt_writer'):
-        for i, asset in enumerate(assets):
-            general.write_loss_map_data(
-                loss_map_id, asset,
-                loss_ratio_matrix[i].mean(),
-                std_dev=loss_ratio_matrix[i].std(ddof=1))
-
-            if insured_losses:
-                general.write_loss_map_data(
-                    insured_loss_map_id, asset,
-                    insured_loss_matrix[i].mean() / asset.value,
-                    std_dev=insured_loss_matrix[i].std(ddof=1) / asset.value)
+    with general.BulkResultWriter() as result_writer:
+        general.write_loss_maps(
+            result_writer, loss_map_id, assets,
+            [loss_ratios.mean() for loss_ratios in loss_ratio_matrix],
+            std_devs=[loss_ratios.std(ddof=1)
+                      for loss_ratios in loss_ratio_matrix])
+
+        if insured_losses:
+            general.write_loss_maps(
+                result_writer, insured_loss_map_id, assets,
+                [insured_loss_matrix[i].mean() / asset.value
+                 for i, asset in enumerate(assets)],
+                std_devs=[insured_loss_matrix[i].std(ddof=1) / asset.value
+                          for i, asset in enumerate(assets)])
 
     aggregate_losses = sum(loss_ratio_matrix[i] * asset.value
                            for i, asset in enumerate(assets))
@@ -21,18 +21,24 @@ Core functionality for the scenario_damage risk calculator.
 """
 
 import numpy
-from django import db
 
 from openquake.nrmllib.risk import parsers
 from openquake.risklib import api, scientific
 from openquake.risklib.models.input import FragilityModel
 
 from openquake.engine.calculators.risk import general
+from openquake.engine.utils import general as general_utils
 from openquake.engine.utils import tasks
 from openquake.engine.db import models
 from openquake.engine import logs
 from openquake.engine.calculators import base
 
+#: The number of risk calculations whose damage states are cached
+DMG_STATES_CACHE_SIZE = 10
+
+# risk calculation id -> list of DmgState objects
+_DMG_STATES_CACHE = general_utils.LRUCache(DMG_STATES_CACHE_SIZE)
+
 
 @tasks.oqtask
 @general.count_progress_risk('r')
@@ -73,11 +79,13 @@ def scenario_damage(job_id, hazard,
     fraction_matrix = calculator(ground_motion_values)
 
     with logs.tracing('save statistics per site'), \
-            db.transaction.commit_on_success(using='reslt_writer'):
+            general.BulkResultWriter() as result_writer:
         rc_id = models.OqJob.objects.get(id=job_id).risk_calculation.id
+        dmg_states = get_dmg_states(rc_id)
         for i, asset in enumerate(assets):
             save_dist_per_asset(
-                fraction_matrix[i] * asset.number_of_units, rc_id, asset)
+                result_writer, fraction_matrix[i] * asset.number_of_units,
+                dmg_states, asset)
 
     # send aggregate fractions to the controller, the hook will collect them
     aggfractions = sum(fraction_matrix[i] * asset.number_of_units
@@ -89,23 +97,39 @@ def scenario_damage(job_id, hazard,
 scenario_damage.ignore_result = False
 
 
-def save_dist_per_asset(fractions, rc_id, asset):
+def get_dmg_states(rc_id):
+    """
+    :param rc_id: the risk_calculation_id
+    :returns: the list of :class:`openquake.engine.db.models.DmgState` of
+    the risk calculation, ordered by limit state index. They are read
+    only once per process.
+    """
+    dmg_states = _DMG_STATES_CACHE.get(rc_id)
+    if dmg_states is None:
+        dmg_states = list(models.DmgState.objects.filter(
+            risk_calculation__id=rc_id).order_by('lsi'))
+        _DMG_STATES_CACHE[rc_id] = dmg_states
+    return dmg_states
+
+
+def save_dist_per_asset(result_writer, fractions, dmg_states, asset):
     """
     Save the damage distribution for a given asset.
 
+    :param result_writer: a
+    :class:`openquake.engine.calculators.risk.general.BulkResultWriter`
     :param fractions: numpy array with the damage fractions
-    :param rc_id: the risk_calculation_id
+    :param dmg_states: the list of DmgState instances
     :param asset: an ExposureData instance
     """
-    dmg_states = models.DmgState.objects.filter(risk_calculation__id=rc_id)
     mean, std = scientific.mean_std(fractions)
     for dmg_state in dmg_states:
         lsi = dmg_state.lsi
-        ddpa = models.DmgDistPerAsset(
-            dmg_state=dmg_state,
+        result_writer.add(
+            models.DmgDistPerAsset,
+            dmg_state_id=dmg_state.id,
             mean=mean[lsi], stddev=std[lsi],
-            exposure_data=asset)
-        ddpa.save()
+            exposure_data_id=asset.id)
 
 
 def save_dist_per_taxonomy(fractions, rc_id, taxonomy):
@@ -117,7 +141,7 @@ def save_dist_per_taxonomy(fractions, rc_id, taxonomy):
     :param int rc_id: the risk_calculation_id
     :param str: the taxonomy string
     """
-    dmg_states = models.DmgState.objects.filter(risk_calculation__id=rc_id)
+    dmg_states = get_dmg_states(rc_id)
     mean, std = scientific.mean_std(fractions)
     for dmg_state in dmg_states:
         lsi = dmg_state.lsi
@@ -135,7 +159,7 @@ def save_dist_total(fractions, rc_id):
     :param fractions: numpy array with the damage fractions
     :param int rc_id: the risk_calculation_id
     """
-    dmg_states = models.DmgState.objects.filter(risk_calculation__id=rc_id)
+    dmg_states = get_dmg_states(rc_id)
     mean, std = scientific.mean_std(fractions)
     for dmg_state in dmg_states:
         lsi = dmg_state.lsi
@@ -21,9 +21,7 @@ This module defines some classes useful to perform bulk insert of
 statistical outputs (mean curves, quantile curves, hazard maps, etc.)
 """
 
-import shapely
-
-from openquake.engine.writer import BulkInserter
+from openquake.engine.writer import CopyBulkInserter
 from openquake.engine.db import models
 from django.db import transaction
 
@@ -46,7 +44,7 @@ class AggregateResultWriter(object):
     def __init__(self, job, imt):
         self._job = job
         self._imt = imt
-        self._inserter = BulkInserter(self.__class__.model)
+        self._inserter = CopyBulkInserter(self.__class__.model)
         self._aggregate_result = None
         self._transaction_handler = None
 
@@ -133,9 +131,7 @@ class AggregateCurveWriter(AggregateResultWriter):
         :param poes
           a list of poe
         """
-
-        location_wkt = shapely.wkb.loads(str(location)).wkt
-        self._inserter.add_entry(location=location_wkt, poes=poes,
+        self._inserter.add_entry(location=location, poes=poes,
                                  hazard_curve_id=self._aggregate_result.pk)
 
 
@@ -17,6 +17,8 @@
 
 import numpy
 import re
+import struct
+import zlib
 try:
     import simplejson as json
 except ImportError:
@@ -32,6 +34,9 @@ from django.contrib.gis.db import models as djm
 #: regex for splitting string lists on whitespace and/or commas
 ARRAY_RE = re.compile('[\s,]+')
 
+#: Magic string at the beginning of the values of a :class:`NumpyArrayField`
+NUMPY_ARRAY_MAGIC = 'NPA1'
+
 # Disable pylint for 'Too many public methods'
 # pylint: disable=R0904
 
@@ -295,12 +300,125 @@ class NumpyListField(PickleField):
         if isinstance(value, numpy.ndarray):
             return super(NumpyListField, self).get_prep_value(value.tolist())
         else:
-            if not instance(value, (list, tuple)):
+            if not isinstance(value, (list, tuple)):
                 raise ValueError(
                     "Unexpected value of type '%s'. Expected 'list', 'tuple', "
                     "or 'numpy.ndarray'"
                     % type(value)
                 )
+            return super(NumpyListField, self).get_prep_value(value)
+
+
+class NumpyArrayField(djm.Field):
+    """
+    Field for storing numpy arrays as binary blobs: a header with the dtype
+    and the shape of the array, followed by the raw (C-contiguous) data,
+    optionally compressed with zlib.
+
+    The layout of a value is the following:
+
+    * the :data:`NUMPY_ARRAY_MAGIC` string
+    * a byte, 1 if the data is compressed, 0 otherwise
+    * the length of the dtype string (a byte), followed by the dtype string
+      (e.g. `<f8`)
+    * the number of dimensions (a byte), followed by the dimensions (as
+      unsigned 64 bit integers)
+    * the data
+
+    Arrays are decoded with `numpy.frombuffer`, without copying the data
+    (compressed arrays share the memory of the decompressed string). Such
+    arrays are read-only: consumers changing them in place must copy them
+    first.
+
+    Values in the old pickled format (see :class:`PickleField` and
+    :class:`NumpyListField`) are still decoded, so that the columns can be
+    switched to this field type without converting the existing data; such
+    values are written in the new format the next time they are saved.
+
+    :param bool compress:
+        If `True`, compress the data with zlib (useful for sparse matrices).
+    """
+
+    __metaclass__ = djm.SubfieldBase
+
+    SUPPORTED_BACKENDS = PickleField.SUPPORTED_BACKENDS
+
+    def __init__(self, *args, **kwargs):
+        self.compress = kwargs.pop('compress', False)
+        super(NumpyArrayField, self).__init__(*args, **kwargs)
+
+    def db_type(self, connection):
+        """Return "bytea" as postgres' column type."""
+        assert connection.settings_dict['ENGINE'] in self.SUPPORTED_BACKENDS
+        return 'bytea'
+
+    def to_python(self, value):
+        """
+        Decode a `numpy.ndarray` from the given ``value``.
+
+        :param value:
+            A `buffer`, `str` or `bytearray` in the format described above,
+            or a pickled `list`, `tuple` or `numpy.ndarray`.
+        """
+        if value is None or isinstance(value, numpy.ndarray):
+            return value
+        if isinstance(value, (list, tuple)):
+            return numpy.array(value)
+        if not isinstance(value, (buffer, str, bytearray)):
+            raise ValueError(
+                "Unexpected value of type '%s'." % type(value))
+
+        if isinstance(value, bytearray):
+            value = buffer(value)
+        if value[:len(NUMPY_ARRAY_MAGIC)] != NUMPY_ARRAY_MAGIC:
+            # a value saved with the old pickled format
+            return numpy.array(pickle.loads(str(value)))
+
+        offset = len(NUMPY_ARRAY_MAGIC)
+        compressed, dtype_len = struct.unpack('<BB', value[offset:offset + 2])
+        offset += 2
+        dtype = numpy.dtype(value[offset:offset + dtype_len])
+        offset += dtype_len
+        [ndim] = struct.unpack('<B', value[offset:offset + 1])
+        offset += 1
+        shape = struct.unpack('<%dQ' % ndim, value[offset:offset + 8 * ndim])
+        offset += 8 * ndim
+
+        if compressed:
+            array = numpy.frombuffer(
+                zlib.decompress(value[offset:]), dtype=dtype)
+        else:
+            array = numpy.frombuffer(value, dtype=dtype, offset=offset)
+        return array.reshape(shape)
+
+    def get_prep_value(self, value):
+        """
+        Encode the ``value`` in the format described above.
+
+        :param value:
+            A `numpy.ndarray`, or a `list` or `tuple` which can be converted
+            to a `numpy.ndarray`.
+        """
+        if value is None:
+            return None
+
+        array = numpy.ascontiguousarray(value)
+        dtype = array.dtype.str
+        data = array.data
+        if self.compress:
+            data = zlib.compress(data)
+        header = (NUMPY_ARRAY_MAGIC
+                  + struct.pack('<BB', self.compress, len(dtype)) + dtype
+                  + struct.pack('<B%dQ' % array.ndim, array.ndim,
+                                *array.shape))
+        return bytearray(header) + data
+
+    def formfield(self, **kwargs):
+        """Specify a custom form field type so forms don't treat this as a
+        default type (such as a string)."""
+        defaults = {'form_class': PickleFormField}
+        defaults.update(kwargs)
+        return super(NumpyArrayField, self).formfield(**defaults)
 
 
 class OqNullBooleanField(djm.NullBooleanField):
@@ -26,6 +26,7 @@ Model representations of the OpenQuake DB tables.
 '''
 
 import collections
+import hashlib
 import itertools
 import operator
 import os
@@ -39,10 +40,13 @@ import numpy
 from django.db import connection
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.gis.db import models as djm
+from django.contrib.gis.geos import GEOSGeometry
 from openquake.hazardlib import geo as hazardlib_geo
 from shapely import wkt
 
 from openquake.engine.db import fields
+from openquake.engine.utils import config
+from openquake.engine.utils import general
 
 #: Default Spectral Acceleration damping. At the moment, this is not
 #: configurable.
@@ -58,6 +62,18 @@ STAT_CHOICES = (
 #: System Reference ID used for geometry objects
 DEFAULT_SRID = 4326
 
+#: Format of the names of the site collection files
+SITE_COLLECTION_FILE_FMT = 'sites-%(hc_id)s-%(fingerprint)s.npy'
+
+#: Maximum number of memory-mapped site collections kept by a process
+SITE_COLLECTION_CACHE_SIZE = 4
+
+_SITE_COLLECTION_CACHE = general.LRUCache(SITE_COLLECTION_CACHE_SIZE)
+
+#: The names of the attributes of a site collection, see
+#: :func:`site_collection_from_arrays`
+_SITE_COLLECTION_ATTRIBUTES = set()
+
 
 VS30_TYPE_CHOICES = (
     (u"measured", u"Value obtained from on-site measurements"),
@@ -90,11 +106,24 @@ def order_by_location(queryset):
         order_by=["x", "y"])
 
 
+#: The expression used to compare the locations of two rows, in the same
+#: order of :func:`order_by_location`. The values compared with it must be
+#: the exact coordinates of a location (e.g. read from its geometry), not the
+#: ones selected by :func:`order_by_location`, which are rounded to 15
+#: significant digits when they are converted to text.
+_LOCATION_KEY = 'ST_X(geometry(%(col)s)), ST_Y(geometry(%(col)s))'
+
+
 def queryset_iter(queryset, chunk_size):
     """
     Given a QuerySet, split it into smaller queries and yield the result of
     each.
 
+    The ordering of the queryset is kept, and the chunks are selected with
+    `OFFSET`, so the database scans again all the preceding rows for each
+    chunk. For large querysets, prefer a keyset pagination such as
+    :func:`location_queryset_iter`.
+
     :param queryset:
         A :class:`django.db.models.query.QuerySet` to iterate over, in chunks
         of ``chunk_size``.
@@ -113,6 +142,29 @@ def queryset_iter(queryset, chunk_size):
             offset += chunk_size
 
 
+def location_queryset_iter(queryset, chunk_size):
+    """
+    Given a QuerySet of rows with a `location`, split it into smaller
+    queries and yield the result of each, like :func:`queryset_iter`. The
+    rows are ordered by location (see :func:`order_by_location`) and each
+    query starts after the location of the last row of the previous chunk,
+    so that the database does not have to scan again the preceding rows
+    (as it would with `OFFSET`).
+
+    The rows with the same location must not be split across chunks,
+    i.e. `chunk_size` must be a multiple of the number of rows per
+    location.
+    """
+    queryset = order_by_location(queryset)
+    where = '(%s) > (%%s, %%s)' % (_LOCATION_KEY % dict(col='location'))
+    chunk = list(queryset[:chunk_size].iterator())
+    while chunk:
+        yield chunk
+        last = chunk[-1].location
+        chunk = list(queryset.extra(
+            where=[where], params=[last.x, last.y])[:chunk_size].iterator())
+
+
 def profile4job(job_id):
     """Return the job profile for the given job.
 
@@ -308,6 +360,10 @@ class ParsedSource(djm.Model):
                    'parsed_source record given a minimum integration distance,'
                    ' use this polygon in distance calculations.')
     )
+    weight = djm.IntegerField(
+        default=1,
+        help_text=('An estimate of the computational cost of the source, '
+                   'i.e. the number of ruptures it generates'))
 
     class Meta:
         db_table = 'hzrdi\".\"parsed_source'
@@ -625,6 +681,10 @@ class HazardCalculation(djm.Model):
     _site_collection = fields.PickleField(
         null=True, blank=True, db_column='site_collection'
     )
+    # If the `[hazard] site_collection_dir` is configured, the site collection
+    # is stored there in a columnar file, identified by this fingerprint,
+    # instead of being pickled in the DB. See :func:`save_site_collection`.
+    site_collection_fingerprint = djm.TextField(null=True, blank=True)
 
     ########################
     # Logic Tree parameters:
@@ -861,10 +921,14 @@ class HazardCalculation(djm.Model):
         calculation.
 
         Because this data is costly to compute, we try to only compute it once
-        and cache it in the DB. See :meth:`init_site_collection`.
+        and cache it in the DB, or in a file which is memory-mapped by the
+        processes needing it. See :meth:`init_site_collection`.
         """
-        if self._site_collection is None:
+        if (self._site_collection is None
+                and self.site_collection_fingerprint is None):
             self.init_site_collection()
+        if self.site_collection_fingerprint is not None:
+            return load_site_collection(self)
         return self._site_collection
 
     def init_site_collection(self):
@@ -889,8 +953,19 @@ class HazardCalculation(djm.Model):
 
             Ideally, this method should only be called once at the very
             beginning a calculation.
+
+        If the `[hazard] site_collection_dir` configuration parameter is set,
+        the site collection is saved in a file in that directory instead of
+        being pickled in the DB.
         """
-        self._site_collection = get_site_collection(self)
+        site_coll = get_site_collection(self)
+        if config.get('hazard', 'site_collection_dir'):
+            self._site_collection = None
+            self.site_collection_fingerprint = save_site_collection(
+                self.id, site_coll)
+        else:
+            self._site_collection = site_coll
+            self.site_collection_fingerprint = None
         self.save()
 
     def individual_curves_per_location(self):
@@ -967,7 +1042,7 @@ class HazardCalculation(djm.Model):
                 self.intensity_measure_types_and_levels.keys())
 
 
-def get_site_collection(hc):
+def get_site_collection(hc, tile=None):
     """
     Create a `SiteCollection`, which is needed by hazardlib to perform various
     calculation tasks (such computing hazard curves and GMFs).
@@ -976,22 +1051,28 @@ def get_site_collection(hc):
         Instance of a :class:`HazardCalculation`. We need this in order to get
         the points of interest for a calculation as well as load pre-computed
         site data or access reference site parameters.
+    :param tile:
+        A `slice` of the sites of the calculation, or `None` for all the
+        sites. Only the sites of the tile are built.
 
     :returns:
         :class:`openquake.hazardlib.site.SiteCollection` instance.
     """
+    if tile is None:
+        tile = slice(None)
     site_data = SiteData.objects.filter(hazard_calculation=hc.id)
     if len(site_data) > 0:
         site_data = site_data[0]
-        sites = zip(site_data.lons, site_data.lats, site_data.vs30s,
-                    site_data.vs30_measured, site_data.z1pt0s,
-                    site_data.z2pt5s)
+        sites = zip(site_data.lons[tile], site_data.lats[tile],
+                    site_data.vs30s[tile], site_data.vs30_measured[tile],
+                    site_data.z1pt0s[tile], site_data.z2pt5s[tile])
         sites = [openquake.hazardlib.site.Site(
             openquake.hazardlib.geo.Point(lon, lat), vs30, vs30m, z1pt0, z2pt5)
             for lon, lat, vs30, vs30m, z1pt0, z2pt5 in sites]
     else:
         # Use the calculation reference parameters to make a site collection.
-        points = hc.points_to_compute()
+        mesh = hc.points_to_compute()
+        points = hazardlib_geo.Mesh(mesh.lons[tile], mesh.lats[tile], None)
         measured = hc.reference_vs30_type == 'measured'
         sites = [
             openquake.hazardlib.site.Site(pt, hc.reference_vs30_value,
@@ -1003,6 +1084,131 @@ def get_site_collection(hc):
     return openquake.hazardlib.site.SiteCollection(sites)
 
 
+def site_collection_from_arrays(lons, lats, vs30, vs30measured, z1pt0, z2pt5):
+    """
+    Wrap arrays of site parameters in a
+    :class:`openquake.hazardlib.site.SiteCollection`, without copying them
+    (the constructor of the site collection takes a list of sites and
+    copies their parameters). This is the only function setting the
+    attributes of a site collection directly; they are checked against the
+    ones of a site collection built by its constructor, so that a change
+    of the layout of the class in hazardlib is not silently ignored.
+
+    :param lons:
+        The array of the longitudes of the sites.
+    :param lats:
+        The array of the latitudes of the sites.
+    :param vs30:
+        The array of the vs30 parameters of the sites; the others are the
+        same, see :class:`openquake.hazardlib.site.Site`.
+    :returns:
+        A :class:`openquake.hazardlib.site.SiteCollection` with the same
+        attributes as one built from a list of sites.
+    :raises RuntimeError:
+        if the site collections of hazardlib have other attributes
+    """
+    site_coll = openquake.hazardlib.site.SiteCollection.__new__(
+        openquake.hazardlib.site.SiteCollection)
+    site_coll.indices = None
+    site_coll.total_sites = len(lons)
+    site_coll.mesh = hazardlib_geo.Mesh(lons, lats, depths=None)
+    site_coll.vs30 = vs30
+    site_coll.vs30measured = vs30measured
+    site_coll.z1pt0 = z1pt0
+    site_coll.z2pt5 = z2pt5
+
+    if not _SITE_COLLECTION_ATTRIBUTES:
+        site = openquake.hazardlib.site.Site(
+            hazardlib_geo.Point(0.0, 0.0), 760.0, True, 100.0, 5.0)
+        _SITE_COLLECTION_ATTRIBUTES.update(
+            vars(openquake.hazardlib.site.SiteCollection([site])))
+    if set(vars(site_coll)) != _SITE_COLLECTION_ATTRIBUTES:
+        raise RuntimeError(
+            'Unsupported version of hazardlib: the attributes of a site '
+            'collection are %s' % sorted(_SITE_COLLECTION_ATTRIBUTES))
+    return site_coll
+
+
+def site_collection_path(hc_id, fingerprint):
+    """
+    :returns:
+        the path of the file of the site collection of a calculation, in the
+        directory set by the `[hazard] site_collection_dir` configuration
+        parameter
+    """
+    return os.path.join(
+        config.get('hazard', 'site_collection_dir'),
+        SITE_COLLECTION_FILE_FMT % dict(hc_id=hc_id, fingerprint=fingerprint))
+
+
+def save_site_collection(hc_id, site_coll):
+    """
+    Save a site collection in a columnar file: a numpy array with a row
+    (i.e. a contiguous block of data) for each of the lons, lats, vs30,
+    vs30 measured, z1pt0 and z2pt5 site parameters.
+
+    :param int hc_id:
+        The ID of a :class:`HazardCalculation`.
+    :param site_coll:
+        A :class:`openquake.hazardlib.site.SiteCollection` instance.
+    :returns:
+        The fingerprint of the site collection (the md5 digest of its data),
+        which is part of the name of the file.
+    """
+    columns = numpy.array([site_coll.mesh.lons, site_coll.mesh.lats,
+                           site_coll.vs30, site_coll.vs30measured,
+                           site_coll.z1pt0, site_coll.z2pt5], dtype=float)
+    fingerprint = hashlib.md5(columns.tostring()).hexdigest()
+    path = site_collection_path(hc_id, fingerprint)
+    if not os.path.exists(path):
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        # write to a temporary file and rename it, so that the processes
+        # reading the site collection never see a partially written file
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as fh:
+            numpy.save(fh, columns)
+        os.rename(tmp_path, path)
+    return fingerprint
+
+
+def load_site_collection(hc):
+    """
+    Memory-map the site collection file of a calculation and wrap the
+    arrays in a :class:`openquake.hazardlib.site.SiteCollection`, without
+    copying them. The site collection is cached by fingerprint, so that the
+    tasks of a calculation running in the same process reuse the mapping.
+
+    If the file does not exist (for instance if the site collection
+    directory is not on a shared filesystem), it is created from the
+    calculation parameters and site data.
+
+    :param hc:
+        Instance of a :class:`HazardCalculation` with a
+        `site_collection_fingerprint`.
+    """
+    fingerprint = hc.site_collection_fingerprint
+    site_coll = _SITE_COLLECTION_CACHE.get(fingerprint)
+    if site_coll is not None:
+        return site_coll
+
+    path = site_collection_path(hc.id, fingerprint)
+    if not os.path.exists(path):
+        save_site_collection(hc.id, get_site_collection(hc))
+    lons, lats, vs30, vs30measured, z1pt0, z2pt5 = numpy.load(
+        path, mmap_mode='r')
+
+    # this is the only column which must be converted
+    vs30measured = vs30measured.astype(bool)
+    vs30measured.flags.writeable = False
+    site_coll = site_collection_from_arrays(
+        lons, lats, vs30, vs30measured, z1pt0, z2pt5)
+
+    _SITE_COLLECTION_CACHE[fingerprint] = site_coll
+    return site_coll
+
+
 class RiskCalculation(djm.Model):
     '''
     Parameters needed to run a Risk job.
@@ -1720,39 +1926,54 @@ class HazardCurveDataManager(djm.GeoManager):
         """
         return self.individual_curves(job, imt).count()
 
-    def individual_curves_chunk(self, job, imt, offset, block_size):
+    def individual_curves_chunk(self, job, imt, start, stop=None):
         """
-        Get a chunk of individual curves related to `job` with `imt`
-        at offset `offset`. The size of the returned chunk is
-        `block_size`. The results are augmented with the wkb
-        representation of the location and the weight of the
-        individual curve
+        Get a chunk of individual curves related to `job` with `imt`,
+        ordered by location, with locations going from `start`
+        (included) to `stop` (excluded). The results are augmented with
+        the wkb representation of the location, the weight of the
+        individual curve and the coordinates of the location used for the
+        ordering
+
+        :param start: the (lon, lat) of the first location of the chunk
+        :param stop: the (lon, lat) of the first location after the
+            chunk, or None if the chunk goes up to the last location
         """
-        base_queryset = self.individual_curves_ordered(job, imt)
-        base_queryset = base_queryset.extra({
-            'wkb': 'asBinary(location)',
-        })
-        values = base_queryset.values(
-            'poes', 'wkb', 'hazard_curve__lt_realization__weight')
+        key = _LOCATION_KEY % dict(col='location')
+        where = ['(%s) >= (%%s, %%s)' % key]
+        params = list(start)
+        if stop is not None:
+            where.append('(%s) < (%%s, %%s)' % key)
+            params.extend(stop)
 
-        return values[offset: block_size + offset]
+        # ordered by the same key of the filter, see order_by_location
+        queryset = order_by_location(self.individual_curves(job, imt)).extra(
+            select={'wkb': 'asBinary(location)'}, where=where, params=params)
+        return queryset.values(
+            'poes', 'wkb', 'hazard_curve__lt_realization__weight', 'x', 'y')
 
     def individual_curves_chunks(self, job, imt, location_block_size=1):
         """
         Return a list of chunk of individual curves. A chunk is a
         tuple with all the ingredients needed to get a chunk of
         individual curves, i.e. a curve finder, the current job, the
-        imt of the curves, a block size and an offset
+        imt of the curves and the boundaries of the locations of the
+        chunk, read from the database once.
         """
-        curve_nr = self.individual_curves_nr(job, imt)
         calc = job.hazard_calculation
         curves_per_location = calc.individual_curves_per_location()
-        block_size = location_block_size * curves_per_location
-        ranges = xrange(0, curve_nr, block_size)
+        # the boundaries are the exact coordinates of the locations, see
+        # :data:`_LOCATION_KEY`
+        locations = [
+            GEOSGeometry(wkb).coords for _, _, wkb in
+            order_by_location(self.individual_curves(job, imt))
+            .extra(select={'wkb': 'asBinary(location)'})
+            .values_list('x', 'y', 'wkb').distinct()]
+        boundaries = locations[::location_block_size] + [None]
 
         return [IndividualHazardCurveChunk(
-                job, imt, curves_per_location, offset, block_size)
-                for offset in ranges]
+                job, imt, curves_per_location, start, stop)
+                for start, stop in zip(boundaries, boundaries[1:])]
 
     def all_curves_for_imt(self, job, imt, sa_period, sa_damping):
         """
@@ -1811,18 +2032,18 @@ class IndividualHazardCurveChunk(object):
     different locations
     """
 
-    def __init__(self, job, imt, curves_per_location, offset, block_size):
+    def __init__(self, job, imt, curves_per_location, start, stop):
         self.job = job
         self.imt = imt
-        self.offset = offset
+        self.start = start
+        self.stop = stop
         self.curves_per_location = curves_per_location
-        self.block_size = block_size
         self._raw_data = None
 
     @property
     def raw_data(self):
         return HazardCurveData.objects.individual_curves_chunk(
-            self.job, self.imt, self.offset, self.block_size)
+            self.job, self.imt, self.start, self.stop)
 
     @property
     def poes(self):
@@ -1909,7 +2130,15 @@ class SES(djm.Model):
     def __iter__(self):
         """
         Iterator for walking through all child :class:`SESRupture` objects.
+
+        The `complete logic tree` SES has no ruptures of its own: it contains
+        all of the ruptures of the other SESs of the same job.
         """
+        if self.complete_logic_tree_ses:
+            job = self.ses_collection.output.oq_job
+            return SESRupture.objects.filter(
+                ses__ses_collection__output__oq_job=job,
+                ses__complete_logic_tree_ses=False).order_by('id').iterator()
         return SESRupture.objects.filter(ses=self.id).iterator()
 
 
@@ -2310,7 +2539,7 @@ class DisaggResult(djm.Model):
     eps_bin_edges = fields.FloatArrayField()
     trts = fields.CharArrayField()
     location = djm.PointField(srid=DEFAULT_SRID)
-    matrix = fields.PickleField()
+    matrix = fields.NumpyArrayField(compress=True)
 
     class Meta:
         db_table = 'hzrdr\".\"disagg_result'
@@ -2640,7 +2869,8 @@ class ExposureModel(djm.Model):
         return ExposureData.objects.taxonomies_contained_in(
             self.id, region_constraint)
 
-    def get_asset_chunk(self, taxonomy, region_constraint, offset, count):
+    def get_asset_chunk(self, taxonomy, region_constraint, count,
+                        after=None):
         """
         :returns: a list of `openquake.engine.db.models.ExposureData` objects
         of a given taxonomy contained in a region and paginated
@@ -2650,11 +2880,12 @@ class ExposureModel(djm.Model):
         :param Polygon region_constraint: a Polygon object with a wkt
         property used to filter the exposure
 
-        :param int offset: An offset used to paginate the returned set
-        :param int count: An offset used to paginate the returned set
+        :param int count: The size of the returned set
+        :param after: The last asset of the previous chunk, or None for
+        the first chunk
         """
         return ExposureData.objects.contained_in(
-            self.id, taxonomy, region_constraint, offset, count)
+            self.id, taxonomy, region_constraint, count, after)
 
 
 class Occupancy(djm.Model):
@@ -2675,24 +2906,34 @@ class AssetManager(djm.GeoManager):
     Asset manager
     """
     def contained_in(self, exposure_model_id, taxonomy,
-                     region_constraint, offset, size):
+                     region_constraint, size, after=None):
         """
-        :returns the asset ids (ordered by location) contained in
-        `region_constraint` of `taxonomy` associated with an
+        :returns the first `size` assets (ordered by location and id)
+        contained in `region_constraint` of `taxonomy` associated with an
         `openquake.engine.db.models.ExposureModel` with ID equal to
-        `exposure_model_id`
+        `exposure_model_id`, coming after the asset `after` (if given).
+
+        The pagination is done by comparing the location and the id of
+        the assets with the ones of `after`, so that the query does not
+        need to skip the preceding assets (as with `OFFSET`)
         """
+        key = "ST_X(geometry(site)), ST_Y(geometry(site)), id"
+        params = [exposure_model_id, taxonomy,
+                  "SRID=4326; %s" % region_constraint.wkt]
+        if after is None:
+            after_clause = ""
+        else:
+            after_clause = "AND (%s) > (%%s, %%s, %%s)" % key
+            params.extend([after.site.x, after.site.y, after.id])
 
         return list(
             self.raw("""
             SELECT * FROM oqmif.exposure_data
-            WHERE exposure_model_id = %s AND taxonomy = %s AND
-            ST_COVERS(ST_GeographyFromText(%s), site)
-            ORDER BY ST_X(geometry(site)), ST_Y(geometry(site))
-            LIMIT %s OFFSET %s
-            """, [exposure_model_id, taxonomy,
-                  "SRID=4326; %s" % region_constraint.wkt,
-                  size, offset]))
+            WHERE exposure_model_id = %%s AND taxonomy = %%s AND
+            ST_COVERS(ST_GeographyFromText(%%s), site) %s
+            ORDER BY %s
+            LIMIT %%s
+            """ % (after_clause, key), params + [size]))
 
     def taxonomies_contained_in(self, exposure_model_id, region_constraint):
         """
@@ -2816,6 +3057,9 @@ class SourceProgress(djm.Model):
 
     lt_realization = djm.ForeignKey('LtRealization')
     parsed_source = djm.ForeignKey('ParsedSource')
+    # the index of the first site of the tile of sites the source is
+    # computed for, when the sites are split in tiles
+    site_offset = djm.IntegerField(default=0)
     is_complete = djm.BooleanField(default=False)
 
     class Meta:
@@ -2824,17 +3068,20 @@ class SourceProgress(djm.Model):
 
 class HazardCurveProgress(djm.Model):
     """
-    Store intermediate results of hazard curve calculations (as a pickled numpy
-    array) for a single logic tree realization.
+    Store intermediate results of hazard curve calculations (as a numpy
+    array) for a single logic tree realization and tile of sites.
     """
 
     lt_realization = djm.ForeignKey('LtRealization')
     imt = djm.TextField()
-    # stores a pickled numpy array for intermediate results
-    # array is 2d: sites x IMLs
+    # the index of the first site of the tile, when the sites are split in
+    # tiles
+    site_offset = djm.IntegerField(default=0)
+    # stores a numpy array for intermediate results
+    # array is 2d: sites of the tile x IMLs
     # each row indicates a site,
     # each column holds the PoE vaue for the IML at that index
-    result_matrix = fields.NumpyListField(default=None)
+    result_matrix = fields.NumpyArrayField(default=None)
 
     class Meta:
         db_table = 'htemp\".\"hazard_curve_progress'
@@ -2852,14 +3099,14 @@ class SiteData(djm.Model):
     """
 
     hazard_calculation = djm.ForeignKey('HazardCalculation')
-    lons = fields.PickleField()
-    lats = fields.PickleField()
-    vs30s = fields.PickleField()
+    lons = fields.NumpyArrayField()
+    lats = fields.NumpyArrayField()
+    vs30s = fields.NumpyArrayField()
     # `vs30_measured` stores a numpy array of booleans.
     # If a value is `False`, this means that the vs30 value is 'inferred'.
-    vs30_measured = fields.PickleField()
-    z1pt0s = fields.PickleField()
-    z2pt5s = fields.PickleField()
+    vs30_measured = fields.NumpyArrayField()
+    z1pt0s = fields.NumpyArrayField()
+    z2pt5s = fields.NumpyArrayField()
 
     class Meta:
         db_table = 'htemp\".\"site_data'
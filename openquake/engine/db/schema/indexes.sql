@@ -40,6 +40,8 @@ CREATE INDEX hzrdr_hazard_map_output_id_idx on hzrdr.hazard_map(output_id);
 -- hazard curve
 CREATE INDEX hzrdr_hazard_curve_output_id_idx on hzrdr.hazard_curve(output_id);
 CREATE INDEX hzrdr_hazard_curve_data_hazard_curve_id_idx on hzrdr.hazard_curve_data(hazard_curve_id);
+-- the key of the pagination by location, see models.order_by_location
+CREATE INDEX hzrdr_hazard_curve_data_location_xy_idx on hzrdr.hazard_curve_data(ST_X(geometry(location)), ST_Y(geometry(location)));
 -- gmf
 CREATE INDEX hzrdr_gmf_result_grp_ordinal_idx on hzrdr.gmf(result_grp_ordinal);
 CREATE INDEX hzrdr_gmf_imt_idx on hzrdr.gmf(imt);
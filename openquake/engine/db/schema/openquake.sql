@@ -171,6 +171,8 @@ CREATE TABLE hzrdi.parsed_source (
         CONSTRAINT enforce_source_type CHECK
         (source_type IN ('area', 'point', 'complex', 'simple')),
     nrml BYTEA NOT NULL,
+    -- estimated computational cost of the source (number of ruptures)
+    weight INTEGER NOT NULL DEFAULT 1,
     last_update timestamp without time zone
         DEFAULT timezone('UTC'::text, now()) NOT NULL
 ) TABLESPACE hzrdi_ts;
@@ -329,6 +331,9 @@ CREATE TABLE uiapi.hazard_calculation (
     region_grid_spacing float,
     -- a pickled `openquake.hazardlib.site.SiteCollection` object
     site_collection BYTEA,
+    -- the fingerprint of the site collection file, if the site collection
+    -- is stored in a file instead of being pickled in `site_collection`
+    site_collection_fingerprint VARCHAR,
     -- logic tree parameters:
     random_seed INTEGER,
     number_of_logic_tree_samples INTEGER,
@@ -1643,17 +1648,23 @@ CREATE TABLE htemp.source_progress (
     id SERIAL PRIMARY KEY,
     lt_realization_id INTEGER NOT NULL,
     parsed_source_id INTEGER NOT NULL,
+    -- index of the first site of the tile of sites the source is computed
+    -- for, 0 if the sites are not split in tiles
+    site_offset INTEGER NOT NULL DEFAULT 0,
     is_complete BOOLEAN NOT NULL DEFAULT FALSE
 ) TABLESPACE htemp_ts;
 
 CREATE TABLE htemp.hazard_curve_progress (
     -- This table will contain 1 record per IMT per logic tree realization
-    -- for a given calculation.
+    -- per tile of sites for a given calculation.
     id SERIAL PRIMARY KEY,
     lt_realization_id INTEGER NOT NULL,
     imt VARCHAR NOT NULL,
+    -- index of the first site of the tile, 0 if the sites are not split in
+    -- tiles
+    site_offset INTEGER NOT NULL DEFAULT 0,
     -- stores a pickled numpy array for intermediate results
-    -- array is 2d: sites x IMLs
+    -- array is 2d: sites of the tile x IMLs
     -- each row indicates a site,
     -- each column holds the PoE value for the IML at that index
     result_matrix BYTEA NOT NULL
@@ -404,7 +404,8 @@ def _switch_to_job_phase(job, ctype, status):
     models.JobPhaseStats.objects.create(oq_job=job, job_status=status,
                                         ctype=ctype)
     logs.LOG.progress("%s (%s)" % (status, ctype))
-    if status == "executing" and not openquake.engine.no_distribute():
+    if (status == "executing" and not openquake.engine.no_distribute()
+            and not openquake.engine.local_executor()):
         # Record the compute nodes that were available at the beginning of the
         # execute phase so we can detect failed nodes later.
         failed_nodes = monitor.count_failed_nodes(job)
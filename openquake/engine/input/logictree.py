@@ -33,6 +33,7 @@ import openquake.hazardlib
 from openquake.hazardlib.gsim.base import GroundShakingIntensityModel
 
 from openquake.engine.db import models
+from openquake.engine.utils import general
 
 GSIM = openquake.hazardlib.gsim.get_available_gsims()
 
@@ -1036,30 +1037,49 @@ def read_logic_trees(basepath, source_model_logictree_path,
     return [branch.value for branch in smlt.root_branchset.branches]
 
 
+#: Maximum number of parsed logic trees kept by a process
+LOGIC_TREE_CACHE_SIZE = 10
+
+_LOGIC_TREE_CACHE = general.LRUCache(LOGIC_TREE_CACHE_SIZE)
+
+
 class LogicTreeProcessor(object):
     """
     Logic tree processor. High-level interface to dealing with logic trees
     that are already in the database.
 
+    The parsed logic trees are cached by the process (see
+    :data:`_LOGIC_TREE_CACHE`), keyed by calculation ID and digests of the
+    logic tree inputs, so that all of the processors created for the same
+    calculation share the same trees. The results of
+    :meth:`parse_source_model_logictree_path` and
+    :meth:`parse_gmpe_logictree_path` are cached together with the trees.
+
     :param int calc_id:
         ID of a :class:`openquake.engine.db.models.HazardCalculation`.
     """
     def __init__(self, calc_id):
         [smlt_input] = models.inputs4hcalc(
             calc_id, input_type='source_model_logic_tree')
-        smlt_content = smlt_input.model_content.raw_content_ascii
-
         [gmpelt_input] = models.inputs4hcalc(
             calc_id, input_type='gsim_logic_tree')
-        gmpelt_content = gmpelt_input.model_content.raw_content_ascii
 
-        self.source_model_lt = SourceModelLogicTree(
-            smlt_content, basepath=None, filename=None, validate=False
-        )
-        self.gmpe_lt = GMPELogicTree(
-            tectonic_region_types=[], content=gmpelt_content,
-            basepath=None, filename=None, validate=False
-        )
+        key = (calc_id, smlt_input.digest, gmpelt_input.digest)
+        if key not in _LOGIC_TREE_CACHE:
+            smlt_content = smlt_input.model_content.raw_content_ascii
+            gmpelt_content = gmpelt_input.model_content.raw_content_ascii
+
+            source_model_lt = SourceModelLogicTree(
+                smlt_content, basepath=None, filename=None, validate=False
+            )
+            gmpe_lt = GMPELogicTree(
+                tectonic_region_types=[], content=gmpelt_content,
+                basepath=None, filename=None, validate=False
+            )
+            _LOGIC_TREE_CACHE[key] = (source_model_lt, gmpe_lt, {}, {})
+
+        (self.source_model_lt, self.gmpe_lt,
+         self._sm_paths, self._gmpe_paths) = _LOGIC_TREE_CACHE[key]
 
     def sample_source_model_logictree(self, random_seed):
         """
@@ -1140,6 +1160,35 @@ class LogicTreeProcessor(object):
             takes one argument, that is the hazardlib source object, and
             applies uncertainties to it in-place.
         """
+        key = tuple(branch_ids)
+        if key not in self._sm_paths:
+            self._sm_paths[key] = self._parse_source_model_logictree_path(
+                branch_ids)
+        return self._sm_paths[key]
+
+    def applies_uncertainties(self, branch_ids):
+        """
+        Check whether a path through the source model logic tree applies
+        some uncertainty (such as `maxMagGRRelative`) to the sources, i.e.
+        whether the sources of the path may differ from the ones stored in
+        the database, as well as their ruptures.
+
+        :param branch_ids:
+            List of string identifiers of branches, representing the path
+            through source model logic tree.
+        :returns:
+            `True` if the path has a branch set other than the source model
+            one, `False` otherwise.
+        """
+        return bool(self._branchsets_and_uncertainties(branch_ids))
+
+    def _branchsets_and_uncertainties(self, branch_ids):
+        """
+        :returns:
+            the list of pairs (branch set, uncertainty value) of the
+            uncertainties applied by a path through the source model logic
+            tree.
+        """
         branchset = self.source_model_lt.root_branchset
         branchsets_and_uncertainties = []
         branch_ids = branch_ids[::-1]
@@ -1149,6 +1198,16 @@ class LogicTreeProcessor(object):
             if not branchset.uncertainty_type == 'sourceModel':
                 branchsets_and_uncertainties.append((branchset, branch.value))
             branchset = branch.child_branchset
+        return branchsets_and_uncertainties
+
+    def _parse_source_model_logictree_path(self, branch_ids):
+        """
+        Build the "apply uncertainties" function for a path through the
+        source model logic tree. See
+        :meth:`parse_source_model_logictree_path`.
+        """
+        branchsets_and_uncertainties = self._branchsets_and_uncertainties(
+            branch_ids)
 
         def apply_uncertainties(source):
             for branchset, value in branchsets_and_uncertainties:
@@ -1165,6 +1224,18 @@ class LogicTreeProcessor(object):
             Dictionary mapping tectonic region type names to instances
             of hazardlib GSIM objects.
         """
+        key = tuple(branch_ids)
+        if key not in self._gmpe_paths:
+            self._gmpe_paths[key] = self._parse_gmpe_logictree_path(
+                branch_ids)
+        # the dictionary is cached, the callers get a copy of it
+        return dict(self._gmpe_paths[key])
+
+    def _parse_gmpe_logictree_path(self, branch_ids):
+        """
+        Build the dictionary of GSIMs for a path through the GMPE logic
+        tree. See :meth:`parse_gmpe_logictree_path`.
+        """
         branchset = self.gmpe_lt.root_branchset
         trt_to_gsim = {}
         branch_ids = branch_ids[::-1]
@@ -370,6 +370,8 @@ class SourceDBWriter(object):
     `hzrdi.parsed_source` table in the database.
 
     The source object data will be stored in the database in pickled blob form.
+    The `hzrdi.parsed_source.weight` field will contain the number of
+    ruptures of the source, used to balance the work of the tasks.
     The `hzrdi.parsed_source.polygon` field will contain the "rupture
     enclosing" polygon. We use HazardLib to generate this polygon. (See
     :meth:`openquake.hazardlib.source.base.SeismicSource.\
@@ -425,7 +427,7 @@ get_rupture_enclosing_polygon`.)
 
             ps = models.ParsedSource(
                 input=self.inp, source_type=_source_type(src), nrml=src,
-                polygon=geom.wkt
+                polygon=geom.wkt, weight=hazardlib_src.count_ruptures()
             )
             ps.save()
 
@@ -28,7 +28,8 @@ import threading
 
 import kombu
 
-from openquake.engine.signalling import AMQPMessageConsumer, amqp_connect
+from openquake.engine.signalling import (
+    AMQPMessageConsumer, amqp_connect, ensure_publish, shared_connection)
 from openquake.engine.utils import stats
 
 
@@ -153,7 +154,10 @@ def set_logger_level(logger, level):
 
 class AMQPHandler(logging.Handler):  # pylint: disable=R0902
     """
-    Logging handler that sends log messages to AMQP.
+    Logging handler that sends log messages to AMQP, on the broker
+    connection shared by the process (see
+    :func:`openquake.engine.signalling.shared_connection`), reconnecting
+    when the connection is lost.
 
     Transmitted log records are represented as json-encoded dictionaries
     with values of LogRecord object enclosed. Those values should be enough
@@ -172,12 +176,14 @@ class AMQPHandler(logging.Handler):  # pylint: disable=R0902
     # pylint: disable=R0913
     def __init__(self, level=logging.NOTSET):
         logging.Handler.__init__(self, level=level)
-        self.producer = self._initialize()
+        self.connection = shared_connection()
+        self.producer = self._initialize(self.connection)
+        self.publish = ensure_publish(self.connection, self.producer)
 
     @staticmethod
-    def _initialize():
+    def _initialize(connection):
         """Initialize amqp artefacts."""
-        _, channel, exchange = amqp_connect()
+        _, channel, exchange = amqp_connect(connection)
         return kombu.messaging.Producer(channel, exchange, serializer='json')
 
     def set_job_id(self, job_id):
@@ -208,7 +214,7 @@ class AMQPHandler(logging.Handler):  # pylint: disable=R0902
         data['job_id'] = getattr(self._MDC, 'job_id', None)
 
         routing_key = self.ROUTING_KEY_FORMAT % data
-        self.producer.publish(data, routing_key)
+        self.publish(data, routing_key)
 
 
 class AMQPLogSource(AMQPMessageConsumer):
@@ -18,6 +18,7 @@
 """
 Classes dealing with amqp signalling between jobbers, workers and supervisors.
 """
+import os
 import socket
 
 import kombu
@@ -26,17 +27,76 @@ import kombu.messaging
 
 from openquake.engine.utils import config
 
+#: Maximum number of times a message is republished, after reconnecting to
+#: the broker, when the publication fails (see :func:`ensure_publish`)
+PUBLISH_MAX_RETRIES = 3
 
-def amqp_connect():
+#: The broker connection of this process and the ID of the process which
+#: created it, see :func:`shared_connection`
+_SHARED_CONNECTION = dict(pid=None, connection=None)
+
+
+def _new_connection():
+    """
+    :returns:
+        a new broker connection, using the default configuration
+    """
+    cfg = config.get_section("amqp")
+    return kombu.BrokerConnection(hostname=cfg['host'],
+                                  userid=cfg['user'],
+                                  password=cfg['password'],
+                                  virtual_host=cfg['vhost'])
+
+
+def shared_connection():
+    """
+    Get the long-lived broker connection of this process, which is shared
+    by the producers of the task completion messages and of the log records,
+    so that they do not connect to the broker for each message. The
+    connection is established lazily; a new one is created in a forked
+    process, since a connection cannot be shared by processes.
+
+    :returns:
+        a :class:`kombu.BrokerConnection`
+    """
+    pid = os.getpid()
+    if _SHARED_CONNECTION['pid'] != pid:
+        _SHARED_CONNECTION.update(pid=pid, connection=_new_connection())
+    return _SHARED_CONNECTION['connection']
+
+
+def ensure_publish(connection, producer, max_retries=PUBLISH_MAX_RETRIES):
+    """
+    :param connection:
+        the :class:`kombu.BrokerConnection` of the producer
+    :param producer:
+        a :class:`kombu.messaging.Producer`
+    :param max_retries:
+        the maximum number of retries, or `None` to retry until the broker
+        is reachable again
+    :returns:
+        a function with the same signature of `producer.publish`, which
+        reconnects to the broker and revives the producer when the
+        publication fails because of a connection error, up to
+        `max_retries` times
+    """
+    return connection.ensure(producer, producer.publish,
+                             max_retries=max_retries)
+
+
+def amqp_connect(connection=None):
     """
     Connect to amqp broker with kombu using default configuration
     and return connection, channel and exchange as tuple.
+
+    :param connection:
+        an existing connection to open the channel on, for instance the
+        one returned by :func:`shared_connection`; by default, a new
+        connection is created
     """
     cfg = config.get_section("amqp")
-    connection = kombu.BrokerConnection(hostname=cfg['host'],
-                                        userid=cfg['user'],
-                                        password=cfg['password'],
-                                        virtual_host=cfg['vhost'])
+    if connection is None:
+        connection = _new_connection()
     channel = connection.channel()
     exchange = kombu.entity.Exchange(cfg['exchange'], type='topic',
                                      channel=channel)
@@ -306,10 +306,12 @@ class SupervisorLogMessageConsumer(logs.AMQPLogSource):
             if failures:
                 message = "job terminated with failures: %s" % failures
             else:
-                # Don't check for failed nodes if distribution is disabled.
-                # In this case, we don't expect any nodes to be present, and
-                # thus, there are none that can fail.
-                if not openquake.engine.no_distribute():
+                # Don't check for failed nodes if distribution is disabled
+                # or the tasks are run by the control node. In this case, we
+                # don't expect any nodes to be present, and thus, there are
+                # none that can fail.
+                if not (openquake.engine.no_distribute()
+                        or openquake.engine.local_executor()):
                     failed_nodes = abort_due_to_failed_nodes(self.job_id)
                     if failed_nodes:
                         message = ("job terminated due to %s failed nodes" %
@@ -21,7 +21,9 @@
 Utility functions of general interest.
 """
 
+import collections
 import cPickle
+import heapq
 
 
 def singleton(cls):
@@ -53,6 +55,47 @@ class MemoizeMutable:
         return self.memo[key]
 
 
+class LRUCache(object):
+    """
+    A dictionary-like cache keeping at most `maxsize` items. When it is
+    full, the least recently used item is discarded to make room for a new
+    one.
+
+    :param int maxsize: the maximum number of items in the cache
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, key):
+        # move the item to the end, i.e. mark it as the most recently used
+        value = self._data.pop(key)
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return the item for `key` if present in the cache, else `default`"""
+        if key in self._data:
+            return self[key]
+        return default
+
+    def clear(self):
+        """Remove all the items from the cache"""
+        self._data.clear()
+
+
 def str2bool(value):
     """Convert a string representation of a boolean value to a bool."""
     return value.lower() in ("true", "yes", "t", "1")
@@ -87,3 +130,41 @@ def block_splitter(data, block_size):
             block_buffer = []
     if len(block_buffer) > 0:
         yield block_buffer
+
+
+def weighted_block_splitter(data, weights, num_blocks):
+    """
+    Given a sequence of objects and their weights, split them in at most
+    ``num_blocks`` blocks of roughly the same total weight.
+
+    The objects are considered from the heaviest to the lightest, and each
+    one is added to the block with the smallest total weight so far (the
+    "longest processing time first" heuristic).
+
+    :param data:
+        Any iterable sequence of data.
+    :param weights:
+        A sequence of non-negative numbers, one for each object in ``data``.
+    :param int num_blocks:
+        Maximum number of blocks. Must be greater than 0.
+    :returns:
+        The list of the non empty blocks (lists of objects), sorted by
+        decreasing total weight.
+    :raises:
+        :exc:`ValueError` of the ``num_blocks`` is <= 0.
+    """
+    if num_blocks <= 0:
+        raise ValueError(
+            'Invalid number of blocks: %s. Value must be greater than 0.'
+            % num_blocks)
+
+    # (total weight, block index, block); the index breaks the ties
+    heap = [(0, i, []) for i in xrange(num_blocks)]
+    for weight, d in sorted(zip(weights, data), key=lambda wd: wd[0],
+                            reverse=True):
+        total, i, block = heapq.heappop(heap)
+        block.append(d)
+        heapq.heappush(heap, (total + weight, i, block))
+
+    return [blk for _, _, blk in sorted(heap, key=lambda t: (-t[0], t[1]))
+            if blk]
@@ -20,6 +20,7 @@
 """Utility functions related to splitting work into tasks."""
 
 import itertools
+import time
 
 from functools import wraps
 
@@ -30,6 +31,11 @@ from openquake.engine import logs
 from openquake.engine.db import models
 from openquake.engine.utils import config
 
+#: The start time and the number given by the control node (see
+#: :class:`openquake.engine.calculators.base.TaskTracker`) of the task
+#: running in this process, if any
+_CURRENT_TASK = dict(started=None, task_no=None)
+
 
 def distribute(task_func, (name, data), tf_args=None, ath=None, ath_args=None,
                flatten_results=False):
@@ -142,6 +148,25 @@ def get_running_job(job_id):
     return job_ctxt
 
 
+def task_duration():
+    """
+    :returns:
+        the seconds elapsed since the start of the :func:`oqtask` running in
+        this process, or `None` if no task is running
+    """
+    started = _CURRENT_TASK['started']
+    return None if started is None else time.time() - started
+
+
+def current_task_no():
+    """
+    :returns:
+        the number given by the control node to the :func:`oqtask` running in
+        this process, or `None` if no task is running or it has no number
+    """
+    return _CURRENT_TASK['task_no']
+
+
 def oqtask(task_func):
     """
     Task function decorator which sets up logging and catches (and logs) any
@@ -158,6 +183,9 @@ def oqtask(task_func):
         code surrounded by a try-except. If any error occurs, log it as a
         critical failure.
         """
+        # the number of the task, if it is tracked by the control node, is
+        # not an argument of the task function
+        task_no = kwargs.pop('task_no', None)
         # job_id is always assumed to be the first argument passed to
         # the task, or a keyword argument
         # this is the only required argument
@@ -180,12 +208,15 @@ def oqtask(task_func):
                 raise JobCompletedError(job_id)
             # The job is running.
             # ... now continue with task execution.
+            _CURRENT_TASK.update(started=time.time(), task_no=task_no)
             task_func(*args, **kwargs)
         # TODO: should we do something different with the JobCompletedError?
         except Exception, err:
             logs.LOG.critical('Error occurred in task: %s' % str(err))
             logs.LOG.exception(err)
             raise
+        finally:
+            _CURRENT_TASK.update(started=None, task_no=None)
 
     celery_queue = config.get('amqp', 'celery_queue')
     return task(wrapped, ignore_result=True, queue=celery_queue)
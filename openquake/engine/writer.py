@@ -20,6 +20,8 @@ Base classes for the output methods of the various codecs.
 """
 
 import logging
+import struct
+from cStringIO import StringIO
 from os.path import basename
 
 from django.db import transaction
@@ -294,3 +296,140 @@ class BulkInserter(object):
         self.fields = None
         self.values = []
         self.count = 0
+
+
+class CopyBulkInserter(BulkInserter):
+    """
+    Handle bulk object insertion by streaming the entries to the database
+    with a `COPY ... FROM STDIN` statement.
+
+    The API is the same as :class:`BulkInserter`, but the rows are
+    serialized in the PostgreSQL text format as soon as they are added,
+    so that the database does not have to parse and plan a huge `INSERT`
+    statement with a parameter per value.
+
+    Geometries can be given either as WKT strings (which are sent as EWKT)
+    or as WKB strings/buffers, for instance coming from `asBinary(location)`
+    (which are sent as hex-encoded EWKB).
+    """
+
+    def __init__(self, dj_model, max_cache_size=None):
+        super(CopyBulkInserter, self).__init__(dj_model, max_cache_size)
+        self.field_map = dict(
+            (f.column, f) for f in self.table._meta.fields)
+        self.stream = StringIO()
+
+    def add_entry(self, **kwargs):
+        """
+        Add a new entry to be inserted
+
+        The first time the method is called the field list is stored;
+        subsequent add_entry() calls must provide the same set of
+        keyword arguments.
+
+        Handles PostGIS/GeoDjango types.
+        """
+        if not self.fields:
+            self.fields = kwargs.keys()
+        assert set(self.fields) == set(kwargs.keys())
+        self.stream.write('\t'.join(
+            self._to_copy_text(self.field_map[f], kwargs[f])
+            for f in self.fields))
+        self.stream.write('\n')
+        self.count += 1
+
+        if self.max_cache_size is not None:
+            if self.count >= self.max_cache_size:
+                self.flush()
+
+    def flush(self):
+        """Stream the entries to the database using a `COPY` statement"""
+        if not self.count:
+            return
+
+        alias = router.db_for_write(self.table)
+        cursor = connections[alias].cursor()
+
+        self.stream.seek(0)
+        sql = "COPY \"%s\" (%s) FROM STDIN" % (
+            self.table._meta.db_table, ", ".join(self.fields))
+        cursor.copy_expert(sql, self.stream)
+        transaction.set_dirty(using=alias)
+
+        self.fields = None
+        self.stream = StringIO()
+        self.count = 0
+
+    @staticmethod
+    def _to_copy_text(field, value):
+        """
+        :returns:
+            the representation of `value` for the column modeled by the
+            django `field`, in the text format expected by `COPY`
+        """
+        if value is None:
+            return r'\N'
+
+        if isinstance(field, gis_models.GeometryField):
+            if (isinstance(value, (buffer, bytearray))
+                    or value[:1] in ('\x00', '\x01')):
+                # a WKB geometry, starting with its byte order flag
+                value = wkb_to_ewkb(str(value), field.srid).encode('hex')
+            else:
+                value = 'SRID=%d;%s' % (field.srid, value)
+        else:
+            value = field.get_prep_value(value)
+
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        elif isinstance(value, float):
+            return repr(value)
+        elif isinstance(value, (buffer, bytearray)):
+            # bytea in hex format; the backslash is escaped for COPY
+            return r'\\x' + str(value).encode('hex')
+        elif isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+
+        return value.replace('\\', '\\\\').replace(
+            '\t', r'\t').replace('\n', r'\n').replace('\r', r'\r')
+
+
+def allocate_ids(dj_model, n):
+    """
+    Reserve ids from the sequence of the primary key of a model table,
+    so that records can be bulk inserted with known ids.
+
+    :param dj_model:
+        Django model class, whose table has a `SERIAL` primary key `id`
+    :param int n:
+        the number of ids to allocate
+    :returns:
+        a list of `n` ids, in increasing order
+    """
+    alias = router.db_for_write(dj_model)
+    cursor = connections[alias].cursor()
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+        "FROM generate_series(1, %s)",
+        ['"%s"' % dj_model._meta.db_table, n])
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+def wkb_to_ewkb(wkb, srid):
+    """
+    Add the SRID to a WKB geometry, by setting the SRID flag in its type
+    and inserting the SRID just after the header.
+
+    :param str wkb:
+        a geometry in the Well Known Binary format
+    :param int srid:
+        the spatial reference id of the geometry
+    :returns:
+        the geometry in the PostGIS Extended Well Known Binary format
+    """
+    byte_order = '<' if ord(wkb[0]) else '>'
+    [geom_type] = struct.unpack(byte_order + 'I', wkb[1:5])
+    return (wkb[0] + struct.pack(byte_order + 'II', geom_type | 0x20000000,
+                                 srid) + wkb[5:])
@@ -24,7 +24,7 @@ from django.db import transaction
 from openquake.engine import writer
 
 from openquake.engine.db.models import OqUser, GmfData
-from openquake.engine.writer import BulkInserter
+from openquake.engine.writer import BulkInserter, CopyBulkInserter
 
 
 def _map_values(fields, values):
@@ -43,6 +43,10 @@ class DummyConnection(object):
         self.sql = sql
         self.values = values
 
+    def copy_expert(self, sql, stream):
+        self.sql = sql
+        self.data = stream.read()
+
 
 class BulkInserterTestCase(unittest.TestCase):
     """
@@ -137,3 +141,80 @@ class BulkInserterTestCase(unittest.TestCase):
 
         self.assertEquals('INSERT INTO "hzrdr"."gmf_data" (%s) VALUES (%s)' %
                           (", ".join(fields), values), connection.sql)
+
+
+class CopyBulkInserterTestCase(unittest.TestCase):
+    """
+    Unit tests for the CopyBulkInserter class, which streams bulk inserts
+    to the database with a COPY statement
+    """
+
+    def setUp(self):
+        self.connections = writer.connections
+
+        writer.connections = dict(
+            admin=DummyConnection(), reslt_writer=DummyConnection())
+
+    def tearDown(self):
+        writer.connections = self.connections
+
+    def test_add_entry(self):
+        inserter = CopyBulkInserter(OqUser)
+
+        inserter.add_entry(user_name='user1', full_name='An user')
+        inserter.add_entry(user_name='user2', full_name='Another user')
+
+        self.assertEquals(sorted(['user_name', 'full_name']),
+                          sorted(inserter.fields))
+        self.assertEquals(inserter.count, 2)
+
+    def test_add_entry_different_keys(self):
+        inserter = CopyBulkInserter(OqUser)
+
+        inserter.add_entry(user_name='user1', full_name='An user')
+        self.assertRaises(AssertionError, inserter.add_entry,
+                          user_name='user1')
+
+    @transaction.commit_on_success('admin')
+    def test_flush(self):
+        inserter = CopyBulkInserter(OqUser)
+        connection = writer.connections['admin']
+
+        inserter.add_entry(user_name='user1', full_name='An\tuser')
+        inserter.add_entry(user_name='user2', full_name=None)
+        fields = inserter.fields
+        inserter.flush()
+
+        self.assertEquals('COPY "admin"."oq_user" (%s) FROM STDIN' %
+                          ", ".join(fields), connection.sql)
+        rows = [dict(zip(fields, line.split('\t')))
+                for line in connection.data.splitlines()]
+        self.assertEquals([{'user_name': 'user1', 'full_name': r'An\tuser'},
+                           {'user_name': 'user2', 'full_name': r'\N'}],
+                          rows)
+        self.assertEquals(0, inserter.count)
+
+    @transaction.commit_on_success('reslt_writer')
+    def test_flush_geometry(self):
+        inserter = CopyBulkInserter(GmfData)
+        connection = writer.connections['reslt_writer']
+
+        inserter.add_entry(location='POINT(1 1)', output_id=1)
+        # little endian WKB for POINT(1 2)
+        inserter.add_entry(
+            location=('0101000000000000000000f03f0000000000000040'
+                      .decode('hex')),
+            output_id=2)
+        fields = inserter.fields
+        inserter.flush()
+
+        self.assertEquals('COPY "hzrdr"."gmf_data" (%s) FROM STDIN' %
+                          ", ".join(fields), connection.sql)
+        rows = [dict(zip(fields, line.split('\t')))
+                for line in connection.data.splitlines()]
+        self.assertEquals(
+            [{'output_id': '1', 'location': 'SRID=4326;POINT(1 1)'},
+             {'output_id': '2',
+              'location': ('0101000020e6100000000000000000f03f'
+                           '0000000000000040')}],
+            rows)
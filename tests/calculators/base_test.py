@@ -15,11 +15,20 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 import kombu
+import mock
 import unittest
 
 from openquake.engine.calculators import base
 
 
+def _local_task(job_id, num_items):
+    base.signal_task_complete(job_id=job_id, num_items=num_items)
+
+
+def _failing_task(job_id):
+    raise RuntimeError('task %s failed' % job_id)
+
+
 class ExchangeConnArgsTestCase(unittest.TestCase):
 
     def test_exchange_and_conn_args(self):
@@ -62,3 +71,277 @@ class SignalTestCase(unittest.TestCase):
                 base.signal_task_complete(
                     job_id=job_id, num_items=num_sources)
                 conn.drain_events()
+
+
+class SignalProducerTestCase(unittest.TestCase):
+    """
+    Tests for the publication of the completion messages on the connection
+    shared by the process.
+    """
+
+    def setUp(self):
+        self.publish = mock.Mock()
+        self.patch = mock.patch(
+            'openquake.engine.calculators.base._signal_producer')
+        signal_producer = self.patch.start()
+        signal_producer.return_value = self.publish
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_publish(self):
+        base.signal_task_complete(job_id=7, num_items=1)
+
+        self.assertEqual(
+            [((dict(job_id=7, num_items=1),),
+              dict(routing_key='oq.job.7.tasks'))],
+            self.publish.call_args_list)
+
+    def test_publish_retried_forever(self):
+        base._SIGNAL_PRODUCER.update(pid=None, producer=None, publish=None)
+        self.patch.stop()
+        try:
+            with mock.patch('openquake.engine.signalling.'
+                            'shared_connection') as shared:
+                base._signal_producer()
+            conn = shared.return_value
+            self.assertEqual(dict(max_retries=None),
+                             conn.ensure.call_args[1])
+        finally:
+            base._SIGNAL_PRODUCER.update(pid=None, producer=None,
+                                         publish=None)
+            self.patch.start()
+
+
+class TaskWindowTestCase(unittest.TestCase):
+    """
+    Tests for :class:`openquake.engine.calculators.base.TaskWindow`.
+    """
+
+    def test_no_workers(self):
+        window = base.TaskWindow(32, lambda: 0)
+        self.assertEqual(32, window.size())
+
+    def test_initial_size(self):
+        window = base.TaskWindow(32, lambda: 4)
+        self.assertEqual(8, window.size())
+        # the size is capped
+        window = base.TaskWindow(32, lambda: 20)
+        self.assertEqual(32, window.size())
+
+    def test_task_durations(self):
+        window = base.TaskWindow(32, lambda: 4)
+        window.task_done(None)
+        self.assertIsNone(window.mean_duration)
+
+        # long tasks: a task waiting for each worker is enough
+        window.task_done(60.)
+        self.assertEqual(8, window.size())
+
+        # short tasks: more tasks waiting for each worker
+        window.task_done(0.)
+        self.assertEqual(48., window.mean_duration)
+        window = base.TaskWindow(32, lambda: 4)
+        window.task_done(0.25)
+        self.assertEqual(20, window.size())
+
+    def test_workers_refresh(self):
+        count_workers = mock.Mock(return_value=2)
+        window = base.TaskWindow(32, count_workers)
+        window.size()
+        window.size()
+        self.assertEqual(1, count_workers.call_count)
+
+        window.counted -= window.REFRESH_INTERVAL + 1
+        count_workers.return_value = 3
+        self.assertEqual(6, window.size())
+        self.assertEqual(2, count_workers.call_count)
+
+
+class FillWindowTestCase(unittest.TestCase):
+    """
+    Tests for the adaptive number of tasks in queue of
+    :class:`openquake.engine.calculators.base.CalculatorNext`.
+    """
+
+    def setUp(self):
+        self.calc = base.CalculatorNext(mock.Mock(id=7))
+        self.calc.window = base.TaskWindow(32, lambda: 2)
+        self.patch = mock.patch(
+            'openquake.engine.calculators.base.queue_next')
+        self.queue_next = self.patch.start()
+        self.log_patch = mock.patch(
+            'openquake.engine.logs.log_percent_complete')
+        self.log_patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.log_patch.stop()
+
+    def test_fill_window(self):
+        task_gen = iter(range(10))
+        self.calc.fill_window(task_gen)
+        self.assertEqual(4, self.calc.progress['in_queue'])
+        self.assertEqual(4, self.queue_next.call_count)
+
+        # the window grows
+        self.calc.window.num_workers = 3
+        self.calc.fill_window(task_gen)
+        self.assertEqual(6, self.calc.progress['in_queue'])
+
+        # no more tasks
+        self.calc.window.num_workers = 10
+        self.calc.fill_window(task_gen)
+        self.assertEqual(10, self.calc.progress['in_queue'])
+
+    def test_window_shrinks(self):
+        task_gen = iter(range(10))
+        self.calc.progress['in_queue'] = 6
+        callback = self.calc.get_task_complete_callback(task_gen, 1, 32)
+
+        # the completed task is not replaced
+        callback(dict(job_id=7, num_items=1, duration=60.), mock.Mock())
+        self.assertEqual(5, self.calc.progress['in_queue'])
+        self.assertEqual(0, self.queue_next.call_count)
+
+        self.calc.progress['in_queue'] = 4
+        callback(dict(job_id=7, num_items=1, duration=60.), mock.Mock())
+        self.assertEqual(4, self.calc.progress['in_queue'])
+        self.assertEqual(1, self.queue_next.call_count)
+
+
+class TaskTrackerTestCase(unittest.TestCase):
+    """
+    Tests for :class:`openquake.engine.calculators.base.TaskTracker`.
+    """
+
+    def test_queue_next_numbers_the_tasks(self):
+        task_func = mock.Mock()
+        with mock.patch('openquake.engine.no_distribute') as nd:
+            nd.return_value = True
+            with base.TaskTracker() as tracker:
+                base.queue_next(task_func, (7, 1))
+                base.queue_next(task_func, (7, 2))
+                # a task dispatched again keeps its number
+                base.queue_next(task_func, (7, 1), 1)
+            base.queue_next(task_func, (7, 3))
+
+        self.assertEqual([((7, 1), dict(task_no=1)),
+                          ((7, 2), dict(task_no=2)),
+                          ((7, 1), dict(task_no=1)),
+                          ((7, 3), {})],
+                         task_func.call_args_list)
+        self.assertEqual(2, tracker.num_tasks)
+        self.assertTrue(base._TASK_TRACKER is None)
+
+    def test_duplicated_completion(self):
+        tracker = base.TaskTracker()
+        task_no = tracker.dispatched(mock.Mock(), (7, 1))
+
+        self.assertTrue(tracker.completed(dict(job_id=7, task_no=task_no)))
+        self.assertFalse(tracker.completed(dict(job_id=7, task_no=task_no)))
+        # the messages of the tasks which are not tracked are always taken
+        self.assertTrue(tracker.completed(dict(job_id=7)))
+        self.assertEqual({}, tracker.running)
+
+    def test_stragglers(self):
+        tracker = base.TaskTracker()
+        task_func = mock.Mock()
+        task_nos = [tracker.dispatched(task_func, (7, i)) for i in xrange(7)]
+        # not enough completed tasks yet
+        self.assertEqual([], tracker.stragglers())
+
+        for task_no in task_nos[:5]:
+            tracker.completed(dict(job_id=7, task_no=task_no))
+        self.assertEqual([], tracker.stragglers())
+
+        # the last task is running for much longer than the others
+        tracker.running[task_nos[-1]][2] -= 3600
+        self.assertEqual([(task_nos[-1], task_func, (7, 6))],
+                         tracker.stragglers())
+        # and it is dispatched again only once
+        self.assertEqual([], tracker.stragglers())
+
+
+class LocalExecutorTestCase(unittest.TestCase):
+    """
+    Tests for :class:`openquake.engine.calculators.base.LocalExecutor`.
+    """
+
+    def test_completion_messages(self):
+        received = []
+
+        def callback(body, message):
+            received.append(body)
+            message.ack()
+
+        with base.LocalExecutor(7, callback, num_processes=2) as executor:
+            # the tasks are submitted to the active executor
+            for num_items in (1, 2, 3):
+                base.queue_next(_local_task, (7, num_items))
+            for _ in xrange(3):
+                executor.wait()
+
+        self.assertEqual([1, 2, 3],
+                         sorted(body['num_items'] for body in received))
+        self.assertEqual([7] * 3, [body['job_id'] for body in received])
+        self.assertTrue(base._LOCAL_EXECUTOR is None)
+
+    def test_drain_all_messages(self):
+        received = []
+
+        def callback(body, message):
+            received.append(body)
+
+        with base.LocalExecutor(7, callback, num_processes=1) as executor:
+            # wait until a message reaches the queue (the queue raises
+            # `Queue.Empty` if it does not in time), then put it back
+            executor.signal_queue.put(dict(job_id=7, num_items=1))
+            first = executor.signal_queue.get(timeout=5)
+            self.assertEqual(dict(job_id=7, num_items=1), first)
+            for body in (first, dict(job_id=7, num_items=2),
+                         dict(job_id=7, num_items=3)):
+                executor.signal_queue.put(body)
+
+            for _ in xrange(3):
+                executor.wait(timeout=5)
+                if len(received) == 3:
+                    break
+        self.assertEqual([1, 2, 3], [body['num_items'] for body in received])
+
+    def test_task_failure(self):
+        def callback(body, message):
+            self.fail('unexpected completion message')
+
+        with self.assertRaises(RuntimeError):
+            with base.LocalExecutor(7, callback, num_processes=1) as executor:
+                base.queue_next(_failing_task, (7,))
+                executor.wait()
+        self.assertTrue(base._LOCAL_EXECUTOR is None)
+
+    def test_task_failure_with_messages(self):
+        # a failure is noticed even if there are completion messages
+        # waiting in the queue
+        received = []
+
+        def callback(body, message):
+            received.append(body)
+
+        with self.assertRaises(RuntimeError):
+            with base.LocalExecutor(7, callback, num_processes=1) as executor:
+                base.queue_next(_failing_task, (7,))
+                executor.results[0].wait(5)
+                executor.signal_queue.put(dict(job_id=7, num_items=1))
+                executor.wait()
+        self.assertEqual([], received)
+
+    def test_get_executor(self):
+        callback = mock.Mock()
+        with mock.patch('openquake.engine.local_executor') as local:
+            local.return_value = True
+            executor = base.get_executor(7, callback)
+            self.assertTrue(isinstance(executor, base.LocalExecutor))
+
+            local.return_value = False
+            executor = base.get_executor(7, callback)
+            self.assertTrue(isinstance(executor, base.CeleryExecutor))
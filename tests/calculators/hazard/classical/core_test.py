@@ -18,6 +18,7 @@ import getpass
 import unittest
 
 import kombu
+import mock
 import numpy
 
 from nose.plugins.attrib import attr
@@ -408,8 +409,8 @@ store_site_model'
             routing_key=routing_key, durable=False, auto_delete=True)
 
         def test_callback(body, message):
-            self.assertEqual(dict(job_id=self.job.id, num_items=1),
-                             body)
+            self.assertEqual(self.job.id, body['job_id'])
+            self.assertEqual(1, body['num_items'])
             message.ack()
 
         with kombu.BrokerConnection(**conn_args) as conn:
@@ -427,6 +428,97 @@ store_site_model'
         # We'll leave more detail testing of results to a QA test (which will
         # take much more time to execute).
 
+    def test_pre_execute_all_sources_filtered(self):
+        # no source can affect the sites: no task is dispatched, and the
+        # realizations are complete
+        with mock.patch('openquake.engine.calculators.hazard.general'
+                        '.filter_sources') as filter_sources:
+            filter_sources.return_value = []
+            self.calc.pre_execute()
+
+        hc = self.job.hazard_calculation
+        self.assertFalse(models.SourceProgress.objects.filter(
+            lt_realization__hazard_calculation=hc,
+            is_complete=False).exists())
+        rlzs = models.LtRealization.objects.filter(hazard_calculation=hc)
+        self.assertTrue(len(rlzs) > 0)
+        for rlz in rlzs:
+            self.assertTrue(rlz.is_complete)
+            self.assertEqual(rlz.total_items, rlz.completed_items)
+        self.assertEqual(0, self.calc.progress['total'])
+        self.assertEqual([], list(self.calc.task_arg_gen(1)))
+
+    def test_pre_execute_sources_with_uncertainties(self):
+        # the sources of the realizations applying some uncertainty may
+        # have larger ruptures than the stored ones, so they are not
+        # filtered
+        with mock.patch('openquake.engine.calculators.hazard.general'
+                        '.filter_sources') as filter_sources:
+            filter_sources.return_value = []
+            with mock.patch('openquake.engine.input.logictree'
+                            '.LogicTreeProcessor.applies_uncertainties') as au:
+                au.return_value = True
+                self.calc.pre_execute()
+        self.assertEqual(0, filter_sources.call_count)
+
+        hc = self.job.hazard_calculation
+        self.assertFalse(models.SourceProgress.objects.filter(
+            lt_realization__hazard_calculation=hc,
+            is_complete=True).exists())
+        self.assertTrue(self.calc.progress['total'] > 0)
+
+    def test_finalize_hazard_curves(self):
+        # the matrices saved through the ORM are copied to the final
+        # hazard curves
+        self.calc.pre_execute()
+        self.job.is_running = True
+        self.job.status = 'executing'
+        self.job.save()
+
+        lt_rlz = models.LtRealization.objects.filter(
+            hazard_calculation=self.job.hazard_calculation).latest('id')
+        num_sites = len(self.calc.computation_mesh)
+        for hc_prog in models.HazardCurveProgress.objects.filter(
+                lt_realization=lt_rlz):
+            hc_prog.result_matrix = numpy.ones(
+                hc_prog.result_matrix.shape) * 0.5
+            hc_prog.save()
+
+        self.calc.finalize_hazard_curves()
+
+        curves = models.HazardCurveData.objects.filter(
+            hazard_curve__lt_realization=lt_rlz,
+            hazard_curve__imt='PGA')
+        self.assertEqual(num_sites, curves.count())
+        for curve in curves:
+            self.assertEqual([0.5] * 19, curve.poes)
+
+    def test_update_source_progress_twice(self):
+        # the second copy of a task dispatched twice does not update the
+        # progress counters
+        self.calc.pre_execute()
+        src_prog = models.SourceProgress.objects.filter(
+            is_complete=False,
+            lt_realization__hazard_calculation=self.job.hazard_calculation
+        ).latest('id')
+        src_id = src_prog.parsed_source.id
+        lt_rlz = src_prog.lt_realization
+        completed_items = lt_rlz.completed_items
+
+        self.assertTrue(core._update_source_progress(
+            lt_rlz, [src_id], speculative=True))
+        self.assertFalse(core._update_source_progress(
+            lt_rlz, [src_id], speculative=True))
+        # without the speculative execution, a task is never dispatched
+        # twice
+        self.assertRaises(RuntimeError, core._update_source_progress,
+                          lt_rlz, [src_id])
+
+        self.assertTrue(
+            models.SourceProgress.objects.get(id=src_prog.id).is_complete)
+        lt_rlz = models.LtRealization.objects.get(id=lt_rlz.id)
+        self.assertEqual(completed_items + 1, lt_rlz.completed_items)
+
 
 class HelpersTestCase(unittest.TestCase):
     """
@@ -455,3 +547,172 @@ class HelpersTestCase(unittest.TestCase):
 
         expected = numpy.array([0.44] * 16).reshape((4, 4))
         numpy.testing.assert_allclose(expected, result)
+
+    def test_site_tiles(self):
+        with mock.patch('openquake.engine.utils.config.get') as get:
+            get.return_value = '4'
+            self.assertEqual(
+                [slice(0, 4), slice(4, 8), slice(8, 10)],
+                core.site_tiles(10))
+            get.assert_called_once_with('hazard', 'site_tile_size')
+
+            get.return_value = '20'
+            self.assertEqual([slice(0, 10)], core.site_tiles(10))
+
+    def test_site_tiles_not_configured(self):
+        with mock.patch('openquake.engine.utils.config.get') as get:
+            get.return_value = None
+            self.assertEqual([slice(0, 10)], core.site_tiles(10))
+
+
+class ControlNodeReductionTestCase(unittest.TestCase):
+    """
+    Tests for the reduction of the partial hazard curves on the control node.
+    """
+
+    def setUp(self):
+        self.calc = core.ClassicalHazardCalculator(mock.Mock())
+
+    def test_task_completed_hook(self):
+        body = dict(job_id=1, num_items=1, lt_rlz_id=7,
+                    matrices={'PGA': numpy.array([[0.2, 0.1]])})
+        rlz = mock.Mock(total_items=2)
+        with mock.patch('openquake.engine.db.models.LtRealization.objects'
+                        '.get') as get:
+            get.return_value = rlz
+            with mock.patch.object(
+                    self.calc, 'save_hazard_curve_progress') as save:
+                self.calc.task_completed_hook(body)
+                self.assertEqual(0, save.call_count)
+
+                body['matrices'] = {'PGA': numpy.array([[0.3, 0.0]])}
+                self.calc.task_completed_hook(body)
+                save.assert_called_once_with(7)
+
+        numpy.testing.assert_allclose(
+            [[0.44, 0.1]], 1 - self.calc.curves_complement[(7, 0, 'PGA')])
+
+    def test_task_completed_hook_with_tiles(self):
+        rlz = mock.Mock(total_items=2)
+        with mock.patch('openquake.engine.db.models.LtRealization.objects'
+                        '.get') as get:
+            get.return_value = rlz
+            with mock.patch.object(
+                    self.calc, 'save_hazard_curve_progress') as save:
+                self.calc.task_completed_hook(dict(
+                    job_id=1, num_items=1, lt_rlz_id=7, site_offset=0,
+                    matrices={'PGA': numpy.array([[0.2, 0.1]])}))
+                self.calc.task_completed_hook(dict(
+                    job_id=1, num_items=1, lt_rlz_id=7, site_offset=1,
+                    matrices={'PGA': numpy.array([[0.3, 0.0]])}))
+                save.assert_called_once_with(7)
+
+        # the curves of different tiles are not combined
+        numpy.testing.assert_allclose(
+            [[0.2, 0.1]], 1 - self.calc.curves_complement[(7, 0, 'PGA')])
+        numpy.testing.assert_allclose(
+            [[0.3, 0.0]], 1 - self.calc.curves_complement[(7, 1, 'PGA')])
+
+    def test_task_completed_hook_with_shared_sources(self):
+        rlz = mock.Mock(total_items=1)
+        with mock.patch('openquake.engine.db.models.LtRealization.objects'
+                        '.get') as get:
+            get.return_value = rlz
+            with mock.patch.object(
+                    self.calc, 'save_hazard_curve_progress') as save:
+                self.calc.task_completed_hook(dict(
+                    job_id=1, num_items=2, lt_rlz_id=[7, 8],
+                    matrices=[{'PGA': numpy.array([[0.2, 0.1]])},
+                              {'PGA': numpy.array([[0.3, 0.0]])}]))
+                self.assertEqual([((7,), {}), ((8,), {})],
+                                 save.call_args_list)
+
+        numpy.testing.assert_allclose(
+            [[0.2, 0.1]], 1 - self.calc.curves_complement[(7, 0, 'PGA')])
+        numpy.testing.assert_allclose(
+            [[0.3, 0.0]], 1 - self.calc.curves_complement[(8, 0, 'PGA')])
+
+    def test_task_completed_hook_with_filtered_sources(self):
+        # one of the two sources of the realization is too far from the
+        # sites, so no task is dispatched for it
+        rlz = mock.Mock(id=7, completed_items=1, total_items=2)
+        with mock.patch('openquake.engine.db.models.LtRealization.objects'
+                        '.filter') as filt:
+            filt.return_value = [rlz]
+            self.calc.initialize_rlz_items()
+
+        with mock.patch.object(
+                self.calc, 'save_hazard_curve_progress') as save:
+            self.calc.task_completed_hook(dict(
+                job_id=1, num_items=1, lt_rlz_id=7,
+                matrices={'PGA': numpy.array([[0.2, 0.1]])}))
+            save.assert_called_once_with(7)
+
+    def test_task_completed_hook_without_matrices(self):
+        self.calc.task_completed_hook(dict(job_id=1, num_items=1))
+        self.assertEqual({}, self.calc.curves_complement)
+
+
+class _FakeSites(object):
+    def __init__(self, num_sites):
+        self.num_sites = num_sites
+
+    def __len__(self):
+        return self.num_sites
+
+    def expand(self, data, total_sites, placeholder):
+        return data
+
+
+class _FakeGsim(object):
+    #: the PoE of each IML
+    POE = None
+
+    def __init__(self, contexts):
+        self.contexts = contexts
+
+    def make_contexts(self, sites, rupture):
+        self.contexts.append(self.__class__)
+        return None, None, None
+
+    def get_poes(self, sctx, rctx, dctx, imt, imls, truncation_level):
+        return numpy.array([[self.POE] * len(imls)] * 2)
+
+
+class _SureGsim(_FakeGsim):
+    POE = 1.
+
+
+class _NullGsim(_FakeGsim):
+    POE = 0.
+
+
+class HazardCurvesMultiGsimsTestCase(unittest.TestCase):
+    """
+    Tests for :func:`openquake.engine.calculators.hazard.classical.core.\
+hazard_curves_multi_gsims`.
+    """
+
+    def test_hazard_curves(self):
+        contexts = []
+        rupture = mock.Mock(tectonic_region_type='Active')
+        rupture.get_probability_one_or_more_occurrences.return_value = 0.5
+        source = mock.Mock()
+        source.iter_ruptures.return_value = [rupture, rupture]
+
+        gsims_list = [dict(Active=_SureGsim(contexts)),
+                      dict(Active=_NullGsim(contexts)),
+                      dict(Active=_SureGsim(contexts))]
+        curves = core.hazard_curves_multi_gsims(
+            [source], _FakeSites(2), {'PGA': [0.1, 0.2]}, 50., gsims_list,
+            3.)
+
+        self.assertEqual(3, len(curves))
+        numpy.testing.assert_allclose(
+            numpy.ones((2, 2)) * 0.75, curves[0]['PGA'])
+        numpy.testing.assert_allclose(numpy.zeros((2, 2)), curves[1]['PGA'])
+        numpy.testing.assert_allclose(curves[0]['PGA'], curves[2]['PGA'])
+        # the ruptures are generated once, and the contexts are computed
+        # once per rupture and GSIM
+        self.assertEqual(1, source.iter_ruptures.call_count)
+        self.assertEqual([_SureGsim, _NullGsim] * 2, contexts)
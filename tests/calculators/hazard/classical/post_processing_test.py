@@ -758,3 +758,54 @@ class QuantileCurveTestCase(unittest.TestCase):
             curves, weights, quantile)
 
         numpy.testing.assert_allclose(expected_curve, actual_curve)
+
+    def test_compute_weighted_quantile_curve_interpolation(self):
+        curves = [
+            [9.9996e-01, 9.9962e-01, 9.9674e-01],
+            [6.9909e-01, 6.0859e-01, 5.0328e-01],
+            [1.0000e+00, 9.9996e-01, 9.9947e-01],
+        ]
+        weights = [0.5, 0.3, 0.2]
+
+        # below the smallest cumulative weight the lowest poes are taken
+        numpy.testing.assert_allclose(
+            [6.9909e-01, 6.0859e-01, 5.0328e-01],
+            post_processing.weighted_quantile_curve(curves, weights, 0.1))
+
+        # in the middle they are interpolated
+        numpy.testing.assert_allclose(
+            [0.849525, 0.804105, 0.75001],
+            post_processing.weighted_quantile_curve(curves, weights, 0.55))
+
+        # at the top the highest poes are taken
+        numpy.testing.assert_allclose(
+            [1.0000e+00, 9.9996e-01, 9.9947e-01],
+            post_processing.weighted_quantile_curve(curves, weights, 1.0))
+
+    def test_quantile_curves_of_many_sites(self):
+        # (realizations x sites x levels)
+        curves = numpy.array([
+            [[9.9996e-01, 9.9962e-01, 9.9674e-01],
+             [9.2439e-01, 8.6700e-01, 7.7785e-01]],
+            [[6.9909e-01, 6.0859e-01, 5.0328e-01],
+             [8.9556e-01, 8.3045e-01, 7.3646e-01]],
+            [[1.0000e+00, 9.9996e-01, 9.9947e-01],
+             [9.1873e-01, 8.6697e-01, 7.8992e-01]],
+        ])
+        weights = [0.5, 0.3, 0.2]
+
+        for quantile in (0.1, 0.3, 0.55, 0.9):
+            weighted = post_processing.weighted_quantile_curve(
+                curves, weights, quantile)
+            unweighted = post_processing.quantile_curve(curves, quantile)
+            self.assertEqual((2, 3), weighted.shape)
+            self.assertEqual((2, 3), unweighted.shape)
+            for site in range(2):
+                numpy.testing.assert_allclose(
+                    post_processing.weighted_quantile_curve(
+                        curves[:, site], weights, quantile),
+                    weighted[site])
+                numpy.testing.assert_allclose(
+                    mstats.mquantiles(
+                        curves[:, site], prob=quantile, axis=0)[0],
+                    unweighted[site])
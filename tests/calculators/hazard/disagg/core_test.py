@@ -250,6 +250,22 @@ class DisaggHazardCalculatorTestcase(unittest.TestCase):
             m.stop()
             patches[i].stop()
 
+    def test_pre_execute_does_not_filter_sources(self):
+        # the realizations need the disaggregation phase even if no source
+        # can affect the sites, so the sources are not filtered
+        with mock.patch('openquake.engine.calculators.hazard.general'
+                        '.filter_sources') as filter_sources:
+            filter_sources.return_value = []
+            self.calc.pre_execute()
+
+        self.assertEqual(0, filter_sources.call_count)
+        num_sources = models.SourceProgress.objects.filter(
+            lt_realization__hazard_calculation=self.calc.hc).count()
+        self.assertTrue(num_sources > 0)
+        self.assertEqual(num_sources, self.calc.progress['hc_total'])
+        self.assertFalse(models.LtRealization.objects.filter(
+            hazard_calculation=self.calc.hc, is_complete=True).exists())
+
     @attr('slow')
     def test_workflow(self):
         # Test `pre_execute` to ensure that all stats are properly initialized.
@@ -319,3 +335,26 @@ class DisaggHazardCalculatorTestcase(unittest.TestCase):
             self.assertEqual(6, rlz.total_items)
             self.assertEqual(6, rlz.completed_items)
             self.assertTrue(rlz.is_complete)
+
+    @attr('slow')
+    def test_hazard_curve_phase_with_control_node_reduction(self):
+        # the disaggregation calculator does not reduce the hazard curves
+        # on the control node, so its tasks must save them even if the
+        # reduction is enabled for the classical calculator
+        self.calc.pre_execute()
+        self.job.is_running = True
+        self.job.status = 'executing'
+        self.job.save()
+
+        with mock.patch('openquake.engine.utils.config.flag_set') as flag:
+            flag.return_value = True
+            with mock.patch('%s.signal_task_complete'
+                            % 'openquake.engine.calculators.base'):
+                for args in self.calc.task_arg_gen(1):
+                    if args[-1] == 'hazard_curve':
+                        disagg_core.disagg_task(*args)
+
+        hc_progress = models.HazardCurveProgress.objects.filter(
+            lt_realization__hazard_calculation=self.calc.hc)
+        self.assertTrue(
+            any((prog.result_matrix != 0).any() for prog in hc_progress))
@@ -49,13 +49,14 @@ class EventBasedHazardCalculatorTestCase(unittest.TestCase):
         # locations. On the first two locations the values are
         # nonzero, in the third one is zero. Then, we will expect the
         # bulk inserter to add only two entries.
-        gmvs = numpy.matrix([[1., 1.],
-                             [1., 1.],
-                             [0., 0.]])
-        gmf_dict = {imt.PGA: dict(rupture_ids=[1, 2], gmvs=gmvs)}
+        gmf_dict = core._create_gmf_cache([imt.PGA])
+        core._update_gmf_cache(
+            gmf_dict, {imt.PGA: numpy.matrix([[1.], [1.], [0.]])}, 1)
+        core._update_gmf_cache(
+            gmf_dict, {imt.PGA: numpy.matrix([[1.], [1.], [0.]])}, 2)
 
         fake_bulk_inserter = mock.Mock()
-        with helpers.patch('openquake.engine.writer.BulkInserter') as m:
+        with helpers.patch('openquake.engine.writer.CopyBulkInserter') as m:
             m.return_value = fake_bulk_inserter
             core._save_gmfs(
                 gmf_set, gmf_dict, [mock.Mock(), mock.Mock(), mock.Mock()], 1)
@@ -64,11 +65,13 @@ class EventBasedHazardCalculatorTestCase(unittest.TestCase):
     def test_save_only_nonzero_gmvs(self):
         gmf_set = mock.Mock()
 
-        gmvs = numpy.matrix([[0.0, 0, 1]])
-        gmf_dict = {imt.PGA: dict(rupture_ids=[1, 2, 3], gmvs=gmvs)}
+        gmf_dict = core._create_gmf_cache([imt.PGA])
+        for rupture_id, gmv in [(1, 0.0), (2, 0), (3, 1)]:
+            core._update_gmf_cache(
+                gmf_dict, {imt.PGA: numpy.matrix([[gmv]])}, rupture_id)
 
         fake_bulk_inserter = mock.Mock()
-        with helpers.patch('openquake.engine.writer.BulkInserter') as m:
+        with helpers.patch('openquake.engine.writer.CopyBulkInserter') as m:
             m.return_value = fake_bulk_inserter
             core._save_gmfs(
                 gmf_set, gmf_dict, [mock.Mock()], 1)
@@ -76,6 +79,63 @@ class EventBasedHazardCalculatorTestCase(unittest.TestCase):
             self.assertEqual([1], call_args['gmvs'])
             self.assertEqual([3], call_args['rupture_ids'])
 
+    def test_save_gmfs_grouped_by_site(self):
+        gmf_set = mock.Mock()
+        points = [mock.Mock(wkt2d='POINT(0.0 0.0)'),
+                  mock.Mock(wkt2d='POINT(1.0 0.0)')]
+
+        gmf_dict = core._create_gmf_cache([imt.PGA])
+        core._update_gmf_cache(
+            gmf_dict, {imt.PGA: numpy.matrix([[0.1], [0.2]])}, 7)
+        core._update_gmf_cache(
+            gmf_dict, {imt.PGA: numpy.matrix([[0.], [0.3]])}, 8)
+        core._update_gmf_cache(
+            gmf_dict, {imt.PGA: numpy.matrix([[0.4], [0.5]])}, 9)
+
+        fake_bulk_inserter = mock.Mock()
+        with helpers.patch('openquake.engine.writer.CopyBulkInserter') as m:
+            m.return_value = fake_bulk_inserter
+            core._save_gmfs(gmf_set, gmf_dict, points, 1)
+
+        entries = [kwargs for _args, kwargs
+                   in fake_bulk_inserter.add_entry.call_args_list]
+        self.assertEqual(
+            [('POINT(0.0 0.0)', [0.1, 0.4], [7, 9]),
+             ('POINT(1.0 0.0)', [0.2, 0.3, 0.5], [7, 8, 9])],
+            [(e['location'], e['gmvs'], e['rupture_ids']) for e in entries])
+
+    def test_rupture_writer(self):
+        ses = mock.Mock(id=3)
+        rupture = mock.Mock(
+            source_typology=None, mag=5.5, rake=90.,
+            tectonic_region_type='Active Shallow Crust')
+        rupture.surface.get_strike.return_value = 10.
+        rupture.surface.get_dip.return_value = 45.
+        for corner in ('top_left', 'top_right', 'bottom_right',
+                       'bottom_left'):
+            setattr(rupture.surface, corner,
+                    mock.Mock(longitude=0., latitude=0., depth=5.))
+
+        rupture_writer = core._RuptureWriter(2, id_block_size=2)
+        fake_bulk_inserter = mock.Mock()
+        rupture_writer.inserter = fake_bulk_inserter
+        with helpers.patch('openquake.engine.writer.allocate_ids') as alloc:
+            alloc.side_effect = [[10, 11], [14, 15]]
+            ids = [rupture_writer.add(ses, rupture, i) for i in (1, 2, 3)]
+
+        self.assertEqual([10, 11, 14], ids)
+        self.assertEqual(2, alloc.call_count)
+        entries = [kwargs for _args, kwargs
+                   in fake_bulk_inserter.add_entry.call_args_list]
+        self.assertEqual([10, 11, 14], [e['id'] for e in entries])
+        self.assertEqual([1, 2, 3], [e['rupture_ordinal'] for e in entries])
+        self.assertTrue(all(e['ses_id'] == 3 and e['result_grp_ordinal'] == 2
+                            for e in entries))
+        self.assertEqual(0, fake_bulk_inserter.flush.call_count)
+
+        rupture_writer.flush()
+        self.assertEqual(1, fake_bulk_inserter.flush.call_count)
+
     def test_initialize_ses_db_records(self):
         hc = self.job.hazard_calculation
 
@@ -311,10 +371,11 @@ class EventBasedHazardCalculatorTestCase(unittest.TestCase):
             ses_collection__output__output_type='complete_lt_ses',
             complete_logic_tree_ses=True)
 
-        clt_ses_ruptures = models.SESRupture.objects.filter(
-            ses=complete_lt_ses.id)
-
-        self.assertEqual(210, clt_ses_ruptures.count())
+        # The ruptures are not copied: the complete logic tree SES refers
+        # to the ruptures of all of the realizations
+        self.assertEqual(0, models.SESRupture.objects.filter(
+            ses=complete_lt_ses.id).count())
+        self.assertEqual(210, len(list(complete_lt_ses)))
 
         # Test the computed `investigation_time`
         # 2 lt realizations * 5 ses_per_logic_tree_path * 50.0 years
@@ -327,3 +388,40 @@ class EventBasedHazardCalculatorTestCase(unittest.TestCase):
         # of all the GMFs for a calculation.
         # Because GMFs take up a lot of space, we don't store a copy of this
         # as we do with SES.
+
+
+class TaskArgGenTestCase(unittest.TestCase):
+    """
+    Tests for :meth:`openquake.engine.calculators.hazard.event_based.core.\
+EventBasedHazardCalculator.task_arg_gen`.
+    """
+
+    def setUp(self):
+        job = mock.Mock(id=1)
+        job.hazard_calculation.random_seed = 42
+        self.calc = core.EventBasedHazardCalculator(job)
+        self.rlzs = [mock.Mock(id=7), mock.Mock(id=8)]
+
+    def _task_args(self, blocks):
+        with mock.patch('openquake.engine.db.models.LtRealization.objects'
+                        '.filter') as filt:
+            filt.return_value.order_by.return_value = self.rlzs
+            with mock.patch.object(self.calc, 'source_blocks') as blocks_:
+                blocks_.return_value = blocks
+                return list(self.calc.task_arg_gen(2))
+
+    def test_seeds_do_not_depend_on_the_dispatch_order(self):
+        rlz1, rlz2 = self.rlzs
+        # the blocks of two realizations, split in the same way, but with
+        # different weights
+        by_rlz = self._task_args([(rlz1, 0, [3, 1]), (rlz1, 0, [2]),
+                                  (rlz2, 0, [1, 2]), (rlz2, 0, [3])])
+        by_weight = self._task_args([(rlz2, 0, [1, 2]), (rlz1, 0, [3, 1]),
+                                     (rlz2, 0, [3]), (rlz1, 0, [2])])
+
+        self.assertEqual([1, 2, 3, 4], [args[4] for args in by_rlz])
+        self.assertEqual(sorted(by_rlz, key=lambda args: args[4]),
+                         sorted(by_weight, key=lambda args: args[4]))
+        # the tasks are dispatched in the order of the blocks
+        self.assertEqual([[1, 2], [3, 1], [3], [2]],
+                         [args[1] for args in by_weight])
@@ -14,14 +14,17 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import getpass
 import unittest
 
 import numpy
 
 from openquake.engine.calculators.hazard.event_based import (
     post_processing as pp)
+from openquake.engine.db import models
 
 from tests.calculators.hazard.event_based import _pp_test_data as test_data
+from tests.utils import helpers
 
 
 class GmvsToHazCurveTestCase(unittest.TestCase):
@@ -52,3 +55,111 @@ post_processing.gmvs_to_haz_curve`.
         actual_poes = pp.gmvs_to_haz_curve(gmvs, imls, invest_time, duration)
         numpy.testing.assert_array_almost_equal(
             expected_poes, actual_poes, decimal=6)
+
+
+class CountExceedancesTestCase(unittest.TestCase):
+    """
+    Tests for
+    :func:`openquake.engine.calculators.hazard.event_based.\
+post_processing.count_exceedances`.
+    """
+
+    def test_count_exceedances(self):
+        imls = [0.01, 0.1, 0.2]
+        gmvs_1 = numpy.array(test_data.SITE_1_GMVS)
+        gmvs_2 = numpy.array(test_data.SITE_2_GMVS)
+        # the third site has no ground motion values
+        site_idxs = numpy.concatenate([numpy.zeros(len(gmvs_1), dtype=int),
+                                       numpy.ones(len(gmvs_2), dtype=int)])
+        gmvs = numpy.concatenate([gmvs_1, gmvs_2])
+
+        counts = pp.count_exceedances(site_idxs, gmvs, imls, 3)
+
+        self.assertEqual((3, 3), counts.shape)
+        for i, site_gmvs in enumerate([gmvs_1, gmvs_2]):
+            expected = [(site_gmvs >= iml).sum() for iml in imls]
+            numpy.testing.assert_array_equal(expected, counts[i])
+        numpy.testing.assert_array_equal([0, 0, 0], counts[2])
+
+    def test_consistent_with_gmvs_to_haz_curve(self):
+        imls = [0.01, 0.1, 0.2]
+        gmvs = numpy.array(test_data.SITE_1_GMVS)
+        site_idxs = numpy.zeros(len(gmvs), dtype=int)
+
+        [counts] = pp.count_exceedances(site_idxs, gmvs, imls, 1)
+        poes = 1 - numpy.exp(- (1.0 / 1000.0) * counts)
+
+        numpy.testing.assert_array_almost_equal(
+            pp.gmvs_to_haz_curve(gmvs, imls, 1.0, 1000.0), poes)
+
+
+class GmfToHazardCurveTaskTestCase(unittest.TestCase):
+    """
+    Tests for
+    :func:`openquake.engine.calculators.hazard.event_based.\
+post_processing.gmf_to_hazard_curve_task`.
+    """
+
+    def setUp(self):
+        cfg = helpers.get_data_path('event_based_hazard/job.ini')
+        self.job = helpers.get_hazard_job(cfg, username=getpass.getuser())
+        self.job.is_running = True
+        self.job.status = 'executing'
+        self.job.save()
+        self.hc = self.job.hazard_calculation
+        self.rlz = models.LtRealization.objects.create(
+            hazard_calculation=self.hc, ordinal=0, seed=1, weight=None,
+            sm_lt_path="test_sm", gsim_lt_path="test_gsim",
+            is_complete=False, total_items=1, completed_items=1)
+
+    def test_gmf_to_hazard_curve_task(self):
+        points = list(self.hc.points_to_compute())
+        imls = [0.1, 0.3, 0.5]
+        invest_time = 50.0
+        duration = 250.0
+
+        rupture_ids = helpers.get_rupture_ids(self.job, self.hc, self.rlz, 3)
+        gmf_set = models.GmfSet.objects.create(
+            gmf_collection=models.GmfCollection.objects.create(
+                output=models.Output.objects.create_output(
+                    self.job, "Test GMF", "gmf"),
+                lt_realization=self.rlz,
+                complete_logic_tree_gmf=False),
+            investigation_time=invest_time,
+            ses_ordinal=1,
+            complete_logic_tree_gmf=False)
+
+        # the GMFs of a site can be split in several records
+        site_gmvs = [(0, [0.2, 0.4, 0.6]), (0, [0.05, 0.35, 0.55]),
+                     (5, [0.6, 0.1, 0.2])]
+        for site_idx, gmvs in site_gmvs:
+            models.Gmf.objects.create(
+                gmf_set=gmf_set, imt="PGA", gmvs=gmvs,
+                rupture_ids=rupture_ids, result_grp_ordinal=1,
+                location=points[site_idx].wkt2d)
+
+        haz_curve = models.HazardCurve.objects.create(
+            output=models.Output.objects.create_output(
+                self.job, "Test hazard curves", "hazard_curve"),
+            lt_realization=self.rlz,
+            investigation_time=invest_time,
+            imt="PGA",
+            imls=imls)
+
+        pp.gmf_to_hazard_curve_task(
+            self.job.id, self.rlz.id, "PGA", imls, haz_curve.id,
+            invest_time, duration)
+
+        curves = models.HazardCurveData.objects.filter(
+            hazard_curve=haz_curve).order_by('id')
+        self.assertEqual(len(points), curves.count())
+        expected = {
+            0: pp.gmvs_to_haz_curve(
+                [0.2, 0.4, 0.6, 0.05, 0.35, 0.55], imls, invest_time,
+                duration),
+            5: pp.gmvs_to_haz_curve(
+                [0.6, 0.1, 0.2], imls, invest_time, duration),
+        }
+        for i, curve in enumerate(curves):
+            numpy.testing.assert_array_almost_equal(
+                expected.get(i, [0.0] * len(imls)), curve.poes)
@@ -17,15 +17,28 @@
 
 import unittest
 
+import mock
+import numpy
 import openquake.hazardlib
 
 from openquake.hazardlib import geo as hazardlib_geo
+from openquake.hazardlib.calc import filters
+from openquake.hazardlib.calc.hazard_curve import hazard_curves_poissonian
+from openquake.hazardlib.const import TRT
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
+from openquake.hazardlib.imt import PGA
+from openquake.hazardlib.mfd import TruncatedGRMFD
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.scalerel import PeerMSR
+from openquake.hazardlib.source import PointSource
 from nose.plugins.attrib import attr
 
 from openquake.engine import engine2
 from openquake.engine.calculators.hazard import general
 from openquake.engine.calculators.hazard.classical import core as cls_core
 from openquake.engine.db import models
+from openquake.engine.input import logictree
+from openquake.engine.utils import general as general_utils
 
 from tests.utils import helpers
 
@@ -319,6 +332,31 @@ class ClosestSiteModelTestCase(unittest.TestCase):
         self.assertEqual(sm1, res1)
         self.assertEqual(sm2, res2)
 
+    def test_store_site_data(self):
+        cfg = helpers.demo_file('simple_fault_demo_hazard/job.ini')
+        job = helpers.get_hazard_job(cfg)
+
+        models.SiteModel(
+            input=self.site_model_inp, vs30_type='measured', vs30=1.0,
+            z1pt0=2.0, z2pt5=3.0, location='POINT(-1 0)').save()
+        models.SiteModel(
+            input=self.site_model_inp, vs30_type='inferred', vs30=4.0,
+            z1pt0=5.0, z2pt5=6.0, location='POINT(1 0)').save()
+
+        mesh = hazardlib_geo.Mesh(
+            numpy.array([-0.5, 0.5, -2.0]), numpy.array([0., 0., 1.]),
+            depths=None)
+        site_data = general.store_site_data(
+            job.hazard_calculation.id, self.site_model_inp, mesh)
+
+        numpy.testing.assert_equal([-0.5, 0.5, -2.0], site_data.lons)
+        numpy.testing.assert_equal([0., 0., 1.], site_data.lats)
+        numpy.testing.assert_equal([1.0, 4.0, 1.0], site_data.vs30s)
+        numpy.testing.assert_equal(
+            [True, False, True], site_data.vs30_measured)
+        numpy.testing.assert_equal([2.0, 5.0, 2.0], site_data.z1pt0s)
+        numpy.testing.assert_equal([3.0, 6.0, 3.0], site_data.z2pt5s)
+
 
 class ImtsToHazardlibTestCase(unittest.TestCase):
     """
@@ -359,6 +397,231 @@ class ImtsToHazardlibTestCase(unittest.TestCase):
             self.assertEqual(exp_imls, act_imls)
 
 
+class _FakeSource(object):
+    def __init__(self, nrml):
+        self.nrml = nrml
+        self.mfd = []
+
+
+class GenSourcesTestCase(unittest.TestCase):
+    """
+    Tests for :func:`openquake.engine.calculators.hazard.general.gen_sources`.
+    """
+
+    def setUp(self):
+        general._SOURCE_CACHE.clear()
+
+    def tearDown(self):
+        general._SOURCE_CACHE.clear()
+
+    def test_sources_are_cached(self):
+        parsed_sources = [mock.Mock(id=1), mock.Mock(id=2)]
+        apply_uncertainties = mock.Mock()
+
+        with mock.patch('openquake.engine.db.models.ParsedSource.objects'
+                        '.filter') as filt:
+            with mock.patch('openquake.engine.input.source'
+                            '.nrml_to_hazardlib') as conv:
+                filt.return_value = parsed_sources
+                conv.side_effect = lambda nrml, *args: _FakeSource(nrml)
+
+                first = list(general.gen_sources(
+                    [1, 2], apply_uncertainties, 5, 0.1, 10))
+                filt.assert_called_once_with(id__in=[1, 2])
+                self.assertEqual(2, conv.call_count)
+
+                # the second realization does not reload nor reconvert
+                filt.return_value = []
+                second = list(general.gen_sources(
+                    [2, 1], apply_uncertainties, 5, 0.1, 10))
+                filt.assert_called_with(id__in=[])
+                self.assertEqual(2, conv.call_count)
+
+        self.assertEqual([parsed_sources[0].nrml, parsed_sources[1].nrml],
+                         [src.nrml for src in first])
+        self.assertEqual([parsed_sources[1].nrml, parsed_sources[0].nrml],
+                         [src.nrml for src in second])
+        # each realization gets its own copy of the MFD
+        self.assertFalse(first[0].mfd is second[1].mfd)
+        self.assertEqual(4, apply_uncertainties.call_count)
+
+    def test_cache_smaller_than_the_block(self):
+        # the cached source 3 is evicted while converting the sources 1 and
+        # 2, but it is still yielded without being loaded again
+        cache = general_utils.LRUCache(1)
+        cache[(3, 5, 0.1, 10)] = _FakeSource('nrml3')
+        parsed_sources = [mock.Mock(id=1), mock.Mock(id=2)]
+
+        with mock.patch('openquake.engine.calculators.hazard.general'
+                        '._SOURCE_CACHE', cache):
+            with mock.patch('openquake.engine.db.models.ParsedSource.objects'
+                            '.filter') as filt:
+                with mock.patch('openquake.engine.input.source'
+                                '.nrml_to_hazardlib') as conv:
+                    filt.return_value = parsed_sources
+                    conv.side_effect = lambda nrml, *args: _FakeSource(nrml)
+
+                    sources = list(general.gen_sources(
+                        [1, 2, 3], mock.Mock(), 5, 0.1, 10))
+                    filt.assert_called_once_with(id__in=[1, 2])
+                    self.assertEqual(2, conv.call_count)
+
+        self.assertEqual(
+            [parsed_sources[0].nrml, parsed_sources[1].nrml, 'nrml3'],
+            [src.nrml for src in sources])
+        self.assertEqual(1, len(cache))
+        self.assertIn((2, 5, 0.1, 10), cache)
+
+
+class FilterSourcesTestCase(unittest.TestCase):
+    """
+    Tests for :func:`openquake.engine.calculators.hazard.general.\
+filter_sources`.
+    """
+
+    def setUp(self):
+        self.mesh = hazardlib_geo.Mesh(
+            numpy.array([0.0, 0.5, 10.0]), numpy.array([0.0, 0.5, 10.0]),
+            None)
+
+    @staticmethod
+    def _square(lon, lat, size=0.1):
+        return hazardlib_geo.Polygon(
+            [hazardlib_geo.Point(lon, lat),
+             hazardlib_geo.Point(lon + size, lat),
+             hazardlib_geo.Point(lon + size, lat + size),
+             hazardlib_geo.Point(lon, lat + size)])
+
+    def test_filter_sources(self):
+        polygons = [
+            # containing a site
+            (1, self._square(-0.05, -0.05)),
+            # ~45 km from the site in (0.5, 0.5)
+            (2, self._square(0.9, 0.45)),
+            # more than 500 km from all the sites
+            (3, self._square(5.0, 5.0)),
+            # ~5 km from the site in (10, 10)
+            (4, self._square(10.05, 9.9, 0.2)),
+        ]
+        self.assertEqual([1, 4], general.filter_sources(
+            polygons, self.mesh, 20))
+        self.assertEqual([1, 2, 4], general.filter_sources(
+            polygons, self.mesh, 60))
+
+    def test_no_sources(self):
+        self.assertEqual([], general.filter_sources([], self.mesh, 200))
+
+    def test_source_with_uncertainties(self):
+        # a site just outside the dilated polygon of the stored source is
+        # affected by the source once its maximum magnitude is increased
+        # by the logic tree, so such sources cannot be filtered in advance
+        src = PointSource(
+            source_id='1', name='point',
+            tectonic_region_type=TRT.ACTIVE_SHALLOW_CRUST,
+            mfd=TruncatedGRMFD(a_val=3.1, b_val=0.9, min_mag=5.0,
+                               max_mag=6.5, bin_width=0.1),
+            nodal_plane_distribution=PMF(
+                [(1, hazardlib_geo.NodalPlane(0.0, 90.0, 0.0))]),
+            hypocenter_distribution=PMF([(1, 5.0)]),
+            upper_seismogenic_depth=0.0, lower_seismogenic_depth=10.0,
+            magnitude_scaling_relationship=PeerMSR(),
+            rupture_aspect_ratio=1, location=hazardlib_geo.Point(5.0, 6.0),
+            rupture_mesh_spacing=1.0)
+        distance = 20.0
+        polygon = src.get_rupture_enclosing_polygon()
+        # the ruptures are vertical and strike north
+        site = hazardlib_geo.Point(
+            5.0, polygon.dilate(distance).lats.max() + 0.01)
+        mesh = hazardlib_geo.Mesh(
+            numpy.array([site.longitude]), numpy.array([site.latitude]),
+            None)
+        self.assertEqual(
+            [], general.filter_sources([('1', polygon)], mesh, distance))
+
+        logictree.BranchSet('maxMagGRRelative', {}).apply_uncertainty(
+            1.0, src)
+        sites = openquake.hazardlib.site.SiteCollection(
+            [openquake.hazardlib.site.Site(site, 760.0, True, 100.0, 5.0)])
+        curves = hazard_curves_poissonian(
+            [src], sites, {PGA(): [0.001]}, 50.0,
+            {TRT.ACTIVE_SHALLOW_CRUST: SadighEtAl1997()}, 3.0,
+            source_site_filter=filters.source_site_distance_filter(distance))
+        self.assertTrue((curves[PGA()] > 0).all())
+
+
+class SourceBlocksTestCase(unittest.TestCase):
+    """
+    Tests for :meth:`openquake.engine.calculators.hazard.general.\
+BaseHazardCalculatorNext.source_blocks`.
+    """
+
+    def setUp(self):
+        self.calc = general.BaseHazardCalculatorNext(mock.Mock())
+        self.rlzs = [mock.Mock(id=7), mock.Mock(id=8)]
+        # realization id -> (site offset, source id, weight)
+        self.rows = {7: [(0, 1, 10), (0, 2, 1), (0, 3, 5)],
+                     8: [(0, 1, 30), (0, 2, 2), (0, 3, 1)]}
+
+    def _blocks(self, **kwargs):
+        def filt(lt_rlz, **_kwargs):
+            src_prog = mock.Mock()
+            src_prog.order_by.return_value.values_list.return_value = (
+                self.rows[lt_rlz.id])
+            return src_prog
+
+        with mock.patch('openquake.engine.db.models.SourceProgress.objects'
+                        '.filter') as source_progress:
+            source_progress.side_effect = filt
+            return [(lt_rlz.id, site_offset, block)
+                    for lt_rlz, site_offset, block in self.calc.source_blocks(
+                        self.rlzs, 2, **kwargs)]
+
+    def test_across_realizations(self):
+        self.assertEqual([(8, 0, [1]), (7, 0, [1]), (7, 0, [3, 2]),
+                          (8, 0, [2, 3])], self._blocks())
+
+    def test_realization_by_realization(self):
+        self.assertEqual([(7, 0, [1]), (7, 0, [3, 2]), (8, 0, [1]),
+                          (8, 0, [2, 3])],
+                         self._blocks(across_realizations=False))
+
+
+class SiteCollectionTileTestCase(unittest.TestCase):
+    """
+    Tests for :func:`openquake.engine.calculators.hazard.general.\
+site_collection_tile`.
+    """
+
+    def setUp(self):
+        self.site_coll = openquake.hazardlib.site.SiteCollection([
+            openquake.hazardlib.site.Site(
+                hazardlib_geo.Point(float(i), float(i)), 760.0 + i,
+                i % 2 == 0, 100.0 + i, 5.0 + i)
+            for i in xrange(5)])
+
+    def test_tile(self):
+        tile_coll = general.site_collection_tile(self.site_coll, slice(1, 3))
+
+        helpers.assertSiteCollectionEqual(
+            openquake.hazardlib.site.SiteCollection([
+                openquake.hazardlib.site.Site(
+                    hazardlib_geo.Point(float(i), float(i)), 760.0 + i,
+                    i % 2 == 0, 100.0 + i, 5.0 + i)
+                for i in xrange(1, 3)]),
+            tile_coll)
+        self.assertEqual(2, tile_coll.total_sites)
+        numpy.testing.assert_equal([1.0, 2.0], tile_coll.mesh.lons)
+        numpy.testing.assert_equal([1.0, 2.0], tile_coll.mesh.lats)
+        numpy.testing.assert_equal([761.0, 762.0], tile_coll.vs30)
+        numpy.testing.assert_equal([False, True], tile_coll.vs30measured)
+        numpy.testing.assert_equal([101.0, 102.0], tile_coll.z1pt0)
+        numpy.testing.assert_equal([6.0, 7.0], tile_coll.z2pt5)
+
+    def test_whole_collection(self):
+        self.assertTrue(self.site_coll is general.site_collection_tile(
+            self.site_coll, slice(0, 5)))
+
+
 class Bug1098154TestCase(unittest.TestCase):
     """
     A test to directly address
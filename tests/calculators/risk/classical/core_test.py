@@ -36,7 +36,7 @@ class ClassicalRiskCalculatorTestCase(general_test.BaseRiskCalculatorTestCase):
         self.job.save()
 
         patch = helpers.patch(
-            'openquake.engine.calculators.risk.general.write_loss_curve')
+            'openquake.engine.calculators.risk.general.write_loss_curves')
         mocked_writer = patch.start()
 
         classical.classical(*self.calculator.task_arg_gen(
@@ -44,9 +44,13 @@ class ClassicalRiskCalculatorTestCase(general_test.BaseRiskCalculatorTestCase):
 
         patch.stop()
 
+        # the loss curves of the assets of the single hazard output
+        # are written all at once
+        self.assertEqual(1, mocked_writer.call_count)
+
         # we expect 1 asset being filtered out by the region
         # constraint, so there are only two loss curves to be written
-        self.assertEqual(2, mocked_writer.call_count)
+        self.assertEqual(2, len(mocked_writer.call_args[0][2]))
 
     def test_complete_workflow(self):
         """
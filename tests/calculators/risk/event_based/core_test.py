@@ -13,6 +13,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import unittest
+
+import numpy
+
 from tests.utils import helpers
 from tests.utils.helpers import demo_file
 from tests.calculators.risk import general_test
@@ -89,12 +93,11 @@ class EventBasedRiskCalculatorTestCase(
         # specific method to write loss curves
 
         patches = [helpers.patch(x) for x in [
-            'openquake.engine.calculators.risk.general.write_loss_curve',
-            'openquake.engine.calculators.risk.general.\
-update_aggregate_losses']]
+            'openquake.engine.calculators.risk.general.write_loss_curves',
+            'openquake.engine.calculators.base.signal_task_complete']]
 
         mocked_loss_writer = patches[0].start()
-        mocked_agg_loss_writer = patches[1].start()
+        mocked_signal = patches[1].start()
 
         event_based.event_based(
             *self.calculator.task_arg_gen(self.calculator.block_size()).next())
@@ -102,12 +105,19 @@ update_aggregate_losses']]
         patches[0].stop()
         patches[1].stop()
 
-        # we expect 1 asset being filtered out by the region
-        # constraint, so there are only four loss curves (2 of them
-        # are insured) to be written
+        # the loss curves and the insured loss curves are written
+        # all at once
         self.assertEqual(2, mocked_loss_writer.call_count)
 
-        self.assertEqual(1, mocked_agg_loss_writer.call_count)
+        # the aggregate losses are sent to the control node, one
+        # (rupture_ids, losses) pair per hazard output, and the event loss
+        # table is derived from them
+        self.assertEqual(1, mocked_signal.call_count)
+        self.assertNotIn('event_loss_table', mocked_signal.call_args[1])
+        aggregate_losses = mocked_signal.call_args[1]['aggregate_losses']
+        self.assertEqual(1, len(aggregate_losses))
+        [(rupture_ids, losses)] = aggregate_losses.values()
+        self.assertEqual(len(rupture_ids), len(losses))
 
     def test_complete_workflow(self):
         """
@@ -150,3 +160,19 @@ update_aggregate_losses']]
 
         files = self.calculator.export(exports=True)
         self.assertEqual(6, len(files))
+
+
+class MergeEventLossTablesTestCase(unittest.TestCase):
+    def test_merge(self):
+        rupture_ids, losses = event_based.merge_event_loss_tables([
+            (numpy.array([3, 1]), numpy.array([1., 2.])),
+            (numpy.array([2, 3, 5]), numpy.array([4., 8., 16.]))])
+
+        numpy.testing.assert_equal([1, 2, 3, 5], rupture_ids)
+        numpy.testing.assert_allclose([2., 4., 9., 16.], losses)
+
+    def test_merge_no_tables(self):
+        rupture_ids, losses = event_based.merge_event_loss_tables([])
+
+        self.assertEqual(0, len(rupture_ids))
+        self.assertEqual(0, len(losses))
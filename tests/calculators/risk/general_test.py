@@ -144,3 +144,39 @@ class RiskCalculatorTestCase(BaseRiskCalculatorTestCase):
         self.assertEqual({'VF': 2}, self.calculator.taxonomies)
         done = stats.pk_get(self.calculator.job.id, "nrisk_done")
         self.assertEqual(0, done)
+
+
+class BulkResultWriterTestCase(unittest.TestCase):
+    def test_write_loss_maps(self):
+        assets = [mock.Mock(asset_ref='a1', value=10.),
+                  mock.Mock(asset_ref='a2', value=20.)]
+        assets[0].site.wkt = 'POINT(1 1)'
+        assets[1].site.wkt = 'POINT(2 2)'
+
+        with mock.patch('openquake.engine.writer.CopyBulkInserter') as ins:
+            with mock.patch('django.db.transaction.commit_on_success'):
+                with risk.BulkResultWriter() as result_writer:
+                    risk.write_loss_maps(
+                        result_writer, 7, assets, [0.1, 0.2],
+                        std_devs=[0.5, None])
+
+        # a single inserter for the whole table, flushed once
+        ins.assert_called_once_with(models.LossMapData)
+        self.assertEqual(
+            [mock.call(loss_map_id=7, asset_ref='a1', value=1.,
+                       std_dev=5., location='POINT(1 1)'),
+             mock.call(loss_map_id=7, asset_ref='a2', value=4.,
+                       std_dev=None, location='POINT(2 2)')],
+            ins.return_value.add_entry.call_args_list)
+        self.assertEqual(1, ins.return_value.flush.call_count)
+
+    def test_no_write_on_error(self):
+        with mock.patch('openquake.engine.writer.CopyBulkInserter') as ins:
+            try:
+                with risk.BulkResultWriter() as result_writer:
+                    result_writer.add(models.LossMapData, value=1.)
+                    raise ValueError
+            except ValueError:
+                pass
+
+        self.assertEqual(0, ins.return_value.flush.call_count)
@@ -14,8 +14,8 @@
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import numpy
 from tests.utils import helpers
+import mock
 import unittest
 import cPickle as pickle
 
@@ -75,6 +75,56 @@ class HazardCurveGetterPerAssetTestCase(unittest.TestCase):
         self.assertEqual([], values)
 
 
+class HazardCurveGetterPerAssetGetDataTestCase(unittest.TestCase):
+    """
+    Tests for the lookup of the closest hazard curves in
+    :meth:`openquake.engine.calculators.risk.hazard_getters.\
+HazardCurveGetterPerAsset.get_data`.
+    """
+
+    def _get_data(self, asset_coords, curve_rows, max_distance):
+        assets = [mock.Mock(id=i, site=mock.Mock(x=x, y=y))
+                  for i, (x, y) in enumerate(asset_coords, 1)]
+        with mock.patch('openquake.engine.db.models.HazardCurve.objects'
+                        '.get') as get:
+            get.return_value = mock.Mock(imls=[0.1, 0.2])
+            getter = hazard_getters.HazardCurveGetterPerAsset(
+                1, "PGA", assets, max_distance)
+
+        with mock.patch('openquake.engine.calculators.risk.hazard_getters'
+                        '.connection') as conn:
+            conn.cursor.return_value.fetchall.return_value = curve_rows
+            return getter.get_data()
+
+    def test_single_asset(self):
+        data = self._get_data(
+            [(10.0, 45.0)],
+            [(10.01, 45.0, [0.5, 0.4]), (11.0, 45.0, [0.9, 0.8])], 50)
+
+        self.assertEqual({1: [(0.1, 0.5), (0.2, 0.4)]}, data)
+
+    def test_assets_sharing_the_closest_site(self):
+        data = self._get_data(
+            [(10.0, 45.0), (10.02, 45.0), (10.9, 45.0)],
+            [(10.01, 45.0, [0.5, 0.4]), (11.0, 45.0, [0.9, 0.8])], 50)
+
+        self.assertEqual([1, 2, 3], data.keys())
+        self.assertEqual([(0.1, 0.5), (0.2, 0.4)], data[1])
+        self.assertEqual([(0.1, 0.5), (0.2, 0.4)], data[2])
+        self.assertEqual([(0.1, 0.9), (0.2, 0.8)], data[3])
+
+    def test_assets_beyond_max_distance(self):
+        # the second asset is about 78 km away from the only site
+        data = self._get_data(
+            [(10.0, 45.0), (11.0, 45.0)],
+            [(10.01, 45.0, [0.5, 0.4])], 10)
+
+        self.assertEqual({1: [(0.1, 0.5), (0.2, 0.4)]}, data)
+
+    def test_no_curves(self):
+        self.assertEqual({}, self._get_data([(10.0, 45.0)], [], 10))
+
+
 class GroundMotionValuesGetterTestCase(HazardCurveGetterPerAssetTestCase):
 
     hazard_demo = demo_file('event_based_hazard/job.ini')
@@ -87,13 +137,20 @@ class GroundMotionValuesGetterTestCase(HazardCurveGetterPerAssetTestCase):
         return self.job.risk_calculation.hazard_output.gmfcollection
 
     def test_call(self):
-        assets, values, missing = self.getter()
-
-        gmvs = numpy.array(values)[:, 0]
+        assets, (gmvs, rupture_ids), missing = self.getter()
 
         self.assertEqual([a.id for a in self.assets()], [a.id for a in assets])
         self.assertEqual(set(), missing)
         self.assertEqual([[0.1, 0.2, 0.3], [0.1, 0.2, 0.3]], gmvs.tolist())
+        self.assertEqual(3, len(rupture_ids))
+        self.assertEqual(sorted(rupture_ids), list(rupture_ids))
+
+    def test_filter(self):
+        self.getter.max_distance = 0.00001  # 1 cm
+        assets, (gmvs, rupture_ids), missing = self.getter()
+        self.assertEqual([], assets)
+        self.assertEqual(set([a.id for a in self.assets()]), missing)
+        self.assertEqual((0, len(rupture_ids)), gmvs.shape)
 
 
 class GroundMotionScenarioGetterTestCase(HazardCurveGetterPerAssetTestCase):
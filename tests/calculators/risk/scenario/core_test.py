@@ -69,7 +69,7 @@ class ScenarioRiskCalculatorTestCase(
         # specific method to write loss map data.
 
         patch_dbwriter = helpers.patch(
-            'openquake.engine.calculators.risk.general.write_loss_map_data',)
+            'openquake.engine.calculators.risk.general.write_loss_maps',)
         write_lossmap_mock = patch_dbwriter.start()
         scenario.scenario(
             *self.calculator.task_arg_gen(self.calculator.block_size()).next())
@@ -148,6 +148,69 @@ class NumpyListFieldTestCase(unittest.TestCase):
         self.assertEqual(pickle.loads(expected), pickle.loads(actual))
 
 
+class NumpyArrayFieldTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.field = fields.NumpyArrayField()
+
+    def test_round_trip(self):
+        value = numpy.array([[0.1, 0.2, 0.3], [6.2, 6.3, 6.7]])
+
+        pvalue = self.field.to_python(
+            buffer(self.field.get_prep_value(value)))
+
+        self.assertEqual(value.dtype, pvalue.dtype)
+        numpy.testing.assert_array_equal(value, pvalue)
+
+    def test_round_trip_compressed(self):
+        field = fields.NumpyArrayField(compress=True)
+        value = numpy.zeros((3, 4, 5), dtype=numpy.float32)
+        value[1, 2, 3] = 0.5
+
+        prep_value = field.get_prep_value(value)
+        self.assertTrue(len(prep_value) < value.nbytes)
+
+        pvalue = field.to_python(buffer(prep_value))
+        self.assertEqual(value.dtype, pvalue.dtype)
+        numpy.testing.assert_array_equal(value, pvalue)
+
+    def test_round_trip_bool(self):
+        value = numpy.array([True, False, True])
+        pvalue = self.field.to_python(str(self.field.get_prep_value(value)))
+        numpy.testing.assert_array_equal(value, pvalue)
+
+    def test_non_contiguous(self):
+        value = numpy.arange(12.).reshape((3, 4))[:, 1]
+        pvalue = self.field.to_python(str(self.field.get_prep_value(value)))
+        numpy.testing.assert_array_equal([1., 5., 9.], pvalue)
+
+    def test_to_python_read_only(self):
+        # the data is not copied, so the decoded arrays are read-only
+        value = numpy.array([[0.1, 0.2], [0.3, 0.4]])
+        for field in (self.field, fields.NumpyArrayField(compress=True)):
+            pvalue = field.to_python(buffer(field.get_prep_value(value)))
+            self.assertFalse(pvalue.flags.writeable)
+            pvalue = pvalue * 2
+            pvalue[0, 0] = 1.0
+            numpy.testing.assert_array_almost_equal(
+                [[1.0, 0.4], [0.6, 0.8]], pvalue)
+
+    def test_to_python_legacy_pickle(self):
+        value = pickle.dumps(
+            [[1, 2, 3], [4, 5, 6]], protocol=pickle.HIGHEST_PROTOCOL
+        )
+        pvalue = self.field.to_python(buffer(value))
+
+        self.assertTrue(isinstance(pvalue, numpy.ndarray))
+        numpy.testing.assert_array_equal(
+            pvalue, numpy.array([[1, 2, 3], [4, 5, 6]])
+        )
+
+    def test_none(self):
+        self.assertIsNone(self.field.to_python(None))
+        self.assertIsNone(self.field.get_prep_value(None))
+
+
 class OqNullBooleanFieldTestCase(unittest.TestCase):
 
     def test_to_python(self):
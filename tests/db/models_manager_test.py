@@ -174,17 +174,82 @@ class HazardCurveDataManagerTestCase(TestCaseWithAJob):
 
         self.assertEqual(str(locations[0]), self.a_location.wkb)
 
+    def test_individual_curves_chunks_one_location(self):
+        chunks = self.manager.individual_curves_chunks(
+            self.job, "PGA", location_block_size=1)
+
+        self.assertEqual(2, len(chunks))
+        self.assertEqual(chunks[0].stop, chunks[1].start)
+        self.assertIsNone(chunks[1].stop)
+
+        self.assertEqual([self.a_location.wkb],
+                         [str(loc) for loc in chunks[0].locations])
+        self.assertEqual([self.a_bigger_location.wkb],
+                         [str(loc) for loc in chunks[1].locations])
+
     def test_individual_curves_chunk(self):
+        start = (self.a_location.x, self.a_location.y)
+        stop = (self.a_bigger_location.x, self.a_bigger_location.y)
         curves = self.manager.individual_curves_chunk(
-            self.job, "PGA", 0, 1)
-        self.assertEqual(1, len(curves))
+            self.job, "PGA", start, stop)
+        self.assertEqual(
+            self.job.hazard_calculation.individual_curves_per_location(),
+            len(curves))
 
         curve = curves[0]
         self.assertEqual(
-            sorted(['poes', 'wkb', 'hazard_curve__lt_realization__weight']),
+            sorted(['poes', 'wkb', 'hazard_curve__lt_realization__weight',
+                    'x', 'y']),
             sorted(curve.keys()))
 
 
+class LocationPaginationTestCase(TestCaseWithAJob):
+    """
+    Test the pagination of hazard curves by location, when the last location
+    of a page has the same longitude of the first location of the next page
+    """
+    def setUp(self):
+        super(LocationPaginationTestCase, self).setUp()
+        output = models.Output.objects.create_output(
+            self.job, "fake output", "hazard_curve")
+
+        self.curves_per_location = (
+            self.job.hazard_calculation.individual_curves_per_location())
+        # 0.1 + 0.2 is not exactly printed with 15 significant digits
+        lon = 0.1 + 0.2
+        self.curves = []
+        for curve_nr in range(0, self.curves_per_location):
+            realization = models.LtRealization.objects.all()[curve_nr]
+            curve = models.HazardCurve.objects.create(
+                output=output,
+                lt_realization=realization,
+                investigation_time=10,
+                imt="PGA", imls=[1, 2, 3])
+            self.curves.append(curve)
+            for lat in (1.0, 2.0, 3.0):
+                models.HazardCurveData.objects.create(
+                    hazard_curve=curve,
+                    location=Point(lon, lat, srid=4326),
+                    poes=[lat])
+
+    def test_location_queryset_iter(self):
+        chunks = list(models.location_queryset_iter(
+            models.HazardCurveData.objects.filter(
+                hazard_curve=self.curves[0]), 2))
+
+        self.assertEqual([[1.0, 2.0], [3.0]],
+                         [[curve.poes[0] for curve in chunk]
+                          for chunk in chunks])
+
+    def test_individual_curves_chunks(self):
+        chunks = models.HazardCurveData.objects.individual_curves_chunks(
+            self.job, "PGA", location_block_size=1)
+
+        self.assertEqual(3, len(chunks))
+        for lat, chunk in zip((1.0, 2.0, 3.0), chunks):
+            self.assertEqual([[lat]] * self.curves_per_location, chunk.poes)
+
+
 class ExposureContainedInTestCase(unittest.TestCase):
     def setUp(self):
         self.job, _ = helpers.get_risk_job(
@@ -215,7 +280,7 @@ class ExposureContainedInTestCase(unittest.TestCase):
         region_constraint = Polygon(((0, 0), (0, 1), (1, 1), (1, 0), (0, 0)))
 
         results = models.ExposureData.objects.contained_in(
-            self.model.id, "test", region_constraint, 0, 10)
+            self.model.id, "test", region_constraint, 10)
 
         self.assertEqual(1, len(list(results)))
         self.assertEqual("test1", results[0].asset_ref)
@@ -225,7 +290,7 @@ class ExposureContainedInTestCase(unittest.TestCase):
             ((-1, 0), (-1, 1), (1, 1), (1, 0), (-1, 0)))
 
         results = models.ExposureData.objects.contained_in(
-            self.model.id, "test", region_constraint, 0, 10)
+            self.model.id, "test", region_constraint, 10)
 
         self.assertEqual(1, len(results))
         self.assertEqual("test1", results[0].asset_ref)
@@ -234,7 +299,23 @@ class ExposureContainedInTestCase(unittest.TestCase):
             ((179, 10), (-179, 10), (-179, -10), (179, -10), (179, 10)))
 
         results = models.ExposureData.objects.contained_in(
-            self.model.id, "test", region_constraint, 0, 10)
+            self.model.id, "test", region_constraint, 10)
 
         self.assertEqual(1, len(list(results)))
         self.assertEqual("test2", results[0].asset_ref)
+
+    def test_pagination(self):
+        region_constraint = Polygon(
+            ((0, -10), (90, -10), (179.5, -10), (179.5, 10), (90, 10),
+             (0, 10), (0, -10)))
+
+        [first] = models.ExposureData.objects.contained_in(
+            self.model.id, "test", region_constraint, 1)
+        self.assertEqual("test1", first.asset_ref)
+
+        [second] = models.ExposureData.objects.contained_in(
+            self.model.id, "test", region_constraint, 1, after=first)
+        self.assertEqual("test2", second.asset_ref)
+
+        self.assertEqual([], models.ExposureData.objects.contained_in(
+            self.model.id, "test", region_constraint, 1, after=second))
@@ -16,12 +16,16 @@
 
 import getpass
 import itertools
+import shutil
 import string
+import tempfile
 import unittest
 
 import numpy
 
 from nose.plugins.attrib import attr
+from openquake.hazardlib import geo as hazardlib_geo
+from openquake.hazardlib import site as hazardlib_site
 
 from openquake.engine import engine
 from openquake.engine import engine2
@@ -661,3 +665,79 @@ class GetSiteCollectionTestCase(unittest.TestCase):
         job_mesh = job.hazard_calculation.points_to_compute()
         self.assertTrue((job_mesh.lons == site_coll.mesh.lons).all())
         self.assertTrue((job_mesh.lats == site_coll.mesh.lats).all())
+
+    def test_get_site_collection_tile(self):
+        cfg = helpers.demo_file(
+            'simple_fault_demo_hazard/job.ini')
+        job = helpers.get_hazard_job(cfg, username=getpass.getuser())
+
+        site_coll = models.get_site_collection(job.hazard_calculation)
+        tile_coll = models.get_site_collection(
+            job.hazard_calculation, slice(2, 5))
+
+        self.assertEqual(3, len(tile_coll))
+        numpy.testing.assert_equal(site_coll.mesh.lons[2:5],
+                                   tile_coll.mesh.lons)
+        numpy.testing.assert_equal(site_coll.mesh.lats[2:5],
+                                   tile_coll.mesh.lats)
+        numpy.testing.assert_equal(site_coll.vs30[2:5], tile_coll.vs30)
+        numpy.testing.assert_equal(site_coll.z1pt0[2:5], tile_coll.z1pt0)
+        numpy.testing.assert_equal(site_coll.z2pt5[2:5], tile_coll.z2pt5)
+
+    def test_site_collection_file(self):
+        cfg = helpers.demo_file(
+            'simple_fault_demo_hazard/job.ini')
+        job = helpers.get_hazard_job(cfg, username=getpass.getuser())
+        hc = job.hazard_calculation
+        site_coll = models.get_site_collection(hc)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            with helpers.patch('openquake.engine.utils.config.get') as get:
+                get.return_value = tmp_dir
+                hc.init_site_collection()
+                self.assertIsNone(hc._site_collection)
+                self.assertIsNotNone(hc.site_collection_fingerprint)
+
+                mapped = hc.site_collection
+                # the mapping is reused
+                self.assertIs(mapped, hc.site_collection)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEqual(len(site_coll), len(mapped))
+        helpers.assertSiteCollectionEqual(site_coll, mapped)
+
+
+class SiteCollectionFromArraysTestCase(unittest.TestCase):
+    """
+    Tests for :func:`openquake.engine.db.models.site_collection_from_arrays`.
+    """
+
+    def test_same_as_site_collection(self):
+        expected = hazardlib_site.SiteCollection([
+            hazardlib_site.Site(
+                hazardlib_geo.Point(float(i), float(i)), 760.0 + i,
+                i % 2 == 0, 100.0 + i, 5.0 + i)
+            for i in xrange(3)])
+
+        site_coll = models.site_collection_from_arrays(
+            expected.mesh.lons, expected.mesh.lats, expected.vs30,
+            expected.vs30measured, expected.z1pt0, expected.z2pt5)
+
+        helpers.assertSiteCollectionEqual(expected, site_coll)
+        self.assertEqual(3, len(site_coll))
+        # the arrays are not copied
+        self.assertIs(expected.vs30, site_coll.vs30)
+
+    def test_other_attributes(self):
+        # a site collection of hazardlib with other attributes (e.g. the
+        # ids of the sites) cannot be built from the arrays
+        arrays = [numpy.zeros(2)] * 6
+        models.site_collection_from_arrays(*arrays)
+        models._SITE_COLLECTION_ATTRIBUTES.add('sids')
+        try:
+            self.assertRaises(
+                RuntimeError, models.site_collection_from_arrays, *arrays)
+        finally:
+            models._SITE_COLLECTION_ATTRIBUTES.discard('sids')
@@ -1895,8 +1895,9 @@ class LogicTreeProcessorTestCase(unittest.TestCase):
     def setUp(self):
         cfg = helpers.get_data_path('classical_job.ini')
         job = helpers.get_hazard_job(cfg)
+        self.calc_id = job.hazard_calculation.id
 
-        self.proc = logictree.LogicTreeProcessor(job.hazard_calculation.id)
+        self.proc = logictree.LogicTreeProcessor(self.calc_id)
 
     def test_sample_source_model(self):
         sm_name, branch_ids = self.proc.sample_source_model_logictree(42)
@@ -1950,6 +1951,27 @@ class LogicTreeProcessorTestCase(unittest.TestCase):
                           ['b1', 'b5', 'b8'], ['b2', 'b3']))
         self.assertRaises(StopIteration, paths.next)
 
+    def test_applies_uncertainties(self):
+        # all the paths have a maxMagGRRelative and a bGRRelative branch
+        self.assertTrue(self.proc.applies_uncertainties(['b1', 'b4', 'b7']))
+        self.assertTrue(self.proc.applies_uncertainties(['b1', 'b5', 'b8']))
+
+    def test_trees_are_cached(self):
+        other = logictree.LogicTreeProcessor(self.calc_id)
+        self.assertIs(self.proc.source_model_lt, other.source_model_lt)
+        self.assertIs(self.proc.gmpe_lt, other.gmpe_lt)
+
+    def test_parsed_paths_are_cached(self):
+        other = logictree.LogicTreeProcessor(self.calc_id)
+        self.assertIs(
+            self.proc.parse_source_model_logictree_path(['b1', 'b5', 'b8']),
+            other.parse_source_model_logictree_path(['b1', 'b5', 'b8']))
+
+        gmpes = self.proc.parse_gmpe_logictree_path(['b2', 'b3'])
+        gmpes.clear()
+        # the cached dictionary is not affected
+        self.assertEqual(2, len(other.parse_gmpe_logictree_path(['b2', 'b3'])))
+
 
 class LogicTreeProcessorParsePathTestCase(unittest.TestCase):
     def setUp(self):
@@ -304,3 +304,6 @@ class SourceDBWriterTestCase(unittest.TestCase):
             actual_poly = wkt.loads(hazardlib_poly.wkt)
 
             self.assertTrue(expected_poly.almost_equals(actual_poly))
+
+            # the weight of the source is its number of ruptures
+            self.assertEqual(hazardlib_src.count_ruptures(), ps.weight)
@@ -254,6 +254,24 @@ class InitLogsAmqpSendTestCase(unittest.TestCase):
             self.assertEqual(logging.root.level, logging.ERROR)
 
 
+class AMQPHandlerTestCase(unittest.TestCase):
+
+    def test_publish_on_shared_connection(self):
+        connection = mock.Mock()
+        with mock.patch('openquake.engine.logs.shared_connection') as shared:
+            shared.return_value = connection
+            with mock.patch('kombu.entity.Exchange'):
+                with mock.patch('kombu.messaging.Producer') as producer:
+                    handler = logs.AMQPHandler()
+
+        self.assertTrue(handler.connection is connection)
+        self.assertTrue(handler.producer is producer.return_value)
+        # the publication is retried on connection errors
+        self.assertEqual(producer.return_value.publish,
+                         connection.ensure.call_args[0][1])
+        self.assertTrue(handler.publish is connection.ensure.return_value)
+
+
 class LogPercentCompleteTestCase(unittest.TestCase):
     """Exercises the log_percent_complete() function."""
 
@@ -19,6 +19,7 @@ import unittest
 import threading
 
 import kombu
+import mock
 import kombu.entity
 import kombu.messaging
 
@@ -89,3 +90,41 @@ class AMQPMessageConsumerTestCase(unittest.TestCase):
         consumer.run()
 
         self.assertEqual(len(timeouts), 2)
+
+
+class SharedConnectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        signalling._SHARED_CONNECTION.update(pid=None, connection=None)
+
+    def tearDown(self):
+        signalling._SHARED_CONNECTION.update(pid=None, connection=None)
+
+    def test_shared_connection(self):
+        conn = signalling.shared_connection()
+        self.assertTrue(isinstance(conn, kombu.BrokerConnection))
+        # the connection is reused in the same process
+        self.assertTrue(conn is signalling.shared_connection())
+
+    def test_shared_connection_after_fork(self):
+        conn = signalling.shared_connection()
+        with mock.patch('os.getpid') as getpid:
+            getpid.return_value = -1
+            self.assertFalse(conn is signalling.shared_connection())
+
+
+class AMQPConnectTestCase(unittest.TestCase):
+
+    def test_amqp_connect(self):
+        connection = mock.Mock()
+        with mock.patch('kombu.entity.Exchange') as exchange:
+            conn, channel, exch = signalling.amqp_connect(connection)
+
+        self.assertTrue(conn is connection)
+        self.assertTrue(channel is connection.channel.return_value)
+        self.assertTrue(exch is exchange.return_value)
+        cfg = config.get_section('amqp')
+        self.assertEqual(((cfg['exchange'],),
+                          dict(type='topic', channel=channel)),
+                         exchange.call_args)
+        self.assertEqual(1, exch.declare.call_count)
@@ -432,6 +432,21 @@ def assertModelAlmostEqual(test_case, expected, actual):
             test_case.assertEqual(exp_val, act_val)
 
 
+def assertSiteCollectionEqual(expected, actual):
+    """
+    Assert that two :class:`openquake.hazardlib.site.SiteCollection`
+    objects have the same attributes, with the same values.
+    """
+    numpy.testing.assert_equal(sorted(vars(expected)), sorted(vars(actual)))
+    for name, exp_val in vars(expected).iteritems():
+        if name == 'mesh':
+            numpy.testing.assert_equal(exp_val.lons, actual.mesh.lons)
+            numpy.testing.assert_equal(exp_val.lats, actual.mesh.lats)
+            numpy.testing.assert_equal(exp_val.depths, actual.mesh.depths)
+        else:
+            numpy.testing.assert_equal(exp_val, getattr(actual, name))
+
+
 def wait_for_celery_tasks(celery_results,
                           max_wait_loops=MAX_WAIT_LOOPS,
                           wait_time=WAIT_TIME_STEP_FOR_TASK_SECS):
@@ -47,6 +47,30 @@ class SingletonTestCase(unittest.TestCase):
         self.assertTrue(instance3 is instance1)
 
 
+class LRUCacheTestCase(unittest.TestCase):
+    """Tests the behaviour of utils.general.LRUCache"""
+
+    def test_least_recently_used_is_discarded(self):
+        cache = general.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        # 'a' becomes the most recently used item
+        self.assertEqual(1, cache['a'])
+        cache['c'] = 3
+
+        self.assertEqual(2, len(cache))
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(None, cache.get('b'))
+
+    def test_clear(self):
+        cache = general.LRUCache(2)
+        cache['a'] = 1
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+
 class MemoizerTestCase(unittest.TestCase):
     """Tests the behaviour of utils.general.MemoizeMutable"""
 
@@ -149,3 +173,25 @@ class BlockSplitterTestCase(unittest.TestCase):
         ]
         actual = [x for x in block_splitter(data, 3)]
         self.assertEqual(expected, actual)
+
+
+class WeightedBlockSplitterTestCase(unittest.TestCase):
+    """Tests for :func:`openquake.engine.utils.general.\
+weighted_block_splitter`."""
+
+    def test_balanced_blocks(self):
+        blocks = general.weighted_block_splitter(
+            'abcdef', [10, 1, 1, 1, 1, 6], 2)
+        self.assertEqual([['a'], ['f', 'b', 'c', 'd', 'e']], blocks)
+
+    def test_heaviest_block_first(self):
+        blocks = general.weighted_block_splitter('abc', [1, 5, 3], 3)
+        self.assertEqual([['b'], ['c'], ['a']], blocks)
+
+    def test_more_blocks_than_data(self):
+        blocks = general.weighted_block_splitter('ab', [1, 1], 5)
+        self.assertEqual([['a'], ['b']], blocks)
+
+    def test_zero_blocks(self):
+        self.assertRaises(
+            ValueError, general.weighted_block_splitter, 'ab', [1, 1], 0)